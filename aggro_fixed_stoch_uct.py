@@ -1,60 +1,267 @@
+import threading
 import backends
-from aggro_treenode import TreeNode
-import chess
+from aggro_treenode import create_root_node
+from board_cursor import BoardCursor
+from game_position import is_white_to_move
+import transposition_table as transposition_tables
+from search_clock import SearchClock
 
 
 weak_evaluator = backends.player_model_evaluator
 strong_evaluator = backends.strong_evaluator
 
+# Values the leaves of the search, e.g. with Stockfish instead of the strong network (see leaf_evaluators.py). The
+# strong network still supplies the policies for culling the engine's own moves.
+leaf_evaluator = strong_evaluator
+
 
-playing_as_white = None
-opponent_probability_cutoff = 0.0
-engine_culling_cutoff = 0.0
 tendril_count = 16
 
-curr_position = None
+# Virtual loss: descents mark their path as pending, so the descents of one iteration spread across distinct leaves.
+# Each iteration keeps descending until it has tendril_count unique leaves or has made max_descents_per_iteration
+# descents, so the batch size is set by tendril_count rather than by how often the tree policy repeats itself.
+use_virtual_loss = True
+max_descents_per_iteration = 32
+
+# Value a pending visit counts as. Aggro leaf values are the change in win probability divided by half the moves it
+# takes, so the lowest a leaf can get is -2.0: a certain win turning into a certain loss on the first move. Searches
+# without the aggro values count pending visits as losses.
+aggro_virtual_loss_value = -2.0
+report_batch_sizes = False
+
+# Generator the chance nodes sample with. Set it to a seeded random.Random for reproducible searches; None uses the
+# random module's shared generator.
+random_generator = None
+
+# Transposition-aware search mode. Transposed move orders share search statistics and cached NN evaluations.
+use_transposition_table = False
+report_transposition_hits = False
+transposition_table = transposition_tables.shared_table
+
+# The state of the last search get_best_move started, which pondering carries on with.
+current_search = None
+
+# Time-managed searches (see get_best_move's search_limits) print their report if report_search_statistics is set, and
+# keep it in their SearchState's report either way.
+report_search_statistics = False
+max_principal_variation_length = 12
+
+
+class SearchState:
+    # The state of one search, so that several can run at once in different threads (see async_search.py). table is
+    # the transposition table to use, or None. With aggro=False, leaves are valued by their expected outcome alone, as
+    # in fixed_stoch_uct.
+
+    def __init__(self, position, own_probability_cutoff, enemy_probability_cutoff, fen_string, weak_evaluator,
+                 strong_evaluator, leaf_evaluator, table=None, aggro=True):
+        # Positions are moves played since fen_string (the empty string stands for the start of the game).
+        self.position = position
+        self.fen_string = fen_string
+        self.playing_as_white = is_white_to_move(position, fen_string)
+        self.engine_culling_cutoff = own_probability_cutoff
+        self.opponent_probability_cutoff = enemy_probability_cutoff
+        self.board_cursor = BoardCursor(position, fen_string)
+
+        self.weak_evaluator = weak_evaluator
+        self.strong_evaluator = strong_evaluator
+        self.leaf_evaluator = leaf_evaluator
+        self.table = table
+        self.aggro = aggro
+        self.virtual_loss_value = aggro_virtual_loss_value if aggro else 0.0
+
+        # The root position's evaluation as white's win probability, set when the search starts.
+        self.curr_eval = None
+
+        self.unique_leaf_counts = []
+
+        # The search clock's report, set when a time-managed search finishes.
+        self.report = ""
+
+
+def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probability_cutoff, search_session=None,
+                  search_limits=None, fen_string=""):
+    # position is the list of moves played since fen_string, or since the start of the game if fen_string is empty.
+    # With search_limits (a search_clock.SearchLimits), the search runs on its time and node limits instead of
+    # nodes_limit. Unlike fixed_stoch_uct, it doesn't stop early once the best move seems decided: aggro values have
+    # no tight bound, so a single outlying leaf can still change the best move.
+
+    # A pondering search shares the tree and the transposition table, so it has to stop first.
+    if search_session is not None:
+        search_session.stop_pondering()
+
+    table = None
+    if use_transposition_table:
+        table = transposition_table
+        table.new_search()
+
+    global current_search
+    current_search = SearchState(position, own_probability_cutoff, enemy_probability_cutoff, fen_string,
+                                 weak_evaluator, strong_evaluator, leaf_evaluator, table)
+
+    # Create tree root, or pick up the subtree explored by the previous search if there is a search session.
+    if search_session is None:
+        root_node = create_root_node(position, random_generator=random_generator, fen_string=fen_string)
+    else:
+        root_node = search_session.get_root(position, fen_string)
 
-curr_eval = None
+    # Statistics kept from the previous search get topped up rather than replaced, unless the session says otherwise.
+    if search_session is not None and not search_session.top_up_reused_statistics:
+        nodes_limit = max(0, nodes_limit - root_node.visit_count)
 
+    best_move = run_search(current_search, root_node, nodes_limit, search_limits)
 
-def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probability_cutoff):
+    if use_transposition_table and report_transposition_hits:
+        print(transposition_table.get_report())
 
-    # Assign global variables from given parameters.
-    global curr_position
-    curr_position = position
+    if report_batch_sizes:
+        print(get_batch_size_report(current_search))
 
-    global playing_as_white
-    playing_as_white = len(position) % 2 == 0
+    return best_move
 
-    global engine_culling_cutoff
-    engine_culling_cutoff = own_probability_cutoff
 
-    global opponent_probability_cutoff
-    opponent_probability_cutoff = enemy_probability_cutoff
+def run_search(search, root_node, nodes_limit, search_limits=None):
+    # Searches from root_node with search (a SearchState) and returns the best move. With search_limits, the search
+    # runs on its time and node limits instead of nodes_limit.
 
     # Get the current position's eval. We'll need it later.
-    global curr_eval
-    curr_eval = strong_evaluator.get_expected_outcome_from_moves(curr_position)
-    curr_eval = (curr_eval + 1.0) / 2.0
-
-    # Create tree root.
-    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position)
+    curr_eval = search.leaf_evaluator.get_expected_outcomes_from_moves([search.position],
+                                                                      fen_string=search.fen_string)[0]
+    search.curr_eval = (curr_eval + 1.0) / 2.0
 
-    # Perform a number of uct iterations equal to parameter nodes_limit.
-    nodes_count = 0
-    while nodes_count < nodes_limit // tendril_count:
-        perform_iteration(root_node)
-        nodes_count += 1
+    if search_limits is not None:
+        perform_timed_iterations(search, root_node, search_limits)
+    else:
+        # Perform uct iterations until nodes_limit leaves have been evaluated, as the timed searches count them.
+        nodes_count = 0
+        while nodes_count < nodes_limit:
+            nodes_count += perform_iteration(search, root_node)
 
     # Return best move found so far.
     best_move = root_node.get_best_move()
     if best_move is None:
-        best_move = get_best_legal_move(position)
+        best_move = get_best_legal_move(search)
 
     return best_move
 
 
-def perform_iteration(root_node):
+def perform_timed_iterations(search, root_node, search_limits):
+    search_clock = SearchClock(search_limits, [search.weak_evaluator, search.strong_evaluator])
+
+    while not search_clock.is_out_of_budget():
+        search_clock.node_count += perform_iteration(search, root_node)
+        if search_clock.is_out_of_budget():
+            break
+
+        search_clock.report_progress(lambda: get_best_line(search, root_node))
+
+    search_clock.report_progress(lambda: get_best_line(search, root_node), force=True)
+
+    search.report = search_clock.get_report()
+    if report_search_statistics:
+        print(search.report)
+
+
+def get_best_line(search, root_node):
+    # The principal variation follows the best move at own move nodes and the most likely reply at chance nodes.
+    principal_variation = []
+    node = root_node
+    while node.has_children() and len(principal_variation) < max_principal_variation_length:
+        if node.is_own_move(search.playing_as_white):
+            next_node = node.get_highest_value_child()
+        else:
+            next_node = node.get_most_likely_child()
+        if next_node is None:
+            break
+        node = next_node
+        principal_variation.append(node.get_move())
+
+    # Aggro values measure how fast the evaluation improves, not how likely a win is, so the reported win probability
+    # is the leaf evaluator's at the end of the principal variation.
+    if node.is_terminal(search.board_cursor):
+        return node.get_result(search.board_cursor, search.playing_as_white), principal_variation
+
+    expected_outcome = search.leaf_evaluator.get_expected_outcomes_from_moves([node.position],
+                                                                             fen_string=search.fen_string)[0]
+    win_probability = (expected_outcome + 1.0) / 2.0
+    if not search.playing_as_white:
+        win_probability = 1.0 - win_probability
+
+    return win_probability, principal_variation
+
+
+class SearchSession:
+    # Keeps the search tree between the moves of one game. When the engine is asked for its next move, the tree is
+    # re-rooted at the subtree for the (own move, opponent reply) pair that was actually played, and the rest of the
+    # old tree is dropped so it can be freed.
+    # While the opponent thinks, the session can also ponder: keep searching below the engine's own move in a
+    # background thread, so the subtree for the opponent's actual reply is already explored when it arrives.
+
+    def __init__(self, top_up_reused_statistics=True):
+        self.root_node = None
+        self.reused_visit_count = 0
+
+        # If False, visits already in the reused subtree count toward the next search's nodes_limit, so a well
+        # pondered reply gets answered almost instantly instead of being searched deeper.
+        self.top_up_reused_statistics = top_up_reused_statistics
+
+        self.ponder_thread = None
+        self.ponder_stop_event = threading.Event()
+        self.ponder_node_count = 0
+
+    def get_root(self, position, fen_string=""):
+        # The new position may be given from a later FEN than the kept tree's, as the callers only keep a few moves of
+        # history. The reused subtree is then rebased onto the new FEN.
+        self.stop_pondering()
+
+        root_node = None
+        if self.root_node is not None:
+            root_node = self.root_node.find_descendant(position, fen_string)
+
+        if root_node is None:
+            root_node = create_root_node(position, random_generator=random_generator, fen_string=fen_string)
+        else:
+            root_node = root_node.detach(position, fen_string)
+
+        self.root_node = root_node
+        self.reused_visit_count = root_node.visit_count
+        return root_node
+
+    def start_pondering(self, own_move, nodes_limit):
+        # Search below the engine's own move. That node is a chance node, so descents pick the opponent's replies
+        # according to Maia's predictions. Search settings are those of the last get_best_move call.
+        self.stop_pondering()
+        if self.root_node is None or current_search is None:
+            return
+
+        ponder_root = self.root_node.get_child_with_move(own_move)
+        if ponder_root is None:
+            return
+
+        self.ponder_stop_event.clear()
+        self.ponder_node_count = 0
+        self.ponder_thread = threading.Thread(target=self.ponder, args=(current_search, ponder_root, nodes_limit),
+                                             daemon=True)
+        self.ponder_thread.start()
+
+    def ponder(self, search, ponder_root, nodes_limit):
+        while self.ponder_node_count < nodes_limit and not self.ponder_stop_event.is_set():
+            self.ponder_node_count += perform_iteration(search, ponder_root)
+
+    def stop_pondering(self):
+        # Pondering stops between iterations, so the tree is always left in a consistent state.
+        if self.ponder_thread is None:
+            return
+        self.ponder_stop_event.set()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+
+    def clear(self):
+        self.stop_pondering()
+        self.root_node = None
+        self.reused_visit_count = 0
+
+
+def perform_iteration(search, root_node):
 
     #
     # TRAVERSAL
@@ -62,30 +269,53 @@ def perform_iteration(root_node):
 
     # Rustle up some leaf nodes to process.
 
-    # TODO: Wait, hang on a minute: won't this just keep selecting the same leaf node?
-    # No, wait, the hope here is that it will go down the tree randomly, since the select_child
-    # function has randomness when dealing with a chance node.
+    # Pending visits count as the worst value a leaf can have.
+    root_node.store.virtual_loss_value = search.virtual_loss_value
+
+    # Without virtual loss, the same leaf keeps getting selected unless a chance node's randomness sends the
+    # descent elsewhere. With it, each descent's pending visit steers the following descents to other leaves.
 
     leaf_nodes = []
-    for i in range(tendril_count):
+    seen_leaf_nodes = set()
+    pending_leaf_nodes = []
+
+    descent_limit = tendril_count
+    if use_virtual_loss:
+        descent_limit = max(tendril_count, max_descents_per_iteration)
+
+    # A chance node root (when pondering below the engine's own move) draws the first step of every descent at once.
+    first_steps = None
+    if root_node.has_children() and not root_node.is_own_move(search.playing_as_white):
+        first_steps = root_node.get_random_children(descent_limit)
+
+    descent_count = 0
+    while len(leaf_nodes) < tendril_count and descent_count < descent_limit:
         leaf_node = root_node
+        if first_steps is not None:
+            leaf_node = first_steps[descent_count]
         while leaf_node.has_children():
-            leaf_node = leaf_node.select_child(playing_as_white)
+            leaf_node = leaf_node.select_child(search.playing_as_white)
+        descent_count += 1
+
+        if use_virtual_loss:
+            leaf_node.add_pending_visit()
+            pending_leaf_nodes.append(leaf_node)
 
-        leaf_nodes.append(leaf_node)
+        if leaf_node not in seen_leaf_nodes:
+            seen_leaf_nodes.add(leaf_node)
+            leaf_nodes.append(leaf_node)
 
-    leaf_nodes = remove_list_duplicates(leaf_nodes)
+    search.unique_leaf_counts.append(len(leaf_nodes))
 
     #
     # EXPANSION
     #
 
     chance_nodes = []
-    chance_node_positions = []
 
     for index in range(len(leaf_nodes)):
         # Skip expansion if the leaf node is terminal (i.e. checkmate or draw).
-        if is_terminal_position(leaf_nodes[index].position):
+        if leaf_nodes[index].is_terminal(search.board_cursor):
             continue
 
         # Skip leaf node if it has not been visited.
@@ -94,10 +324,10 @@ def perform_iteration(root_node):
 
         # Previously visited leaf nodes get expanded.
 
-        if leaf_nodes[index].is_own_move(playing_as_white):
+        if leaf_nodes[index].is_own_move(search.playing_as_white):
             # Leaf node is an OWN MOVE node.
             # So we create children for the node and pick one of those to consider.
-            legal_moves = get_legal_moves_from_position(leaf_nodes[index].position)
+            legal_moves = get_legal_moves_from_node(search, leaf_nodes[index])
             probabilities = []
             for i in range(len(legal_moves)):
                 probabilities.append(1.0)
@@ -109,28 +339,27 @@ def perform_iteration(root_node):
             # by probability each time. Since the engine can pick any move it wants,
             # a probability of 1.0 for each move makes sense.
             leaf_nodes[index].expand_with_probability_distribution(probability_distribution)
-            leaf_nodes[index] = leaf_nodes[index].select_child(playing_as_white)
+            leaf_nodes[index] = leaf_nodes[index].select_child(search.playing_as_white)
 
             # TODO: What the hell? Wouldn't we want to append this child node to the chance_nodes list?
 
         else:
             # Leaf node is a CHANCE node. We will need to expand it to consider it.
             chance_nodes.append(leaf_nodes[index])
-            chance_node_positions.append(leaf_nodes[index].position)
 
     # Get probabilities from MAIA.
-    chance_evaluations = weak_evaluator.get_evaluations_from_moves(chance_node_positions)
+    chance_policies = get_weak_policies(search, chance_nodes)
 
     # For each CHANCE node, expand it according to MAIA's policy
     for index in range(len(chance_nodes)):
         leaf_index = leaf_nodes.index(chance_nodes[index])
-        probability_distribution = chance_evaluations[index].move_policy_list
+        probability_distribution = chance_policies[index]
 
         probability_distribution = get_simplified_probability_distribution(probability_distribution,
-                                                                           opponent_probability_cutoff)
+                                                                           search.opponent_probability_cutoff)
 
         leaf_nodes[leaf_index].expand_with_probability_distribution(probability_distribution)
-        leaf_nodes[leaf_index] = leaf_nodes[leaf_index].select_child(playing_as_white)
+        leaf_nodes[leaf_index] = leaf_nodes[leaf_index].select_child(search.playing_as_white)
 
     #
     # ROLLOUT
@@ -139,36 +368,35 @@ def perform_iteration(root_node):
     # Note: The "Rollout" phase gets its name from the typical Monte-Carlo method of randomly rolling out the rest
     # of the game randomly in order to get a value guess. In this algorithm, we can just use our strong evaluator.
 
-    positions = []
-
-    for leaf in leaf_nodes:
-        positions.append(leaf.position)
-
     # Get policy values from STRONG LEELA or STOCKFISH
-    expected_values = strong_evaluator.get_expected_outcomes_from_moves(positions)
+    expected_values = get_strong_values(search, leaf_nodes)
 
     # Get evals of these positions.
     for index in range(len(leaf_nodes)):
-        if is_terminal_position(leaf_nodes[index].position):
-            # The * 10 here in the next line is just to really make the engine give a fuck about delivering mate.
+        if leaf_nodes[index].is_terminal(search.board_cursor):
+            # The * 10 here is just to really make the engine give a fuck about delivering mate.
             # Previously, it would be similarly jazzed about a winning position and mate.
             # Even though it's supposed to care about delivering mate quickly, a boring winning position in one move
             # is still evaluated better than a mate in two, for example.
             # Really, we should probably just make a function that maps the 0-1 eval to an exponential function.
-            expected_values[index] = get_result(leaf_nodes[index].position, playing_as_white) * 10
+            expected_values[index] = leaf_nodes[index].get_result(search.board_cursor, search.playing_as_white)
+            if search.aggro:
+                expected_values[index] *= 10
         else:
             expected_values[index] = (expected_values[index] + 1.0) / 2.0
 
-            if not playing_as_white:
+            if not search.playing_as_white:
                 expected_values[index] = 1.0 - expected_values[index]  # Reverse objective value if playing as black
 
         # IMPORTANT: This is the aggro part.
         # After getting the raw expected value for the outcome, there's one more factor we care about.
         # We want to divide the eval increase by the number of moves it takes us to get there.
-        moves_it_will_take = len(leaf_nodes[index].position) - len(curr_position)
+        if not search.aggro:
+            continue
+        moves_it_will_take = len(leaf_nodes[index].position) - len(search.position)
         if moves_it_will_take == 0:
             continue
-        expected_values[index] = (expected_values[index] - curr_eval) / (moves_it_will_take / 2.0)
+        expected_values[index] = (expected_values[index] - search.curr_eval) / (moves_it_will_take / 2.0)
 
     #
     # BACKPROPAGATION
@@ -188,63 +416,54 @@ def perform_iteration(root_node):
             curr_node.visit_count += 1
             curr_node.total_value += expected_values[index]
 
-            curr_node = curr_node.parent
-
+            if curr_node.entry is not None:
+                curr_node.entry.visit_count += 1
+                curr_node.entry.total_value += expected_values[index]
 
-def get_legal_moves_from_position(moves_list):
+            curr_node = curr_node.parent
 
-    if engine_culling_cutoff <= 0.0:
-        board = chess.Board()
-        for move in moves_list:
-            board.push_uci(move)
+    for leaf_node in pending_leaf_nodes:
+        leaf_node.remove_pending_visit()
 
-        legal_moves = []
-        for legal_move in board.legal_moves:
-            legal_moves.append(legal_move.uci())
+    return len(leaf_nodes)
 
-    else:
-        evaluation = strong_evaluator.get_full_evaluation_from_moves(moves_list)
-        policies_list = evaluation.move_policy_list
 
-        # Remove the most unpromising moves.
-        policies_list = get_simplified_probability_distribution(policies_list, engine_culling_cutoff)
+def get_batch_size_report(search):
+    if len(search.unique_leaf_counts) == 0:
+        return "No iterations performed."
+    return "Unique leaves per iteration: average " \
+           + str(round(sum(search.unique_leaf_counts) / len(search.unique_leaf_counts), 2)) + ", min " \
+           + str(min(search.unique_leaf_counts)) + ", max " + str(max(search.unique_leaf_counts)) + " over " \
+           + str(len(search.unique_leaf_counts)) + " iterations (target " + str(tendril_count) + ")"
 
-        legal_moves = []
-        for policy in policies_list:
-            legal_moves.append(policy[0])
 
-    return legal_moves
+def get_weak_policies(search, nodes):
+    return transposition_tables.get_weak_policies(search.table, nodes, search.weak_evaluator, search.fen_string,
+                                                  search.board_cursor)
 
 
-def is_terminal_position(position):
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
+def get_strong_values(search, nodes):
+    return transposition_tables.get_strong_values(search.table, nodes, search.leaf_evaluator, search.fen_string,
+                                                  search.board_cursor)
 
-    outcome = board.outcome(claim_draw=True)
-    if outcome is not None:
-        return True
-    else:
-        return False
 
+def get_legal_moves_from_node(search, node):
 
-def get_result(position, is_white):
+    if search.engine_culling_cutoff <= 0.0:
+        legal_moves = node.get_legal_moves(search.board_cursor)
 
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
-    outcome = board.outcome(claim_draw=True)
-    if outcome.result() == "1-0":
-        result = 1.0
-    elif outcome.result() == "0-1":
-        result = 0.0
     else:
-        result = 0.5
+        evaluation = search.strong_evaluator.get_full_evaluation_from_moves(node.position, search.fen_string)
+        policies_list = evaluation.move_policy_list
 
-    if not is_white:
-        result = 1.0 - result
+        # Remove the most unpromising moves.
+        policies_list = get_simplified_probability_distribution(policies_list, search.engine_culling_cutoff)
+
+        legal_moves = []
+        for policy in policies_list:
+            legal_moves.append(policy[0])
 
-    return result
+    return legal_moves
 
 
 def get_simplified_probability_distribution(distribution, cutoff):
@@ -271,9 +490,9 @@ def probability_distribution_sort(entry):
 
 
 # Quickly return the legal move with the highest policy value.
-def get_best_legal_move(position):
+def get_best_legal_move(search):
 
-    evaluation = strong_evaluator.get_full_evaluation_from_moves(position)
+    evaluation = search.strong_evaluator.get_full_evaluation_from_moves(search.position, search.fen_string)
     legal_moves = evaluation.move_policy_list
     legal_moves.sort(key=probability_distribution_sort, reverse=True)
 
@@ -281,9 +500,12 @@ def get_best_legal_move(position):
 
 
 def remove_list_duplicates(input_list):
+    # Keeps the first occurrence of each element. Nodes hash by identity, so this is linear in the list length.
     output_list = []
+    seen_elements = set()
     for element in input_list:
-        if element not in output_list:
+        if element not in seen_elements:
+            seen_elements.add(element)
             output_list.append(element)
 
     return output_list
@@ -1,55 +1,223 @@
+import bisect
 import math
-import random
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from game_position import get_board
+import transposition_table as transposition_tables
+from tree_store import TreeStore, NO_NODE, BOARD_STATE_UNKNOWN, BOARD_STATE_ONGOING, BOARD_STATE_WHITE_WON, \
+    BOARD_STATE_BLACK_WON, encode_move, get_board_state
+
+
+# Nodes with at least this many children score them all in one NumPy operation instead of a Python loop, if NumPy is
+# installed. With fewer children, NumPy's per-call overhead costs more than the loop (see benchmark_uct_selection.py).
+vectorized_selection_min_children = 48
+
+# Table of the entries transposition-aware searches give the nodes.
+transposition_table = transposition_tables.shared_table
+
+
+def create_root_node(position, capacity=4096, random_generator=None, fen_string=""):
+    # Starts a new search tree for position (moves played since fen_string) and returns its root. Chance nodes sample
+    # with random_generator.
+    return TreeNode(TreeStore(position, capacity, random_generator, fen_string), 0)
 
 
 class TreeNode:
-    def __init__(self, total_value, visit_count, probability, parent=None, position=[]):
-        self.total_value = total_value
-        self.visit_count = visit_count
-        self.probability = probability
-        self.parent = parent
-        self.children = []
-        # The position is represented as a list of moves in LAN that have been made.
-        self.position = position
+    # A lightweight handle on one node of a TreeStore. Handles are created on the fly, so two handles on the same
+    # node compare and hash equal.
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, TreeNode) and self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    @property
+    def total_value(self):
+        return self.store.total_values[self.index]
+
+    @total_value.setter
+    def total_value(self, value):
+        self.store.total_values[self.index] = value
+
+    @property
+    def visit_count(self):
+        return self.store.visit_counts[self.index]
+
+    @visit_count.setter
+    def visit_count(self, value):
+        self.store.visit_counts[self.index] = value
+
+    @property
+    def probability(self):
+        return self.store.probabilities[self.index]
+
+    @property
+    def pending_visits(self):
+        return self.store.pending_visits[self.index]
+
+    @property
+    def parent(self):
+        parent_index = self.store.parents[self.index]
+        if parent_index == NO_NODE:
+            return None
+        return TreeNode(self.store, parent_index)
+
+    @property
+    def children(self):
+        return [TreeNode(self.store, child_index) for child_index in self.store.get_children(self.index)]
+
+    @property
+    def position(self):
+        # The position is represented as a list of moves in LAN that have been made since the tree's FEN (or since
+        # the start of the game if there is no FEN). Rebuilt on every access.
+        return self.store.get_position(self.index)
+
+    @property
+    def fen_string(self):
+        return self.store.fen_string
+
+    @property
+    def entry(self):
+        # Shared transposition table entry, only used by transposition-aware searches.
+        entry = self.store.entries.get(self.index)
+        if entry is None:
+            return None
+        return transposition_table.lookup(entry)
+
+    @entry.setter
+    def entry(self, value):
+        self.store.entries[self.index] = value
 
     def expand_with_probability_distribution(self, probability_distribution):
         # probability_distribution needs to be a list of tuples of the form ('move', probability)
-        for entry in probability_distribution:
-            new_node = TreeNode(total_value=0, visit_count=0, probability=entry[1],
-                                parent=self, position=self.position.copy())
-            new_node.position.append(entry[0])
-            self.add_child(new_node)
+        self.store.add_children(self.index, probability_distribution)
 
     def get_uct(self):
-        if self.visit_count <= 0:
-            return math.inf
-        else:
-            exploitation = self.total_value / self.visit_count
-            exploration = 2 * math.sqrt(math.log(self.parent.visit_count) / self.visit_count)
-            return self.probability * (exploitation + exploration)
+        return get_uct(self.store, self.index)
+
+    def add_pending_visit(self):
+        index = self.index
+        while index != NO_NODE:
+            self.store.pending_visits[index] += 1
+            index = self.store.parents[index]
+
+    def remove_pending_visit(self):
+        index = self.index
+        while index != NO_NODE:
+            self.store.pending_visits[index] -= 1
+            index = self.store.parents[index]
+
+    def get_move(self):
+        # The move that leads to this node.
+        return self.store.get_move(self.index)
 
     def get_best_move(self):
         best_child = self.get_highest_value_child()
         if best_child is None:
             return None
-        return best_child.position[len(best_child.position) - 1]
+        return self.store.get_move(best_child.index)
+
+    def load_board_state(self, board_cursor):
+        if self.store.board_states[self.index] != BOARD_STATE_UNKNOWN:
+            return
+        board = board_cursor.move_to(self.position)
+        self.store.board_states[self.index] = get_board_state(board.outcome(claim_draw=True))
+
+    def is_terminal(self, board_cursor):
+        self.load_board_state(board_cursor)
+        return self.store.board_states[self.index] != BOARD_STATE_ONGOING
+
+    def get_result(self, board_cursor, is_white):
+        self.load_board_state(board_cursor)
+        board_state = self.store.board_states[self.index]
+        if board_state == BOARD_STATE_WHITE_WON:
+            result = 1.0
+        elif board_state == BOARD_STATE_BLACK_WON:
+            result = 0.0
+        else:
+            result = 0.5
+        if not is_white:
+            result = 1.0 - result
+        return result
+
+    def get_legal_moves(self, board_cursor):
+        # Only asked for once per node, when it gets expanded, so the moves aren't kept.
+        board = board_cursor.move_to(self.position)
+        return [legal_move.uci() for legal_move in board.legal_moves]
+
+    def find_descendant(self, position, fen_string=""):
+        # Follow the moves of position down from this node. Returns None if that line hasn't been expanded.
+        if fen_string != self.store.fen_string:
+            return self.find_descendant_from_fen(position, fen_string)
+
+        own_length = self.store.get_position_length(self.index)
+        if len(position) < own_length or position[:own_length] != self.position:
+            return None
+
+        return self.follow_moves(position[own_length:])
+
+    def find_descendant_from_fen(self, position, fen_string):
+        # The position is given from another FEN, e.g. a later snapshot of the same game. Its last few moves are
+        # followed down from this node, and the node they lead to has to have the same board.
+        target_fen = get_board(position, fen_string).fen()
+        own_board = get_board(self.position, self.store.fen_string)
+
+        for move_count in range(len(position) + 1):
+            moves = position[len(position) - move_count:]
+            node = self.follow_moves(moves)
+            if node is None:
+                continue
+
+            board = own_board.copy(stack=False)
+            for move in moves:
+                board.push_uci(move)
+            if board.fen() == target_fen:
+                return node
+
+        return None
+
+    def follow_moves(self, moves):
+        node = self
+        for move in moves:
+            node = node.get_child_with_move(move)
+            if node is None:
+                return None
+        return node
+
+    def detach(self, root_position=None, fen_string=None):
+        # Returns this node as the root of a new tree holding only its subtree, so the rest of the tree can be freed.
+        # root_position and fen_string describe the node from another FEN, if the new tree should use it.
+        return TreeNode(self.store.extract_subtree(self.index, root_position, fen_string), 0)
 
     #
     # SELF-EXPLANATORY UTILITY FUNCTIONS
     #
 
+    def get_child_with_move(self, move):
+        move_code = encode_move(move)
+        for child_index in self.store.get_children(self.index):
+            if self.store.moves[child_index] == move_code:
+                return TreeNode(self.store, child_index)
+        return None
+
     def is_own_move(self, is_white):
-        white_to_play = len(self.position) % 2 == 0
+        white_to_play = self.store.is_white_to_move(self.index)
         if is_white:
             return white_to_play
         else:
             return not white_to_play
 
-    def add_child(self, child_node):
-        self.children.append(child_node)
-
     def has_children(self):
-        return len(self.children) > 0
+        return self.store.child_counts[self.index] > 0
 
     def select_child(self, is_white):
         # If it's the engine's move, get the candidate child position with the highest uct.
@@ -64,33 +232,91 @@ class TreeNode:
         if not self.has_children():
             return None
 
+        if numpy is not None and self.store.child_counts[self.index] >= vectorized_selection_min_children \
+                and not self.store.entries:
+            return TreeNode(self.store, get_child_with_highest_uct_vectorized(self.store, self.index))
+
+        store = self.store
+        if store.entries:
+            highest_uct_value = -math.inf
+            highest_uct_child = None
+            for child_index in store.get_children(self.index):
+                uct_value = get_uct(store, child_index)
+                if uct_value > highest_uct_value:
+                    highest_uct_value = uct_value
+                    highest_uct_child = child_index
+            return TreeNode(store, highest_uct_child)
+
+        # The loop of get_uct, with the parent's terms worked out once and the arrays bound to locals.
+        visit_counts = store.visit_counts
+        pending_visits = store.pending_visits
+        total_values = store.total_values
+        probabilities = store.probabilities
+        parent_visit_count = visit_counts[self.index] + pending_visits[self.index]
+        log_parent_visit_count = get_log_visit_count(parent_visit_count)
+
         highest_uct_value = -math.inf
         highest_uct_child = None
 
-        for child in self.children:
-            uct_value = child.get_uct()
+        for child_index in store.get_children(self.index):
+            visit_count = visit_counts[child_index] + pending_visits[child_index]
+            if visit_count <= 0:
+                uct_value = math.inf
+            else:
+                total_value = total_values[child_index] + pending_visits[child_index] * store.virtual_loss_value
+                exploitation = total_value / visit_count
+                exploration = 2 * math.sqrt(log_parent_visit_count / visit_count)
+                uct_value = probabilities[child_index] * (exploitation + exploration)
 
             if uct_value > highest_uct_value:
                 highest_uct_value = uct_value
-                highest_uct_child = child
+                highest_uct_child = child_index
 
-        return highest_uct_child
+        return TreeNode(store, highest_uct_child)
 
     def get_random_child(self):
         # NB: Not uniformly random, but randomly selected given the probability distribution of the children.
+        # The children's cumulative probabilities are worked out at expansion, so a sample is a bisection.
 
         if not self.has_children():
             return None
 
-        random_value = random.random()
-        for child in self.children:
-            if random_value < child.probability:
-                return child
-            else:
-                random_value -= child.probability
+        return TreeNode(self.store, self.sample_child_index(self.store.random_generator.random()))
+
+    def get_random_children(self, sample_count):
+        # Draws sample_count children at once, e.g. the first step of several descents from a chance node.
+        if not self.has_children():
+            return []
 
-        # In case no child was selected.
-        return self.children[0]
+        random_generator = self.store.random_generator
+        random_children = []
+        for i in range(sample_count):
+            random_children.append(TreeNode(self.store, self.sample_child_index(random_generator.random())))
+        return random_children
+
+    def sample_child_index(self, random_value):
+        # The first child whose cumulative probability exceeds random_value.
+        first_child = self.store.first_children[self.index]
+        end_child = first_child + self.store.child_counts[self.index]
+        child_index = bisect.bisect_right(self.store.cumulative_probabilities, random_value, first_child, end_child)
+
+        # In case no child was selected (pruned distributions can add up to less than random_value).
+        if child_index == end_child:
+            return first_child
+        return child_index
+
+    def get_most_likely_child(self):
+        if not self.has_children():
+            return None
+
+        most_likely_child = None
+        highest_probability = -math.inf
+        for child_index in self.store.get_children(self.index):
+            if self.store.probabilities[child_index] > highest_probability:
+                highest_probability = self.store.probabilities[child_index]
+                most_likely_child = child_index
+
+        return TreeNode(self.store, most_likely_child)
 
     def get_highest_value_child(self):
         if not self.has_children():
@@ -99,13 +325,81 @@ class TreeNode:
         highest_value_child = None
         highest_value_amount = -math.inf
 
-        for child in self.children:
-            if child.visit_count == 0:
+        for child_index in self.store.get_children(self.index):
+            visit_count = self.store.visit_counts[child_index]
+            if visit_count == 0:
                 continue
-            child_value = child.total_value / child.visit_count
+            child_value = self.store.total_values[child_index] / visit_count
 
             if child_value > highest_value_amount:
                 highest_value_amount = child_value
-                highest_value_child = child
+                highest_value_child = child_index
+
+        if highest_value_child is None:
+            return None
+        return TreeNode(self.store, highest_value_child)
+
+
+def get_uct(store, index):
+    # Transposed nodes share their visit and value statistics through their transposition table entry.
+    entry = store.entries.get(index) if store.entries else None
+    if entry is not None:
+        entry = transposition_table.lookup(entry)
+        visit_count = entry.visit_count
+        total_value = entry.total_value
+    else:
+        visit_count = store.visit_counts[index]
+        total_value = store.total_values[index]
+
+    pending_visits = store.pending_visits[index]
+    visit_count += pending_visits
+    total_value += pending_visits * store.virtual_loss_value
+    parent_index = store.parents[index]
+    parent_visit_count = store.visit_counts[parent_index] + store.pending_visits[parent_index]
+
+    if visit_count <= 0:
+        return math.inf
+    else:
+        exploitation = total_value / visit_count
+        exploration = 2 * math.sqrt(get_log_visit_count(parent_visit_count) / visit_count)
+        return store.probabilities[index] * (exploitation + exploration)
+
+
+def get_log_visit_count(visit_count):
+    # A parent can have no visits of its own while its children do, e.g. through transposition table entries or a
+    # fresh root, so its exploration term is taken as 0 then.
+    if visit_count > 0:
+        return math.log(visit_count)
+    return 0.0
+
+
+def get_child_with_highest_uct_vectorized(store, index):
+    # Same scores as get_uct, computed for all children at once over views of the store's arrays. The operations are
+    # the same IEEE ones in the same order, and argmax picks the first of equal scores like the loop, so both select
+    # the same child. Transposition table entries aren't supported; callers fall back to the loop when there are any.
+    first_child = store.first_children[index]
+    child_count = store.child_counts[index]
+
+    visit_counts = get_child_view(store.visit_counts, numpy.int64, first_child, child_count)
+    pending_visits = get_child_view(store.pending_visits, numpy.int64, first_child, child_count)
+    total_values = get_child_view(store.total_values, numpy.float64, first_child, child_count)
+    probabilities = get_child_view(store.probabilities, numpy.float64, first_child, child_count)
+
+    visit_counts = visit_counts + pending_visits
+    total_values = total_values + pending_visits * store.virtual_loss_value
+    parent_visit_count = store.visit_counts[index] + store.pending_visits[index]
+
+    # Unvisited children score infinity, so they are tried first.
+    scores = numpy.full(child_count, math.inf)
+    visited = visit_counts > 0
+    if visited.any():
+        visited_counts = visit_counts[visited]
+        exploitation = total_values[visited] / visited_counts
+        exploration = 2 * numpy.sqrt(get_log_visit_count(parent_visit_count) / visited_counts)
+        scores[visited] = probabilities[visited] * (exploitation + exploration)
+
+    return first_child + int(numpy.argmax(scores))
+
 
-        return highest_value_child
+def get_child_view(node_array, dtype, first_child, child_count):
+    return numpy.frombuffer(node_array, dtype, child_count, first_child * node_array.itemsize)
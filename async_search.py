@@ -0,0 +1,67 @@
+import asyncio
+import concurrent.futures
+import aggro_fixed_stoch_uct
+import backends
+from aggro_treenode import create_root_node
+from batching_evaluator import BatchingEvaluator
+
+# Asyncio front-end for the aggro and fixed stochastic UCT searches, so many searches (e.g. one per human game hosted
+# by a server process) can run from one event loop. Each search runs aggro_fixed_stoch_uct's search loop with its own
+# SearchState in a thread of this module's search executor, so a search waiting on the network or Stockfish only
+# blocks its own thread, and a single BatchingEvaluator per evaluator combines the waiting searches' positions into
+# shared backend batches.
+# At most max_concurrent_searches searches run at once; the rest wait for a free thread. Each running search waits on
+# one evaluation at a time, so this also caps how many searches share a backend batch. Set it before the first search.
+max_concurrent_searches = 64
+
+# Created on first use, with max_concurrent_searches threads. Kept apart from the event loop's default executor so
+# searches don't hold up other blocking calls, and are not capped by its thread count.
+search_executor = None
+
+# Shared by every search that doesn't bring its own evaluators. Created on first use.
+default_weak_evaluator = None
+default_strong_evaluator = None
+
+
+def get_search_executor():
+    global search_executor
+    if search_executor is None:
+        search_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_searches,
+                                                                thread_name_prefix="search")
+    return search_executor
+
+
+def get_default_evaluators():
+    global default_weak_evaluator
+    global default_strong_evaluator
+    if default_weak_evaluator is None:
+        default_weak_evaluator = BatchingEvaluator(backends.player_model_evaluator)
+        default_strong_evaluator = BatchingEvaluator(backends.strong_evaluator)
+    return default_weak_evaluator, default_strong_evaluator
+
+
+async def search(position, nodes_limit, own_probability_cutoff=.01, enemy_probability_cutoff=.02, aggro=True,
+                 weak_evaluator=None, strong_evaluator=None, random_generator=None, fen_string="",
+                 leaf_evaluator=None, search_limits=None):
+    # Returns (best move, search report) for position (the moves played since fen_string) after searching nodes_limit
+    # nodes, or on search_limits (a search_clock.SearchLimits) if given. The report is the search clock's, and empty
+    # without search_limits. With aggro=True this searches like aggro_fixed_stoch_uct, otherwise leaves are valued by
+    # their expected outcome alone, like fixed_stoch_uct.
+    # The evaluators are PositionEvaluators, and should be BatchingEvaluators to batch across searches. They default
+    # to shared batching evaluators of the backends' evaluators; leaf_evaluator defaults to strong_evaluator.
+    # Searches don't use the transposition table, which is shared by every search of a process. Searches running at
+    # once interleave their draws from the random module, so pass each one its own seeded random.Random as
+    # random_generator to make it reproducible.
+    if weak_evaluator is None or strong_evaluator is None:
+        weak_evaluator, strong_evaluator = get_default_evaluators()
+    if leaf_evaluator is None:
+        leaf_evaluator = strong_evaluator
+
+    search_state = aggro_fixed_stoch_uct.SearchState(position, own_probability_cutoff, enemy_probability_cutoff,
+                                                     fen_string, weak_evaluator, strong_evaluator, leaf_evaluator,
+                                                     aggro=aggro)
+    root_node = create_root_node(position, random_generator=random_generator, fen_string=fen_string)
+    loop = asyncio.get_running_loop()
+    best_move = await loop.run_in_executor(get_search_executor(), aggro_fixed_stoch_uct.run_search, search_state,
+                                           root_node, nodes_limit, search_limits)
+    return best_move, search_state.report
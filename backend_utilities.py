@@ -1,48 +1,54 @@
-from lczero.backends import Weights, Backend, GameState, Output
+import threading
+from collections import OrderedDict
+try:
+    from lczero.backends import Weights, Backend, GameState
+except ImportError:
+    # The bundled lc0 backend is Windows only. Elsewhere, the package still imports and can run on the heuristic
+    # evaluators (see config.EVALUATOR_BACKEND), and only loading a network fails.
+    Weights = None
+    Backend = None
+    GameState = None
+from persistent_evaluation_cache import PersistentEvaluationCache
+from game_position import is_white_to_move, PositionSnapshots, NETWORK_HISTORY_LENGTH
 
 
-class NeuralNetworkEvaluator:
-    def __init__(self, path_to_weights):
-        self.weights = Weights(path_to_weights)
-        self.backend = Backend(self.weights)
+class PositionEvaluator:
+    # Convenience methods shared by every evaluator. Subclasses only need to provide get_evaluations, which takes a
+    # batch of positions, each given as a list of moves played from fen_string (or from the start position if there
+    # is no FEN), and returns a PositionEvaluation for each of them: the expected outcome from -1 to 1 for the side to
+    # move, and the policy as a list of (move in LAN, probability) tuples over the legal moves.
+    # fen_string may also be a list with one FEN per position, so that one batch can mix positions from different
+    # games (see get_fen_strings).
+
+    # Calls this evaluator has made to a neural network backend. Evaluators that hand their positions to another
+    # process (e.g. an evaluation server) make none themselves.
+    backend_call_count = 0
+
+    def get_evaluations(self, input_moves_list, fen_string=""):
+        raise NotImplementedError
+
+    def set_path_to_weights(self, path_to_weights):
+        # Evaluators that don't use a network ignore weights files.
+        pass
 
     def get_full_evaluation_from_fen(self, fen_string):
-        game_state = GameState(fen=fen_string)
-        network_input = game_state.as_input(self.backend)
-        output = self.backend.evaluate(network_input)
-        position_evaluation = PositionEvaluation(game_state, output)
-        return position_evaluation
-
-    def get_full_evaluation_from_moves(self, input_moves):
-        game_state = GameState(moves=input_moves)
-        network_input = game_state.as_input(self.backend)
-        output = self.backend.evaluate(network_input)
-        position_evaluation = PositionEvaluation(game_state, output[0])
-        return position_evaluation
+        return self.get_evaluations([[]], fen_string)[0]
+
+    def get_full_evaluation_from_moves(self, input_moves, fen_string=""):
+        return self.get_evaluations([input_moves], fen_string)[0]
 
     def get_full_evaluation_from_both(self, fen_string="", input_moves=None):
         if input_moves is None:
             input_moves = []
 
-        game_state = GameState(fen=fen_string, moves=input_moves)
-        network_input = game_state.as_input(self.backend)
-        output = self.backend.evaluate(network_input)
-        position_evaluation = PositionEvaluation(game_state, output)
-        return position_evaluation
+        return self.get_evaluations([input_moves], fen_string)[0]
 
     def get_expected_outcome_from_fen(self, fen_string):
-        game_state = GameState(fen=fen_string)
-        network_input = game_state.as_input(self.backend)
-        output = self.backend.evaluate(network_input)
-        expected_outcome = output[0].q()
-        return expected_outcome
-
-    def get_expected_outcome_from_moves(self, input_moves, objective_evaluation=True):
-        white_to_move = len(input_moves) % 2 == 0
-        game_state = GameState(moves=input_moves)
-        network_input = game_state.as_input(self.backend)
-        output = self.backend.evaluate(network_input)
-        expected_outcome = output[0].q()
+        return self.get_full_evaluation_from_fen(fen_string).expected_outcome
+
+    def get_expected_outcome_from_moves(self, input_moves, objective_evaluation=True, fen_string=""):
+        white_to_move = is_white_to_move(input_moves, fen_string)
+        expected_outcome = self.get_full_evaluation_from_moves(input_moves, fen_string).expected_outcome
 
         if not objective_evaluation:
             return expected_outcome
@@ -52,44 +58,17 @@ class NeuralNetworkEvaluator:
             else:
                 return -expected_outcome
 
-    def get_evaluations_from_moves(self, input_moves_list):
-        nn_inputs = []
-        game_states = []
-        for move_list in input_moves_list:
-            g = GameState(moves=move_list)
-            game_states.append(g)
-            i = g.as_input(self.backend)
-            nn_inputs.append(i)
-
-        nn_outputs = self.backend.evaluate(*nn_inputs)
+    def get_evaluations_from_moves(self, input_moves_list, fen_string=""):
+        return self.get_evaluations(input_moves_list, fen_string)
 
-        position_evaluations = []
-        for index in range(len(nn_outputs)):
-            evaluation = PositionEvaluation(game_states[index], nn_outputs[index])
-            position_evaluations.append(evaluation)
-
-        return position_evaluations
-
-    def get_expected_outcomes_from_moves(self, input_moves_list, objective_evaluation=True):
-        nn_inputs = []
-        game_states = []
-        for move_list in input_moves_list:
-            g = GameState(moves=move_list)
-            game_states.append(g)
-            i = g.as_input(self.backend)
-            nn_inputs.append(i)
-
-        nn_outputs = self.backend.evaluate(*nn_inputs)
-
-        position_evaluations = []
-        for index in range(len(nn_outputs)):
-            evaluation = PositionEvaluation(game_states[index], nn_outputs[index])
-            position_evaluations.append(evaluation)
+    def get_expected_outcomes_from_moves(self, input_moves_list, objective_evaluation=True, fen_string=""):
+        position_evaluations = self.get_evaluations(input_moves_list, fen_string)
+        fen_strings = get_fen_strings(fen_string, len(input_moves_list))
 
         outcomes_list = []
 
         for index in range(len(position_evaluations)):
-            white_to_move = len(input_moves_list[index]) % 2 == 0
+            white_to_move = is_white_to_move(input_moves_list[index], fen_strings[index])
             if not objective_evaluation:
                 outcomes_list.append(position_evaluations[index].expected_outcome)
             else:
@@ -101,9 +80,206 @@ class NeuralNetworkEvaluator:
         return outcomes_list
 
 
+class NeuralNetworkEvaluator(PositionEvaluator):
+    def __init__(self, path_to_weights, cache_size=0, path_to_persistent_cache="",
+                 history_length=NETWORK_HISTORY_LENGTH):
+        self.path_to_weights = path_to_weights
+        self.path_to_persistent_cache = path_to_persistent_cache
+        self.weights = None
+        self.backend = None
+        self.persistent_cache = None
+        self.cache = EvaluationCache(cache_size)
+        self.backend_call_count = 0
+
+        # Network inputs are built from a FEN snapshot plus at most history_length moves, so building them doesn't
+        # get slower as the game goes on. None builds them from the whole move list.
+        self.history_length = history_length
+        self.snapshots = PositionSnapshots()
+
+        # Searches may run in background threads (e.g. pondering), so backend and cache access is serialised.
+        self.lock = threading.Lock()
+
+    def load_backend(self):
+        # The network is only loaded when the first position is evaluated, so importing backends stays cheap and
+        # processes that get their evaluations from elsewhere (e.g. an evaluation server) never load it.
+        if self.backend is not None:
+            return
+        if Backend is None:
+            raise RuntimeError("The lc0 backend can't be loaded on this system. Set config.EVALUATOR_BACKEND to "
+                               "\"stub\" or \"reference\" to run without networks.")
+        self.weights = Weights(self.path_to_weights)
+        self.backend = Backend(self.weights)
+        if self.path_to_persistent_cache != "":
+            self.persistent_cache = PersistentEvaluationCache(self.path_to_persistent_cache, self.path_to_weights)
+
+    def set_path_to_weights(self, path_to_weights):
+        # Switches to another network. It gets loaded on the next evaluation, and cached evaluations of the old one
+        # are dropped (the persistent cache keeps them apart by the weights file's digest).
+        with self.lock:
+            self.path_to_weights = path_to_weights
+            self.weights = None
+            self.backend = None
+            self.persistent_cache = None
+            self.cache = EvaluationCache(self.cache.capacity)
+
+    def get_evaluations(self, input_moves_list, fen_string=""):
+        with self.lock:
+            self.load_backend()
+            return self.get_evaluations_unlocked(input_moves_list, fen_string)
+
+    def get_evaluations_unlocked(self, input_moves_list, fen_string=""):
+        # Evaluates a batch of positions, each given as a list of moves played from fen_string (or from the start
+        # position if there is no FEN). Only positions missing from the caches are sent to the backend.
+        position_evaluations = [None] * len(input_moves_list)
+        fen_strings = get_fen_strings(fen_string, len(input_moves_list))
+
+        missing_keys = []
+        missing_indices = {}
+        for index in range(len(input_moves_list)):
+            # Positions are cached by the network's input, so the same position keeps its key when a search starts
+            # from a later FEN snapshot of the same game.
+            network_fen_string, network_moves = self.get_network_input(input_moves_list[index], fen_strings[index])
+            key = get_cache_key(network_fen_string, network_moves)
+
+            cached_evaluation = self.cache.get(key)
+            if cached_evaluation is not None:
+                position_evaluations[index] = cached_evaluation.copy()
+                continue
+
+            # Positions repeated within one batch are only evaluated once.
+            if key in missing_indices:
+                missing_indices[key].append(index)
+                continue
+            missing_indices[key] = [index]
+            missing_keys.append(key)
+
+        if self.persistent_cache is not None and len(missing_keys) > 0:
+            stored_evaluations = self.persistent_cache.get_many(missing_keys)
+
+            for key in stored_evaluations:
+                evaluation = PositionEvaluation(stored_evaluations[key][0], stored_evaluations[key][1])
+                self.cache.put(key, evaluation.copy())
+                for index in missing_indices[key]:
+                    position_evaluations[index] = evaluation.copy()
+
+            missing_keys = [key for key in missing_keys if key not in stored_evaluations]
+
+        if len(missing_keys) > 0:
+            nn_inputs = []
+            game_states = []
+            for key in missing_keys:
+                g = get_game_state(key[0], list(key[1]))
+                game_states.append(g)
+                nn_inputs.append(g.as_input(self.backend))
+
+            nn_outputs = self.backend.evaluate(*nn_inputs)
+            self.backend_call_count += 1
+
+            new_evaluations = []
+            for output_index in range(len(nn_outputs)):
+                evaluation = get_position_evaluation(game_states[output_index], nn_outputs[output_index])
+                key = missing_keys[output_index]
+                self.cache.put(key, evaluation.copy())
+                new_evaluations.append((key, evaluation.expected_outcome, evaluation.move_policy_list))
+
+                for index in missing_indices[key]:
+                    position_evaluations[index] = evaluation.copy()
+
+            if self.persistent_cache is not None:
+                self.persistent_cache.put_many(new_evaluations)
+
+        return position_evaluations
+
+    def get_game_state(self, input_moves, fen_string=""):
+        return get_game_state(*self.get_network_input(input_moves, fen_string))
+
+    def get_network_input(self, input_moves, fen_string=""):
+        return get_network_input(self.snapshots, input_moves, fen_string, self.history_length)
+
+
+def get_network_input(snapshots, input_moves, fen_string="", history_length=NETWORK_HISTORY_LENGTH):
+    # Returns the (fen_string, moves) a network's input is built from. The network only looks at the last few
+    # positions, so the moves before the last history_length are replaced by the FEN they lead to, found through
+    # snapshots (a game_position.PositionSnapshots). A history_length of None keeps every move.
+    if history_length is not None and len(input_moves) > history_length:
+        snapshot_length = len(input_moves) - history_length
+        fen_string = snapshots.get_fen(input_moves[:snapshot_length], fen_string)
+        input_moves = input_moves[snapshot_length:]
+    return fen_string, input_moves
+
+
+def get_game_state(fen_string, input_moves):
+    if fen_string == "":
+        return GameState(moves=input_moves)
+    return GameState(fen=fen_string, moves=input_moves)
+
+
 class PositionEvaluation:
-    def __init__(self, game_state, output):
-        self.expected_outcome = output.q()
-        moves = game_state.moves()
-        policies = output.p_softmax(*game_state.policy_indices())
-        self.move_policy_list = list(zip(moves, policies))
+    def __init__(self, expected_outcome, move_policy_list):
+        self.expected_outcome = expected_outcome
+        self.move_policy_list = move_policy_list
+
+    def copy(self):
+        # Callers are free to sort or edit the policy list, so cached evaluations are only ever handed out as copies.
+        return PositionEvaluation(self.expected_outcome, self.move_policy_list.copy())
+
+
+def get_position_evaluation(game_state, output):
+    expected_outcome = output.q()
+    moves = game_state.moves()
+    policies = output.p_softmax(*game_state.policy_indices())
+    return PositionEvaluation(expected_outcome, list(zip(moves, policies)))
+
+
+class EvaluationCache:
+    # Size-bounded LRU cache of position evaluations. A capacity of 0 disables caching.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        evaluation = self.entries.get(key)
+        if evaluation is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return evaluation
+
+    def put(self, key, evaluation):
+        if self.capacity <= 0:
+            return
+
+        self.entries[key] = evaluation
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_report(self):
+        lookups = self.hits + self.misses
+        hit_rate = 0.0
+        if lookups > 0:
+            hit_rate = self.hits / lookups * 100
+        return "Evaluation cache: " + str(len(self.entries)) + " entries, " + str(self.hits) + " hits, " \
+               + str(self.misses) + " misses (" + str(round(hit_rate, 1)) + "% hit rate), " \
+               + str(self.evictions) + " evictions"
+
+
+def get_cache_key(fen_string, input_moves):
+    # The network sees the current position and the positions before it, so two move lists only share an evaluation
+    # when they are identical from the same starting position.
+    return fen_string, tuple(input_moves)
+
+
+def get_fen_strings(fen_string, position_count):
+    # Evaluators take either one starting FEN for a whole batch or a list with one per position. Returns the list.
+    if isinstance(fen_string, str):
+        return [fen_string] * position_count
+    return fen_string
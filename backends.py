@@ -1,5 +1,22 @@
 import config
 import backend_utilities
+import heuristic_evaluators
 
-strong_evaluator = backend_utilities.NeuralNetworkEvaluator(config.PATH_TO_STRONG_WEIGHTS_FILE)
-player_model_evaluator = backend_utilities.NeuralNetworkEvaluator(config.PATH_TO_PLAYER_MODEL_WEIGHTS_FILE)
+# The evaluators every engine uses, of the kind config.EVALUATOR_BACKEND selects. Networks are only loaded when the
+# first position is evaluated.
+
+
+def get_evaluator(path_to_weights):
+    if config.EVALUATOR_BACKEND == "lc0":
+        return backend_utilities.NeuralNetworkEvaluator(path_to_weights, config.EVALUATION_CACHE_SIZE,
+                                                        config.PATH_TO_PERSISTENT_EVALUATION_CACHE)
+    elif config.EVALUATOR_BACKEND == "stub":
+        return heuristic_evaluators.StubEvaluator(config.EVALUATION_CACHE_SIZE)
+    elif config.EVALUATOR_BACKEND == "reference":
+        return heuristic_evaluators.ReferenceEvaluator()
+    else:
+        raise ValueError("unknown evaluator backend " + config.EVALUATOR_BACKEND)
+
+
+strong_evaluator = get_evaluator(config.PATH_TO_STRONG_WEIGHTS_FILE)
+player_model_evaluator = get_evaluator(config.PATH_TO_PLAYER_MODEL_WEIGHTS_FILE)
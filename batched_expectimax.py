@@ -0,0 +1,282 @@
+import math
+import backends
+from expectimaxtree import Node
+from board_cursor import BoardCursor
+from game_position import is_white_to_move
+from expectimax import get_simplified_probability_distribution, probability_distribution_sort
+
+# Expectimax that evaluates positions in batches. expectimax.py searches depth-first and sends the networks one
+# position at a time; here the tree below a group of nodes is expanded a level at a time, so that all the Maia
+# policies of a level go to the network in one batch, and all the leaf values of the group in another.
+# The search is split into such groups so that it can still prune: the root's candidate moves are searched one after
+# another, and the opponent replies to each are searched in chunks of chance_chunk_size, most likely first. Once the
+# replies left can't lift a candidate above the best one so far, they are skipped. Pruning deeper in the tree would
+# need its subtrees searched one by one, so within a chunk every value is exact. Either way the best move is the one
+# expectimax.py finds.
+
+weak_evaluator = backends.player_model_evaluator
+strong_evaluator = backends.strong_evaluator
+
+# Opponent replies to each candidate move that are searched together.
+chance_chunk_size = 8
+
+# Minimum probability for any position to be considered.
+probability_cutoff = 0.0
+
+# Cutoff when culling policy distributions.
+engine_culling_cutoff = 0.0
+
+opponent_culling_cutoff = 0.0
+
+board_cursor = None
+
+# Positions are moves played since curr_fen_string (the empty string stands for the start of the game).
+curr_fen_string = ""
+
+# Statistics of the last search: nodes visited, network calls made and the size of each batch sent. Printed after
+# every search if report_batch_sizes is set.
+report_batch_sizes = False
+node_count = 0
+batch_sizes = []
+
+
+def get_best_move(position, depth, position_probability_cutoff, move_culling_cutoff, enemy_culling_cutoff,
+                  fen_string=""):
+    global probability_cutoff
+    probability_cutoff = position_probability_cutoff
+    global engine_culling_cutoff
+    engine_culling_cutoff = move_culling_cutoff
+    global opponent_culling_cutoff
+    opponent_culling_cutoff = enemy_culling_cutoff
+    global curr_fen_string
+    curr_fen_string = fen_string
+    global board_cursor
+    board_cursor = BoardCursor(position, fen_string)
+
+    global node_count
+    global batch_sizes
+    node_count = 0
+    batch_sizes = []
+
+    root_node = Node(None, position, 1.0, 1.0, [], fen_string)
+    is_white = is_white_to_move(position, fen_string)
+
+    if root_node.is_terminal(board_cursor):
+        return None
+
+    if depth <= 0:
+        return get_best_legal_move(position)
+
+    max_child, max_value = search_root(root_node, depth, is_white)
+
+    if report_batch_sizes:
+        print(get_batch_size_report())
+
+    if max_child is None:
+        return get_best_legal_move(position)
+
+    return max_child.position[len(max_child.position) - 1]
+
+
+def search_root(root_node, depth, is_white):
+    # Returns the best child of root_node and its value, or None if root_node has no children to choose from.
+    global node_count
+    expand_own_move_nodes([root_node])
+    node_count += 1 + len(root_node.children)
+    if len(root_node.children) <= 0:
+        return None, -math.inf
+
+    if depth == 1:
+        child_values = evaluate_subtrees(root_node.children, 0, is_white)
+    else:
+        # The root's children are all the opponent's to move, so their policies go in a single batch.
+        expand_chance_nodes([child for child in root_node.children if not child.is_terminal(board_cursor)])
+        child_values = None
+
+    max_value = -math.inf
+    max_child = None
+    for index in range(len(root_node.children)):
+        child = root_node.children[index]
+        if child_values is not None:
+            child_value = child_values[index]
+        else:
+            child_value = get_chance_node_value(child, depth - 1, max_value, is_white)
+
+        if child_value > max_value:
+            max_value = child_value
+            max_child = child
+
+    return max_child, max_value
+
+
+def get_chance_node_value(node, depth, value_to_beat, is_white):
+    # Value of a node whose children have been expanded already (if it isn't a leaf), searching its children in chunks
+    # and giving up once it can't beat value_to_beat.
+    if node.is_terminal(board_cursor) or len(node.children) <= 0:
+        return evaluate_subtrees([node], 0, is_white)[0]
+
+    # Prune immediately if the sibling node is unbeatable.
+    if value_to_beat >= 1.0:
+        return 0.0
+
+    expected_value = 0.0
+    remaining_weight = 1.0
+    for chunk_start in range(0, len(node.children), chance_chunk_size):
+        # Prune if this node cannot hope to beat its sibling.
+        if expected_value + remaining_weight <= value_to_beat:
+            return 0.0
+
+        chunk = node.children[chunk_start:chunk_start + chance_chunk_size]
+        chunk_values = evaluate_subtrees(chunk, depth - 1, is_white)
+        for index in range(len(chunk)):
+            expected_value += chunk[index].local_probability * chunk_values[index]
+            remaining_weight -= chunk[index].local_probability
+
+    return expected_value
+
+
+def evaluate_subtrees(nodes, depth, is_white):
+    # Expands the tree below nodes depth levels deep, a level at a time, and returns the nodes' exact expectimax values.
+    global node_count
+
+    levels = [nodes]
+    for level in range(depth):
+        own_move_nodes = []
+        chance_nodes = []
+        for node in levels[-1]:
+            if node.is_terminal(board_cursor):
+                continue
+            if node.is_own_move(is_white):
+                own_move_nodes.append(node)
+            else:
+                chance_nodes.append(node)
+
+        expand_own_move_nodes(own_move_nodes)
+        expand_chance_nodes(chance_nodes)
+
+        next_level = []
+        for node in own_move_nodes + chance_nodes:
+            next_level.extend(node.children)
+        if len(next_level) == 0:
+            break
+        levels.append(next_level)
+
+    # Leaves are the last level, and nodes that ended the game or lost all their children to the cutoffs.
+    leaves = []
+    for level_nodes in levels[1:]:
+        node_count += len(level_nodes)
+    for level_nodes in levels:
+        for node in level_nodes:
+            if len(node.children) <= 0:
+                leaves.append(node)
+
+    values = {}
+    leaf_values = get_heuristics(leaves, is_white)
+    for index in range(len(leaves)):
+        values[leaves[index]] = leaf_values[index]
+
+    for level_nodes in reversed(levels):
+        for node in level_nodes:
+            if node in values:
+                continue
+            if node.is_own_move(is_white):
+                max_value = -math.inf
+                for child in node.children:
+                    max_value = max(max_value, values[child])
+                values[node] = max_value
+            else:
+                expected_value = 0.0
+                for child in node.children:
+                    expected_value += child.local_probability * values[child]
+                values[node] = expected_value
+
+    return [values[node] for node in nodes]
+
+
+def expand_own_move_nodes(nodes):
+    if engine_culling_cutoff <= 0.0:
+        for node in nodes:
+            legal_moves = node.get_legal_moves(board_cursor)
+            node.expand_with_probability_distribution([(move, 1.0) for move in legal_moves], probability_cutoff)
+        return
+
+    evaluations = get_evaluations(strong_evaluator, nodes)
+    for index in range(len(nodes)):
+        # Remove the most unpromising moves.
+        policies_list = get_simplified_probability_distribution(evaluations[index].move_policy_list,
+                                                                engine_culling_cutoff)
+        policies_list.sort(key=probability_distribution_sort, reverse=True)
+        nodes[index].expand_with_probability_distribution([(policy[0], 1.0) for policy in policies_list],
+                                                          probability_cutoff)
+
+
+def expand_chance_nodes(nodes):
+    evaluations = get_evaluations(weak_evaluator, nodes)
+    for index in range(len(nodes)):
+        # Simplifying here, an unsound way of saving time.
+        probability_distribution = get_simplified_probability_distribution(evaluations[index].move_policy_list,
+                                                                           opponent_culling_cutoff)
+        probability_distribution.sort(key=probability_distribution_sort, reverse=True)
+        nodes[index].expand_with_probability_distribution(probability_distribution, probability_cutoff)
+
+
+def get_heuristics(nodes, is_white):
+    # Leaf values for the engine, from 0 to 1. Finished games get their result, the rest the strong network's value.
+    heuristics = [None] * len(nodes)
+    evaluated_indices = []
+    for index in range(len(nodes)):
+        if nodes[index].is_terminal(board_cursor):
+            heuristics[index] = nodes[index].get_result(board_cursor)
+        else:
+            evaluated_indices.append(index)
+
+    evaluations = get_evaluations(strong_evaluator, [nodes[index] for index in evaluated_indices])
+    for evaluation_index in range(len(evaluated_indices)):
+        index = evaluated_indices[evaluation_index]
+        expected_outcome = evaluations[evaluation_index].expected_outcome
+        if not is_white_to_move(nodes[index].position, curr_fen_string):
+            expected_outcome = -expected_outcome
+        heuristics[index] = (expected_outcome + 1.0) / 2.0
+
+    if is_white:
+        return heuristics
+    return [1.0 - heuristic for heuristic in heuristics]
+
+
+def get_evaluations(evaluator, nodes):
+    if len(nodes) == 0:
+        return []
+    batch_sizes.append(len(nodes))
+    return evaluator.get_evaluations_from_moves([node.position for node in nodes], curr_fen_string)
+
+
+def get_batch_size_report():
+    if len(batch_sizes) == 0:
+        return "No network calls made."
+
+    # Batch sizes grouped by powers of two: 1, 2-3, 4-7, 8-15 and so on.
+    histogram = {}
+    for batch_size in batch_sizes:
+        bucket = 1 << (batch_size.bit_length() - 1)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    buckets = []
+    for bucket in sorted(histogram):
+        if bucket == 1:
+            label = "1"
+        else:
+            label = str(bucket) + "-" + str(bucket * 2 - 1)
+        buckets.append(label + ": " + str(histogram[bucket]))
+
+    return "Batched expectimax: " + str(node_count) + " nodes, " + str(len(batch_sizes)) + " network calls, " \
+           + str(sum(batch_sizes)) + " positions, batch sizes " + ", ".join(buckets)
+
+
+# Quickly return the legal move with the highest policy value.
+def get_best_legal_move(position):
+
+    evaluation = strong_evaluator.get_full_evaluation_from_moves(position, curr_fen_string)
+    legal_moves = evaluation.move_policy_list
+    legal_moves.sort(key=probability_distribution_sort, reverse=True)
+
+    return legal_moves[0][0]
@@ -0,0 +1,206 @@
+import concurrent.futures
+import functools
+import multiprocessing
+import threading
+import time
+from backend_utilities import PositionEvaluator, get_fen_strings
+
+
+class BatchingEvaluator(PositionEvaluator):
+    # Collects evaluation requests from many concurrent callers (e.g. the worker threads of async_search) and sends
+    # them to the wrapped evaluator as one large batch.
+    # A batch is flushed once it holds max_batch_size positions, or max_wait seconds after its first request.
+    # Callers that block on get_evaluations pay up to max_wait in latency, so it should stay small.
+
+    def __init__(self, evaluator, max_batch_size=256, max_wait=0.005):
+        self.evaluator = evaluator
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.condition = threading.Condition()
+        self.pending_requests = []
+        self.pending_position_count = 0
+        self.closed = False
+
+        self.batch_count = 0
+        self.position_count = 0
+        self.largest_batch = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def backend_call_count(self):
+        return self.evaluator.backend_call_count
+
+    def submit(self, input_moves_list, fen_string=""):
+        # Returns a Future that resolves to the list of PositionEvaluations for input_moves_list.
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Evaluation requested from a closed BatchingEvaluator.")
+            self.pending_requests.append((input_moves_list, fen_string, future))
+            self.pending_position_count += len(input_moves_list)
+            self.condition.notify()
+        return future
+
+    def get_evaluations(self, input_moves_list, fen_string=""):
+        return self.submit(input_moves_list, fen_string).result()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.pending_requests) == 0 and not self.closed:
+                    self.condition.wait()
+                if len(self.pending_requests) == 0 and self.closed:
+                    return
+
+                deadline = time.monotonic() + self.max_wait
+                while self.pending_position_count < self.max_batch_size and not self.closed:
+                    remaining_time = deadline - time.monotonic()
+                    if remaining_time <= 0:
+                        break
+                    self.condition.wait(remaining_time)
+
+                requests = self.pending_requests
+                self.pending_requests = []
+                self.pending_position_count = 0
+
+            self.evaluate_requests(requests)
+
+    def evaluate_requests(self, requests):
+        # Every request goes into one call, with a starting FEN per position, so games that started from different
+        # FENs (or whose searches start from later FEN snapshots) still share the backend call.
+        combined_moves_list = []
+        combined_fen_strings = []
+        for request in requests:
+            combined_moves_list.extend(request[0])
+            combined_fen_strings.extend(get_fen_strings(request[1], len(request[0])))
+
+        if len(combined_moves_list) == 0:
+            for request in requests:
+                request[2].set_result([])
+            return
+
+        try:
+            evaluations = self.evaluator.get_evaluations(combined_moves_list, combined_fen_strings)
+        except Exception as exception:
+            for request in requests:
+                request[2].set_exception(exception)
+            return
+
+        self.batch_count += 1
+        self.position_count += len(combined_moves_list)
+        self.largest_batch = max(self.largest_batch, len(combined_moves_list))
+
+        start = 0
+        for request in requests:
+            request[2].set_result(evaluations[start:start + len(request[0])])
+            start += len(request[0])
+
+    def get_report(self):
+        average_batch = 0.0
+        if self.batch_count > 0:
+            average_batch = self.position_count / self.batch_count
+        return "Batching evaluator: " + str(self.batch_count) + " batches, " + str(self.position_count) \
+               + " positions, average batch " + str(round(average_batch, 1)) + ", largest batch " \
+               + str(self.largest_batch)
+
+
+class EvaluationServer:
+    # Serves evaluations to worker processes. Requests from every worker go through one BatchingEvaluator per
+    # network, so games played side by side in different processes share large backend.evaluate calls.
+    # Workers connect with EvaluationClient(*server.get_client_arguments()), which must be passed to them when the
+    # processes are created (e.g. as ProcessPoolExecutor initializer arguments).
+
+    def __init__(self, evaluators, client_count, max_batch_size=256, max_wait=0.005, context=None):
+        # The queues have to come from the same multiprocessing context as the worker processes.
+        if context is None:
+            context = multiprocessing.get_context()
+
+        self.request_queue = context.Queue()
+        self.response_queues = []
+        for i in range(client_count):
+            self.response_queues.append(context.Queue())
+        self.next_client_id = context.Value("i", 0)
+
+        self.batching_evaluators = {}
+        for network_name in evaluators:
+            self.batching_evaluators[network_name] = BatchingEvaluator(evaluators[network_name], max_batch_size,
+                                                                       max_wait)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def get_client_arguments(self):
+        return self.request_queue, self.response_queues, self.next_client_id
+
+    def run(self):
+        while True:
+            request = self.request_queue.get()
+            if request is None:
+                return
+
+            client_id, network_name, fen_string, input_moves_list = request
+            future = self.batching_evaluators[network_name].submit(input_moves_list, fen_string)
+            future.add_done_callback(functools.partial(self.send_response, client_id))
+
+    def send_response(self, client_id, future):
+        exception = future.exception()
+        if exception is not None:
+            self.response_queues[client_id].put(exception)
+        else:
+            self.response_queues[client_id].put(future.result())
+
+    def close(self):
+        self.request_queue.put(None)
+        self.thread.join()
+        for network_name in self.batching_evaluators:
+            self.batching_evaluators[network_name].close()
+
+    def get_report(self):
+        report_lines = []
+        for network_name in self.batching_evaluators:
+            report_lines.append(network_name + ": " + self.batching_evaluators[network_name].get_report())
+        return "\n".join(report_lines)
+
+
+class EvaluationClient:
+    # One worker process's connection to an EvaluationServer.
+
+    def __init__(self, request_queue, response_queues, next_client_id):
+        with next_client_id.get_lock():
+            self.client_id = next_client_id.value
+            next_client_id.value += 1
+
+        self.request_queue = request_queue
+        self.response_queue = response_queues[self.client_id]
+
+        # Responses come back on one queue per client, so a client only has one request in flight at a time.
+        self.lock = threading.Lock()
+
+    def get_evaluations(self, network_name, input_moves_list, fen_string):
+        with self.lock:
+            self.request_queue.put((self.client_id, network_name, fen_string, input_moves_list))
+            response = self.response_queue.get()
+
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class RemoteEvaluator(PositionEvaluator):
+    # Stands in for a NeuralNetworkEvaluator in a worker process, forwarding every batch to the evaluation server.
+
+    def __init__(self, client, network_name):
+        self.client = client
+        self.network_name = network_name
+
+    def get_evaluations(self, input_moves_list, fen_string=""):
+        return self.client.get_evaluations(self.network_name, input_moves_list, fen_string)
@@ -0,0 +1,58 @@
+import sys
+import config
+
+# Compares expectimax's iterative deepening with and without ordering the moves by their values at the previous depth.
+# Each depth searched without the ordering is the same search a fixed-depth expectimax of that depth makes, so the
+# unordered columns are what the pruning cuts off today. Runs on the heuristic evaluators by default.
+# Run it with: python benchmark_expectimax_ordering.py [stub|reference|lc0]
+
+SEARCH_POSITIONS = [
+    [],
+    ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6"],
+    ["d2d4", "d7d5", "c2c4", "e7e6", "b1c3", "g8f6", "c1g5", "f8e7", "e2e3", "e8g8"],
+    ["e2e4", "d7d5", "e4d5", "d8d5", "b1c3"],
+]
+MAX_DEPTH = 4
+LINE_CUTOFF = .01
+OWN_MOVE_CUTOFF = .01
+OPPONENT_MOVE_CUTOFF = .02
+
+
+def run_searches(order_by_previous_depth):
+    # Returns the best move of each position, and the nodes searched and chance nodes pruned at each depth in total.
+    import expectimax
+    from search_clock import SearchLimits
+
+    expectimax.order_by_previous_depth = order_by_previous_depth
+    best_moves = []
+    node_counts = [0] * MAX_DEPTH
+    pruned_counts = [0] * MAX_DEPTH
+    for position in SEARCH_POSITIONS:
+        best_moves.append(expectimax.get_best_move(position, MAX_DEPTH, LINE_CUTOFF, OWN_MOVE_CUTOFF,
+                                                   OPPONENT_MOVE_CUTOFF, SearchLimits(depth=MAX_DEPTH)))
+        for depth, node_count, evaluation_count, pruned_count, completed in expectimax.depth_statistics:
+            node_counts[depth - 1] += node_count
+            pruned_counts[depth - 1] += pruned_count
+
+    expectimax.order_by_previous_depth = True
+    return best_moves, node_counts, pruned_counts
+
+
+def main():
+    config.EVALUATOR_BACKEND = "stub"
+    if len(sys.argv) > 1:
+        config.EVALUATOR_BACKEND = sys.argv[1]
+
+    unordered_moves, unordered_nodes, unordered_pruned = run_searches(False)
+    ordered_moves, ordered_nodes, ordered_pruned = run_searches(True)
+
+    print("depth  nodes unordered  nodes ordered  pruned unordered  pruned ordered  (" + config.EVALUATOR_BACKEND + ")")
+    for index in range(MAX_DEPTH):
+        print(str(index + 1).ljust(5) + str(unordered_nodes[index]).rjust(17) + str(ordered_nodes[index]).rjust(15)
+              + str(unordered_pruned[index]).rjust(18) + str(ordered_pruned[index]).rjust(16))
+    print("best moves unordered: " + " ".join(unordered_moves))
+    print("best moves ordered:   " + " ".join(ordered_moves))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import sys
+import config
+
+# Regression benchmark for expectimax's pruning: searches a fixed suite of positions with expectiminimax's alpha
+# pruning and with Star1 pruning, and compares the nodes searched and network evaluations asked for at each depth.
+# The best moves must come out the same. Runs on the heuristic evaluators by default, in about five minutes.
+# Run it with: python benchmark_expectimax_pruning.py [stub|reference|lc0]
+# On the stub evaluators, Star1 searched 96618 nodes and asked for 131517 evaluations at depth 4, against 98024 and
+# 129493 with alpha pruning. Each depth searches a new tree, so bounds kept on the nodes never helped: the counts were
+# the same without them. Cutting off windows outside 0..1 (bounded_expectiminimax's first check) saves 2200 of the
+# 133717 evaluations Star1 asks for without it, and 29 of the 176 nodes at depth 1.
+
+SEARCH_POSITIONS = [
+    [],
+    ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6"],
+    ["d2d4", "d7d5", "c2c4", "e7e6", "b1c3", "g8f6", "c1g5", "f8e7", "e2e3", "e8g8"],
+    ["e2e4", "d7d5", "e4d5", "d8d5", "b1c3"],
+    ["e2e4", "c7c5", "g1f3", "d7d6", "d2d4", "c5d4", "f3d4", "g8f6", "b1c3", "a7a6"],
+    ["f2f3", "e7e5", "g2g4"],
+]
+MAX_DEPTH = 4
+LINE_CUTOFF = .01
+OWN_MOVE_CUTOFF = .02
+OPPONENT_MOVE_CUTOFF = .03
+
+# (name, use_bounded_search)
+SEARCHES = [
+    ("alpha", False),
+    ("star1", True),
+]
+
+
+def run_searches(use_bounded_search):
+    # Returns the best move of each position, and the nodes searched and evaluations asked for at each depth in total.
+    import expectimax
+    from search_clock import SearchLimits
+
+    expectimax.use_bounded_search = use_bounded_search
+    best_moves = []
+    node_counts = [0] * MAX_DEPTH
+    evaluation_counts = [0] * MAX_DEPTH
+    for position in SEARCH_POSITIONS:
+        best_moves.append(expectimax.get_best_move(position, MAX_DEPTH, LINE_CUTOFF, OWN_MOVE_CUTOFF,
+                                                   OPPONENT_MOVE_CUTOFF, SearchLimits(depth=MAX_DEPTH)))
+        for depth, node_count, evaluation_count, pruned_count, completed in expectimax.depth_statistics:
+            node_counts[depth - 1] += node_count
+            evaluation_counts[depth - 1] += evaluation_count
+
+    expectimax.use_bounded_search = True
+    return best_moves, node_counts, evaluation_counts
+
+
+def main():
+    config.EVALUATOR_BACKEND = "stub"
+    if len(sys.argv) > 1:
+        config.EVALUATOR_BACKEND = sys.argv[1]
+
+    results = []
+    for name, use_bounded_search in SEARCHES:
+        results.append(run_searches(use_bounded_search))
+
+    print("nodes / evaluations at each depth  (" + config.EVALUATOR_BACKEND + ")")
+    print("depth" + "".join([search[0].rjust(20) for search in SEARCHES]))
+    for index in range(MAX_DEPTH):
+        line = str(index + 1).ljust(5)
+        for best_moves, node_counts, evaluation_counts in results:
+            line += (str(node_counts[index]) + " / " + str(evaluation_counts[index])).rjust(20)
+        print(line)
+
+    for index in range(len(SEARCHES)):
+        print("best moves " + SEARCHES[index][0] + ": " + " ".join(results[index][0]))
+    if any(result[0] != results[0][0] for result in results):
+        print("Best moves differ.")
+
+
+if __name__ == "__main__":
+    main()
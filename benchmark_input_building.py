@@ -0,0 +1,71 @@
+import random
+import timeit
+import chess
+import backends
+
+# Times building the network inputs for a batch of positions deep into a game, with the whole move list given to the
+# network against a FEN snapshot plus the last few moves (the evaluator's history_length). The batch looks like one
+# from a search: the game so far plus a couple of moves below it.
+# Run it with: python benchmark_input_building.py
+
+PLIES = [10, 30, 50, 75, 100, 150]
+BATCH_SIZE = 64
+BATCH_DEPTH = 2
+BATCHES_PER_TIMING = 5
+REPEATS = 5
+
+
+def get_random_game(ply_count, rng):
+    # A random game of ply_count moves that isn't over yet.
+    while True:
+        board = chess.Board()
+        while len(board.move_stack) < ply_count and board.outcome() is None:
+            board.push(rng.choice(list(board.legal_moves)))
+        if len(board.move_stack) == ply_count and board.outcome() is None:
+            return board
+
+
+def get_batch(game_board, rng):
+    batch = []
+    while len(batch) < BATCH_SIZE:
+        board = game_board.copy()
+        while len(board.move_stack) < len(game_board.move_stack) + BATCH_DEPTH and board.outcome() is None:
+            board.push(rng.choice(list(board.legal_moves)))
+        batch.append([move.uci() for move in board.move_stack])
+    return batch
+
+
+def build_inputs(evaluator, batch):
+    for input_moves in batch:
+        evaluator.get_game_state(input_moves).as_input(evaluator.backend)
+
+
+def time_batch(evaluator, batch, history_length):
+    evaluator.history_length = history_length
+    # The first batch fills the snapshot cache, as the root's evaluation does in a search.
+    build_inputs(evaluator, batch)
+    timings = timeit.repeat(lambda: build_inputs(evaluator, batch), number=BATCHES_PER_TIMING, repeat=REPEATS)
+    return min(timings) / BATCHES_PER_TIMING
+
+
+def main():
+    evaluator = backends.strong_evaluator
+    evaluator.load_backend()
+    history_length = evaluator.history_length
+
+    print("ply  full history  bounded history  (milliseconds per batch of " + str(BATCH_SIZE) + ")")
+    for ply_count in PLIES:
+        rng = random.Random(ply_count)
+        batch = get_batch(get_random_game(ply_count, rng), rng)
+
+        full_time = time_batch(evaluator, batch, None)
+        bounded_time = time_batch(evaluator, batch, history_length)
+
+        print(str(ply_count).rjust(3) + str(round(full_time * 1000, 2)).rjust(14)
+              + str(round(bounded_time * 1000, 2)).rjust(17))
+
+    evaluator.history_length = history_length
+
+
+if __name__ == "__main__":
+    main()
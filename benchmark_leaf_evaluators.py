@@ -0,0 +1,92 @@
+import random
+import chess
+import leaf_evaluators
+import player
+from search_clock import SearchLimits
+
+# Compares the leaf evaluators of the UCT engines: search speed in nodes per second on a few positions, and trial games
+# against the simulated player, in which Polecat tries to win in as few half-moves as it can.
+# Run it with: python benchmark_leaf_evaluators.py
+
+ENGINE = "aggro fixed stochastic uct"
+SEARCH_POSITIONS = [
+    [],
+    ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6"],
+    ["d2d4", "d7d5", "c2c4", "e7e6", "b1c3", "g8f6", "c1g5", "f8e7", "e2e3", "e8g8"],
+]
+SEARCH_TIME = 2.0
+TRIAL_GAMES = 4
+TRIAL_MOVE_TIME = 1.0
+TRIAL_SEED = 0
+
+
+def get_nodes_per_second():
+    # Average speed of a SEARCH_TIME search of each position.
+    search_clocks = []
+
+    def record_clock(search_clock, win_probability, principal_variation, depth):
+        search_clocks.append(search_clock)
+
+    node_count = 0
+    elapsed_time = 0.0
+    for position in SEARCH_POSITIONS:
+        board = chess.Board()
+        for move in position:
+            board.push_uci(move)
+        player.aggro_search_session.clear()
+        player.get_computer_move(board, SearchLimits(move_time=SEARCH_TIME, info_callback=record_clock))
+        node_count += search_clocks[-1].node_count
+        elapsed_time += search_clocks[-1].get_elapsed_time()
+
+    return node_count / elapsed_time
+
+
+def play_trial_games():
+    # Returns the half-move count and result of each game.
+    games = []
+    for game_index in range(TRIAL_GAMES):
+        random.seed(TRIAL_SEED * 1000003 + game_index)
+        played_game = player.play_game(play_random=False, is_computer_white=(game_index % 2 == 0))
+
+        board = chess.Board()
+        for move in played_game:
+            board.push_uci(move)
+        outcome = board.outcome(claim_draw=True)
+        result = "*"
+        if outcome is not None:
+            result = outcome.result()
+        games.append((len(played_game), result))
+
+    return games
+
+
+def main():
+    player.computer_engine = ENGINE
+    player.simulate_player = True
+    player.suppress_game_text = True
+    leaf_evaluator = player.leaf_evaluator
+    move_time = player.move_time
+    clock_time = player.clock_time
+
+    print("evaluator  nodes/s  average half-moves  results")
+    for name in leaf_evaluators.LEAF_EVALUATOR_CHOICES:
+        player.set_leaf_evaluator(name)
+        player.move_time = None
+        player.clock_time = None
+        nodes_per_second = get_nodes_per_second()
+
+        player.move_time = TRIAL_MOVE_TIME
+        games = play_trial_games()
+        half_moves = [game[0] for game in games]
+        results = [game[1] for game in games]
+
+        print(name.ljust(9) + str(round(nodes_per_second)).rjust(9)
+              + str(round(sum(half_moves) / len(half_moves), 1)).rjust(20) + "  " + " ".join(results))
+
+    player.set_leaf_evaluator(leaf_evaluator)
+    player.move_time = move_time
+    player.clock_time = clock_time
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import sys
+import chess
+import config
+
+# Measures the searches' own speed, in nodes per second, with the deterministic heuristic evaluators standing in for
+# the networks, so the time spent in the search code isn't hidden behind network evaluations. Runs anywhere
+# python-chess does: no weights or lc0 backend needed.
+# Run it with: python benchmark_search_throughput.py [stub|reference|lc0]
+
+ENGINES = ["aggro fixed stochastic uct", "fixed stochastic uct", "expectimax"]
+SEARCH_POSITIONS = [
+    [],
+    ["e2e4", "e7e5", "g1f3", "b8c6", "f1c4", "g8f6"],
+    ["d2d4", "d7d5", "c2c4", "e7e6", "b1c3", "g8f6", "c1g5", "f8e7", "e2e3", "e8g8"],
+]
+NODES_LIMIT = 4000
+EXPECTIMAX_DEPTH = 3
+
+
+def main():
+    config.EVALUATOR_BACKEND = "stub"
+    if len(sys.argv) > 1:
+        config.EVALUATOR_BACKEND = sys.argv[1]
+
+    # The evaluators are built when the engines are first imported, so this has to wait for the backend choice.
+    import player
+    from search_clock import SearchLimits
+
+    search_clocks = []
+
+    def record_clock(search_clock, win_probability, principal_variation, depth):
+        search_clocks.append(search_clock)
+
+    player.reuse_search_tree = False
+    print("engine                       nodes/s  evaluator calls per 1000 nodes  (" + config.EVALUATOR_BACKEND + ")")
+    for engine in ENGINES:
+        player.computer_engine = engine
+        node_count = 0
+        elapsed_time = 0.0
+        backend_call_count = 0
+        for position in SEARCH_POSITIONS:
+            board = chess.Board()
+            for move in position:
+                board.push_uci(move)
+            search_limits = SearchLimits(nodes_limit=NODES_LIMIT, info_callback=record_clock)
+            if engine == "expectimax":
+                search_limits = SearchLimits(depth=EXPECTIMAX_DEPTH, info_callback=record_clock)
+            player.get_computer_move(board, search_limits)
+
+            node_count += search_clocks[-1].node_count
+            elapsed_time += search_clocks[-1].get_elapsed_time()
+            backend_call_count += search_clocks[-1].get_backend_call_count()
+
+        print(engine.ljust(27) + str(round(node_count / elapsed_time)).rjust(9)
+              + str(round(backend_call_count / node_count * 1000, 1)).rjust(32))
+
+
+if __name__ == "__main__":
+    main()
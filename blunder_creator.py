@@ -1,7 +1,8 @@
 import backends
 import stockfish_utility
 from treenode import TreeNode
-import chess
+from board_cursor import BoardCursor
+from game_position import get_board, is_white_to_move
 
 
 weak_evaluator = backends.player_model_evaluator
@@ -11,25 +12,48 @@ playing_as_white = None
 engine_culling = .02
 opponent_culling = .02
 
+# Most positions sent to a network in one call. The leaves of a search go in as few calls as this allows.
+evaluation_batch_size = 256
 
-def get_best_move(position):
+# Most replies the beam search keeps for each of the opponent's positions, however flat Maia's policy is, so that the
+# size of each level is bounded.
+beam_reply_limit = 8
+
+board_cursor = None
+
+# Positions are moves played since curr_fen_string (the empty string stands for the start of the game).
+curr_fen_string = ""
+
+
+def get_best_move(position, fen_string=""):
 
     # e4 player for sharper positions. Consider this an opening book.
-    if len(position) == 0:
+    if len(position) == 0 and fen_string == "":
         return 'e2e4'
 
+    global curr_fen_string
+    curr_fen_string = fen_string
+
     global playing_as_white
-    playing_as_white = len(position) % 2 == 0
+    playing_as_white = is_white_to_move(position, fen_string)
+
+    global board_cursor
+    board_cursor = BoardCursor(position, fen_string)
+
+    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position, fen_string=fen_string)
+    if root_node.is_terminal(board_cursor):
+        return None
+
+    # The root's value and its candidate moves come from a single strong network evaluation.
+    root_evaluation = strong_evaluator.get_full_evaluation_from_moves(position, fen_string)
 
     # Select engine
-    current_value = get_position_value(position)
+    current_value = (root_evaluation.expected_outcome + 1.0) / 2.0
     if current_value > .9:
-        return stockfish_utility.get_best_move(position)
-
-    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position)
+        return stockfish_utility.get_best_move(position, fen_string)
 
     # Expand root node with candidate moves.
-    legal_moves = get_engine_moves(position)
+    legal_moves = get_engine_moves(root_node, root_evaluation)
     probabilities = []
     for i in range(len(legal_moves)):
         probabilities.append(1.0)
@@ -43,7 +67,7 @@ def get_best_move(position):
     for child in children:
         positions.append(child.position)
 
-    evaluations = weak_evaluator.get_evaluations_from_moves(positions)
+    evaluations = weak_evaluator.get_evaluations_from_moves(positions, fen_string)
 
     leaf_nodes = []
 
@@ -56,17 +80,19 @@ def get_best_move(position):
         children[index].expand_with_probability_distribution(probability_distribution)
         leaf_nodes.extend(children[index].children)
 
-    # Evaluate each player response node and propagate its value upward.
-    for leaf in leaf_nodes:
-        leaf_value = get_position_value(leaf.position)
-        leaf.total_value = leaf_value
+    # Evaluate the player response nodes together and propagate their values upward. The leaves are visited in tree
+    # order, so the board cursor only pushes and pops the last move or two to check each one for the end of the game.
+    leaf_values = get_node_values(leaf_nodes)
+    for index in range(len(leaf_nodes)):
+        leaf = leaf_nodes[index]
+        leaf.total_value = leaf_values[index]
 
-        leaf.parent.total_value += leaf_value * leaf.probability
+        leaf.parent.total_value += leaf_values[index] * leaf.probability
 
     # Set values of candidate moves that are terminal nodes.
     for child in children:
-        if is_terminal_position(child.position):
-            result = get_result(child.position)
+        if child.is_terminal(board_cursor):
+            result = child.get_result(board_cursor, playing_as_white)
             child.total_value = result
             if child.total_value >= 1.0:
                 child.total_value = 100
@@ -80,93 +106,203 @@ def get_best_move(position):
             max_child = child
             max_value = child.total_value
 
-    return max_child.position[len(max_child.position) - 1]
+    return max_child.get_move()
 
 
-def get_legal_moves(position):
+def get_best_move_beam(position, depth, beam_width, reply_probability_mass, fen_string=""):
+    # Beam search variant, depth plies deep (depth 2 searches as deep as get_best_move). The tree grows a level at a
+    # time: each of the engine's positions keeps its beam_width most valuable moves, and each of the opponent's keeps
+    # Maia's most likely replies up to reply_probability_mass, and no more than beam_reply_limit. Every level is
+    # evaluated with one batch per network, so a move costs about depth strong network calls and half as many Maia
+    # calls, whatever the position.
 
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
+    # e4 player for sharper positions. Consider this an opening book.
+    if len(position) == 0 and fen_string == "":
+        return 'e2e4'
 
-    legal_moves = []
-    for legal_move in board.legal_moves:
-        legal_moves.append(legal_move.uci())
+    global curr_fen_string
+    curr_fen_string = fen_string
 
-    return legal_moves
+    global playing_as_white
+    playing_as_white = is_white_to_move(position, fen_string)
 
+    global board_cursor
+    board_cursor = BoardCursor(position, fen_string)
 
-def get_engine_moves(moves_list):
+    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position, fen_string=fen_string)
+    if root_node.is_terminal(board_cursor):
+        return None
 
-    if engine_culling <= 0.0:
-        board = chess.Board()
-        for move in moves_list:
-            board.push_uci(move)
+    root_evaluation = strong_evaluator.get_full_evaluation_from_moves(position, fen_string)
 
-        legal_moves = []
-        for legal_move in board.legal_moves:
-            legal_moves.append(legal_move.uci())
+    # Select engine
+    current_value = (root_evaluation.expected_outcome + 1.0) / 2.0
+    if current_value > .9:
+        return stockfish_utility.get_best_move(position, fen_string)
+
+    # Evaluations whose policies expand the nodes of the level being expanded: the strong network's for the engine's
+    # positions and Maia's for the opponent's.
+    evaluations = {root_node: root_evaluation}
+
+    levels = [[root_node]]
+    for ply in range(depth):
+        next_level = []
+        for node in levels[-1]:
+            if node not in evaluations:
+                continue
+            if node.is_own_move(playing_as_white):
+                legal_moves = get_engine_moves(node, evaluations[node])
+                node.expand_with_probability_distribution([(move, 1.0) for move in legal_moves])
+            else:
+                node.expand_with_probability_distribution(
+                    get_most_likely_moves(evaluations[node].move_policy_list, reply_probability_mass))
+            next_level.extend(node.children)
+
+        if len(next_level) == 0:
+            break
+
+        evaluations = {}
+        values, strong_evaluations = get_node_evaluations(next_level)
+        for index in range(len(next_level)):
+            next_level[index].total_value = values[index]
+            if strong_evaluations[index] is not None:
+                evaluations[next_level[index]] = strong_evaluations[index]
+
+        # Keep the most valuable moves of each of the engine's positions.
+        for node in levels[-1]:
+            if node.is_own_move(playing_as_white) and len(node.children) > beam_width:
+                node.children.sort(key=get_total_value, reverse=True)
+                node.truncate_children(beam_width)
+        next_level = [child for node in levels[-1] for child in node.children]
+
+        # The opponent's positions that get expanded at the next level need Maia's policy.
+        if ply < depth - 1:
+            chance_nodes = [node for node in next_level
+                            if node in evaluations and not node.is_own_move(playing_as_white)]
+            maia_evaluations = get_evaluations_in_batches(weak_evaluator, chance_nodes)
+            for index in range(len(chance_nodes)):
+                evaluations[chance_nodes[index]] = maia_evaluations[index]
+
+        levels.append(next_level)
+
+    # Propagate the values up the tree: the engine takes its best move, and the opponent's replies are averaged.
+    for level in reversed(levels[1:-1]):
+        for node in level:
+            if len(node.children) <= 0:
+                continue
+            if node.is_own_move(playing_as_white):
+                node.total_value = max(get_total_value(child) for child in node.children)
+            else:
+                node.total_value = sum(child.total_value * child.probability for child in node.children)
 
-    else:
-        evaluation = strong_evaluator.get_full_evaluation_from_moves(moves_list)
-        policies_list = evaluation.move_policy_list
+    children = root_node.children
+    if len(children) <= 0:
+        return get_best_legal_move(root_evaluation)
 
-        # Remove the most unpromising moves.
-        policies_list = get_simplified_probability_distribution(policies_list, engine_culling)
+    # Play a mate on the board straight away.
+    for child in children:
+        if child.is_terminal(board_cursor) and child.total_value >= 1.0:
+            child.total_value = 100
 
-        legal_moves = []
-        for policy in policies_list:
-            legal_moves.append(policy[0])
+    max_child = max(children, key=get_total_value)
+    return max_child.get_move()
 
-    return legal_moves
 
+def get_total_value(node):
+    return node.total_value
 
-def get_position_value(position):
 
-    if is_terminal_position(position):
-        return get_result(position)
+def get_most_likely_moves(distribution, probability_mass):
+    # The most likely moves of distribution that together make up probability_mass, renormalized.
+    distribution = sorted(distribution, key=lambda element: element[1], reverse=True)
 
-    position_as_list = [position]
+    new_distribution = []
+    new_distribution_sum = 0.0
+    for element in distribution:
+        if new_distribution_sum >= probability_mass or len(new_distribution) >= beam_reply_limit:
+            break
+        new_distribution.append(element)
+        new_distribution_sum += element[1]
 
-    value = strong_evaluator.get_expected_outcomes_from_moves(position_as_list)[0]
+    return [(element[0], element[1] / new_distribution_sum) for element in new_distribution]
 
-    value = (value + 1.0) / 2.0
 
-    if playing_as_white:
-        return value
-    else:
-        return 1.0 - value
+def get_best_legal_move(evaluation):
+    # Move with the highest policy value, for when the cutoffs leave no candidate moves.
+    return max(evaluation.move_policy_list, key=lambda element: element[1])[0]
 
 
-def is_terminal_position(position):
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
+def get_legal_moves(position, fen_string=""):
+
+    board = get_board(position, fen_string)
+
+    legal_moves = []
+    for legal_move in board.legal_moves:
+        legal_moves.append(legal_move.uci())
+
+    return legal_moves
 
-    outcome = board.outcome(claim_draw=True)
-    if outcome is not None:
-        return True
-    else:
-        return False
 
+def get_engine_moves(node, evaluation=None):
+    # evaluation is the strong network's evaluation of node, if it has been evaluated already.
 
-def get_result(position):
+    if engine_culling <= 0.0:
+        legal_moves = node.get_legal_moves(board_cursor)
 
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
-    outcome = board.outcome(claim_draw=True)
-    if outcome.result() == "1-0":
-        result = 1.0
-    elif outcome.result() == "0-1":
-        result = 0.0
     else:
-        result = 0.5
+        if evaluation is None:
+            evaluation = strong_evaluator.get_full_evaluation_from_moves(node.position, curr_fen_string)
+        policies_list = evaluation.move_policy_list
+
+        # Remove the most unpromising moves.
+        policies_list = get_simplified_probability_distribution(policies_list, engine_culling)
+
+        legal_moves = []
+        for policy in policies_list:
+            legal_moves.append(policy[0])
+
+    return legal_moves
 
-    if not playing_as_white:
-        result = 1.0 - result
 
-    return result
+def get_node_values(nodes):
+    return get_node_evaluations(nodes)[0]
+
+
+def get_node_evaluations(nodes):
+    # Win probabilities of nodes for the side the engine plays, and the strong network's evaluations of them (None
+    # for finished games). Positions that need the network are evaluated in batches of up to evaluation_batch_size.
+    values = [None] * len(nodes)
+    evaluations = [None] * len(nodes)
+    evaluated_nodes = []
+    evaluated_indices = []
+    for index in range(len(nodes)):
+        if nodes[index].is_terminal(board_cursor):
+            values[index] = nodes[index].get_result(board_cursor, playing_as_white)
+        else:
+            evaluated_nodes.append(nodes[index])
+            evaluated_indices.append(index)
+
+    network_evaluations = get_evaluations_in_batches(strong_evaluator, evaluated_nodes)
+    for evaluation_index in range(len(evaluated_indices)):
+        index = evaluated_indices[evaluation_index]
+        evaluation = network_evaluations[evaluation_index]
+
+        # Expected outcomes are for the side to move.
+        value = (evaluation.expected_outcome + 1.0) / 2.0
+        if not nodes[index].is_own_move(playing_as_white):
+            value = 1.0 - value
+        values[index] = value
+        evaluations[index] = evaluation
+
+    return values, evaluations
+
+
+def get_evaluations_in_batches(evaluator, nodes):
+    evaluations = []
+    for batch_start in range(0, len(nodes), evaluation_batch_size):
+        batch_positions = [node.position for node in nodes[batch_start:batch_start + evaluation_batch_size]]
+        evaluations.extend(evaluator.get_evaluations_from_moves(batch_positions, curr_fen_string))
+    return evaluations
 
 
 def get_simplified_probability_distribution(distribution, cutoff):
@@ -0,0 +1,50 @@
+import chess
+import chess.polyglot
+from game_position import get_board
+
+
+class BoardCursor:
+    # A single board that walks around a search tree by pushing and popping moves, so that a node's board state
+    # can be found in time proportional to its depth in the tree rather than to the length of the game.
+
+    def __init__(self, position, fen_string=""):
+        # The position is represented as a list of moves in LAN that have been made since fen_string (or since the
+        # start of the game if there is no FEN).
+        self.board = get_board(position, fen_string)
+
+        self.root_length = len(position)
+
+        # Moves pushed on top of the root position, in order.
+        self.path = []
+
+    def move_to(self, position):
+        # Pop back to the deepest common ancestor of the current and requested positions, then push the rest.
+        target_path = position[self.root_length:]
+
+        common_length = 0
+        while common_length < len(self.path) and common_length < len(target_path) \
+                and self.path[common_length] == target_path[common_length]:
+            common_length += 1
+
+        while len(self.path) > common_length:
+            self.board.pop()
+            self.path.pop()
+
+        for move in target_path[common_length:]:
+            self.board.push(chess.Move.from_uci(move))
+            self.path.append(move)
+
+        return self.board
+
+    def get_zobrist_key(self, position):
+        return chess.polyglot.zobrist_hash(self.move_to(position))
+
+
+def get_outcome_value(outcome):
+    # Objective value of a finished game, from white's perspective.
+    if outcome.result() == "1-0":
+        return 1.0
+    elif outcome.result() == "0-1":
+        return 0.0
+    else:
+        return 0.5
@@ -1,8 +1,27 @@
 
 # Trial settings:
 NUMBER_OF_TRIALS = 6
+NUMBER_OF_TRIAL_WORKERS = 4
+TRIAL_SEED = 0
+PATH_TO_TRIAL_RESULTS = "./trial_results.csv"
+
+# Batch network evaluations from all of parallel_trial.py's worker processes in one evaluation server.
+USE_EVALUATION_SERVER = True
+EVALUATION_BATCH_SIZE = 256
+EVALUATION_BATCH_DEADLINE = 0.005
 
 # Engine settings:
 PATH_TO_STOCKFISH = "./Stockfish/stockfish_14.1_win_x64/stockfish_14.1_win_x64.exe"
+# Stockfish processes each process keeps for searching positions in parallel.
+STOCKFISH_POOL_SIZE = 4
 PATH_TO_STRONG_WEIGHTS_FILE = "./Neural Net Weights Files/752187.pb.gz"
 PATH_TO_PLAYER_MODEL_WEIGHTS_FILE = "./Neural Net Weights Files/maia-1700.pb.gz"
+# Evaluators for the strong and player model networks: "lc0" evaluates the networks above; "stub" and "reference" use a
+# deterministic material and mobility heuristic instead (see heuristic_evaluators.py), which needs no weights or lc0
+# backend, for running and profiling the searches anywhere. "stub" is the fast one.
+EVALUATOR_BACKEND = "lc0"
+TRANSPOSITION_TABLE_SIZE = 200000
+EVALUATION_CACHE_SIZE = 100000
+
+# Evaluation cache shared between runs and processes. Leave empty to disable it.
+PATH_TO_PERSISTENT_EVALUATION_CACHE = ""
@@ -1,30 +1,36 @@
 import backends
-import chess
 import math
 from expectimaxtree import Node
+from board_cursor import BoardCursor
+from game_position import is_white_to_move
+from search_clock import SearchClock
 
 weak_evaluator = backends.player_model_evaluator
 strong_evaluator = backends.strong_evaluator
 
 
+class SearchTimeout(Exception):
+    # Raised inside a time-managed search when its limits run out, to abandon the depth being searched.
+    pass
+
+
 def expectiminimax(node, depth, value_to_beat, is_white):
-    if is_terminal_position(node.position) or depth <= 0:
-        heuristic = get_heuristic(node.position, is_white)
-        return heuristic
+    if search_clock is not None:
+        search_clock.node_count += 1
+        if search_clock.is_out_of_budget():
+            raise SearchTimeout()
+
+    if node.is_terminal(board_cursor) or depth <= 0:
+        heuristic = get_heuristic(node, is_white)
+        return record_value(node, heuristic)
 
     if node.is_own_move(is_white):
-        # Expand node
-        legal_moves = get_legal_moves_from_position(node.position)
-        probabilities = []
-        for i in range(len(legal_moves)):
-            probabilities.append(1.0)
-        probability_distribution = list(zip(legal_moves, probabilities))
-        node.expand_with_probability_distribution(probability_distribution, probability_cutoff)
+        expand_own_move_node(node)
 
         # Node expansion may not produce any children due to the probability cutoff.
         if len(node.children) <= 0:
-            heuristic = get_heuristic(node.position, is_white)
-            return heuristic
+            heuristic = get_heuristic(node, is_white)
+            return record_value(node, heuristic)
 
         # Get maximum child
         max_value = -math.inf
@@ -33,28 +39,19 @@ def expectiminimax(node, depth, value_to_beat, is_white):
             if child_value > max_value:
                 max_value = child_value
 
-        return max_value
+        return record_value(node, max_value)
 
     else:
         # Prune immediately if the sibling node is unbeatable.
         if value_to_beat >= 1.0:
-            return 0.0
-
-        # Expand node
-        evaluation = weak_evaluator.get_full_evaluation_from_moves(node.position)
-        probability_distribution = evaluation.move_policy_list
+            return record_pruned_value(node)
 
-        # Simplifying here, an unsound way of saving time.
-        probability_distribution = get_simplified_probability_distribution(probability_distribution,
-                                                                           opponent_culling_cutoff)
-
-        probability_distribution.sort(key=probability_distribution_sort, reverse=True)
-        node.expand_with_probability_distribution(probability_distribution, probability_cutoff)
+        expand_chance_node(node)
 
         # Node expansion may not produce any children due to the probability cutoff.
         if len(node.children) <= 0:
-            heuristic = get_heuristic(node.position, is_white)
-            return heuristic
+            heuristic = get_heuristic(node, is_white)
+            return record_value(node, heuristic)
 
         # Get expected value
         expected_value = 0.0
@@ -64,14 +61,122 @@ def expectiminimax(node, depth, value_to_beat, is_white):
 
             # Prune if this node cannot hope to beat its sibling.
             if max_possible_value <= value_to_beat:
-                return 0.0
+                return record_pruned_value(node)
 
             child_contribution = child.local_probability * expectiminimax(child, depth - 1, 0.0, is_white)
             expected_value += child_contribution
 
             remaining_weight -= child.local_probability
 
-        return expected_value
+        return record_value(node, expected_value)
+
+
+def bounded_expectiminimax(node, depth, alpha, beta, is_white):
+    # Star1 expectimax (Ballard's pruning for chance nodes). Returns the node's value if it lies strictly between
+    # alpha and beta; otherwise a value at or below alpha that is an upper bound on it, or one at or above beta that is
+    # a lower bound. Values are win probabilities, so a window outside 0..1 is decided without searching the node.
+    if alpha >= 1.0:
+        return 1.0
+    if beta <= 0.0:
+        return 0.0
+
+    if search_clock is not None:
+        search_clock.node_count += 1
+        if search_clock.is_out_of_budget():
+            raise SearchTimeout()
+
+    if node.is_terminal(board_cursor) or depth <= 0:
+        heuristic = get_heuristic(node, is_white)
+        return record_value(node, heuristic)
+
+    if node.is_own_move(is_white):
+        expand_own_move_node(node)
+
+        # Node expansion may not produce any children due to the probability cutoff.
+        if len(node.children) <= 0:
+            heuristic = get_heuristic(node, is_white)
+            return record_value(node, heuristic)
+
+        max_value = -math.inf
+        for child in node.children:
+            child_value = bounded_expectiminimax(child, depth - 1, max(alpha, max_value), beta, is_white)
+            if child_value > max_value:
+                max_value = child_value
+            if max_value >= beta:
+                break
+
+        return record_value(node, max_value)
+
+    expand_chance_node(node)
+
+    # Node expansion may not produce any children due to the probability cutoff.
+    if len(node.children) <= 0:
+        heuristic = get_heuristic(node, is_white)
+        return record_value(node, heuristic)
+
+    # Probability of the children not searched yet, whose values can be anything from 0 to 1. Children the policy
+    # cutoffs removed count as 0, as they do in expectiminimax.
+    remaining_weight = 0.0
+    for child in node.children:
+        remaining_weight += child.local_probability
+
+    # Star1: each child is searched with the window that decides whether this node can leave alpha..beta, given the
+    # children searched so far and the bounds of the rest.
+    expected_value = 0.0
+    for child in node.children:
+        if child.local_probability <= 0.0:
+            continue
+        remaining_weight -= child.local_probability
+
+        child_alpha = (alpha - expected_value - remaining_weight) / child.local_probability
+        child_beta = (beta - expected_value) / child.local_probability
+        child_value = bounded_expectiminimax(child, depth - 1, child_alpha, child_beta, is_white)
+        expected_value += child.local_probability * child_value
+
+        if child_value <= child_alpha:
+            return record_pruned_bound(node, expected_value + remaining_weight)
+        if child_value >= child_beta:
+            return record_pruned_bound(node, expected_value)
+
+    return record_value(node, expected_value)
+
+
+def record_pruned_bound(node, value):
+    global pruned_chance_node_count
+    pruned_chance_node_count += 1
+    return record_value(node, value)
+
+
+def record_value(node, value):
+    # Keeps the value of a node searched by an iterative deepening search, to order its siblings at the next depth.
+    if current_values is not None:
+        current_values[tuple(node.position)] = value
+    return value
+
+
+def record_pruned_value(node):
+    # A pruned chance node couldn't beat a sibling, so its 0.0 sorts it after them at the next depth.
+    global pruned_chance_node_count
+    pruned_chance_node_count += 1
+    return record_value(node, 0.0)
+
+
+def order_own_move_children(node):
+    # Most valuable moves at the previous depth first, to raise the value the later moves have to beat as soon as
+    # possible. Moves that weren't searched go last, in their original order.
+    if not order_by_previous_depth or len(previous_values) == 0:
+        return
+    node.children.sort(key=lambda child: previous_values.get(tuple(child.position), -1.0), reverse=True)
+
+
+def order_chance_children(node):
+    # Replies first by how much they pulled the expected value down at the previous depth, probability times the
+    # value missed, so that a move that can't beat its sibling is found out after as few replies as possible. Replies
+    # that weren't searched go last, in order of probability.
+    if not order_by_previous_depth or len(previous_values) == 0:
+        return
+    node.children.sort(key=lambda child: child.local_probability
+                       * (1.0 - previous_values.get(tuple(child.position), 1.0)), reverse=True)
 
 
 # Minimum probability for any position to be considered.
@@ -82,75 +187,236 @@ engine_culling_cutoff = 0.0
 
 opponent_culling_cutoff = 0.0
 
+board_cursor = None
+
+# Positions are moves played since curr_fen_string (the empty string stands for the start of the game).
+curr_fen_string = ""
+
+# Clock of the running time-managed search, None otherwise. Time-managed searches print their report if
+# report_search_statistics is set, and keep it in last_search_report either way.
+search_clock = None
+report_search_statistics = False
+last_search_report = ""
+
+# Best move found so far in the depth being searched, for when the first depth runs out of time.
+partial_best_move = None
+
+# Iterative deepening searches each depth with its moves ordered by their values at the depth before, best moves and
+# most damaging replies first, so that the alpha pruning cuts off more. Without the ordering, moves are searched in
+# the order the strong network's policy (or the legal move generator) gives them.
+order_by_previous_depth = True
+
+# Values of the nodes searched at the depth being searched and at the one before, keyed by their moves. None outside
+# iterative deepening.
+current_values = None
+previous_values = {}
+
+# Search with Star1 pruning (bounded_expectiminimax) rather than expectiminimax's alpha pruning. Both find the same
+# values for the root's moves.
+use_bounded_search = True
 
-def get_best_move(position, depth, position_probability_cutoff, move_culling_cutoff, enemy_culling_cutoff):
+# Network evaluations asked for and chance nodes cut off by the pruning so far, and the statistics of each depth of
+# the last time-managed search: (depth, nodes searched, evaluations, chance nodes pruned, whether it was completed).
+evaluation_count = 0
+pruned_chance_node_count = 0
+depth_statistics = []
+
+
+def get_best_move(position, depth, position_probability_cutoff, move_culling_cutoff, enemy_culling_cutoff,
+                  search_limits=None, fen_string=""):
+    # With search_limits (a search_clock.SearchLimits), depth is the maximum depth of an iterative deepening search
+    # that runs on the limits' time and node budget.
     global probability_cutoff
     probability_cutoff = position_probability_cutoff
     global engine_culling_cutoff
     engine_culling_cutoff = move_culling_cutoff
     global opponent_culling_cutoff
     opponent_culling_cutoff = enemy_culling_cutoff
+    global curr_fen_string
+    curr_fen_string = fen_string
+    global board_cursor
+    board_cursor = BoardCursor(position, fen_string)
 
-    root_node = Node(None, position, 1.0, 1.0, [])
-    is_white = len(position) % 2 == 0
+    root_node = Node(None, position, 1.0, 1.0, [], fen_string)
+    is_white = is_white_to_move(position, fen_string)
 
-    if is_terminal_position(root_node.position):
+    if root_node.is_terminal(board_cursor):
         return None
 
     if depth <= 0:
         return get_best_legal_move(position)
 
+    if search_limits is not None:
+        return get_best_move_timed(position, depth, search_limits)
+
+    max_child, max_value = search_root(root_node, depth, is_white)
+    if max_child is None:
+        return get_best_legal_move(position)
+
+    return max_child.position[len(max_child.position) - 1]
+
+
+def get_best_move_timed(position, max_depth, search_limits):
+    # Iterative deepening: search depth 1, 2, ... up to max_depth while the budget lasts. A depth that runs out of time
+    # is abandoned, and the move from the last completed depth is played.
+    global search_clock
+    global partial_best_move
+    global current_values
+    global previous_values
+    global pruned_chance_node_count
+    global depth_statistics
+    search_clock = SearchClock(search_limits, [weak_evaluator, strong_evaluator])
+    partial_best_move = None
+    previous_values = {}
+    depth_statistics = []
+    is_white = is_white_to_move(position, curr_fen_string)
+    if search_limits.depth is not None:
+        max_depth = min(max_depth, search_limits.depth)
+
+    best_move = None
+    depth_times = []
+    try:
+        for depth in range(1, max_depth + 1):
+            depth_start_time = search_clock.get_elapsed_time()
+            depth_start_nodes = search_clock.node_count
+            depth_start_evaluations = evaluation_count
+            current_values = {}
+            pruned_chance_node_count = 0
+            root_node = Node(None, position, 1.0, 1.0, [], curr_fen_string)
+            try:
+                max_child, max_value = search_root(root_node, depth, is_white)
+            except SearchTimeout:
+                record_depth_statistics(depth, depth_start_nodes, depth_start_evaluations, False)
+                raise
+            record_depth_statistics(depth, depth_start_nodes, depth_start_evaluations, True)
+            previous_values = current_values
+            if max_child is None:
+                search_clock.stop("no candidate moves")
+                break
+
+            best_move = max_child.position[len(max_child.position) - 1]
+            depth_times.append(search_clock.get_elapsed_time() - depth_start_time)
+            search_clock.report_progress(lambda: (max_value, [best_move]), depth, force=True)
+
+            # Values are win probabilities, so a forced win can't be overtaken, and neither can an only move.
+            if len(root_node.children) == 1:
+                search_clock.stop("only move")
+                break
+            if max_value >= 1.0:
+                search_clock.stop("best move decided")
+                break
+            if depth == max_depth:
+                search_clock.stop("depth limit")
+                break
+
+            # Each depth takes about as many times longer than the last as the last did than the one before.
+            if len(depth_times) >= 2 and depth_times[-2] > 0:
+                predicted_time = depth_times[-1] * depth_times[-1] / depth_times[-2]
+                if predicted_time > search_clock.get_remaining_time():
+                    search_clock.stop("next depth would not finish")
+                    break
+    except SearchTimeout:
+        if best_move is None:
+            best_move = partial_best_move
+
+    current_values = None
+    previous_values = {}
+
+    global last_search_report
+    last_search_report = search_clock.get_report() + get_depth_report()
+    if report_search_statistics:
+        print(last_search_report)
+    search_clock = None
+
+    if best_move is None:
+        best_move = get_best_legal_move(position)
+    return best_move
+
+
+def record_depth_statistics(depth, depth_start_nodes, depth_start_evaluations, completed):
+    depth_statistics.append((depth, search_clock.node_count - depth_start_nodes,
+                             evaluation_count - depth_start_evaluations, pruned_chance_node_count, completed))
+
+
+def get_depth_report():
+    depth_reports = []
+    for depth, node_count, depth_evaluation_count, pruned_count, completed in depth_statistics:
+        depth_report = "depth " + str(depth) + ": " + str(node_count) + " nodes, " + str(depth_evaluation_count) \
+                       + " evaluations, " + str(pruned_count) + " pruned"
+        if not completed:
+            depth_report += " (unfinished)"
+        depth_reports.append(depth_report)
+    if len(depth_reports) == 0:
+        return ""
+    return "; " + "; ".join(depth_reports)
+
+
+def search_root(root_node, depth, is_white):
+    # Returns the best child of root_node and its value, or None if root_node has no children to choose from.
+    global partial_best_move
+
     # Expand node
-    legal_moves = get_legal_moves_from_position(root_node.position)
+    legal_moves = get_legal_moves_from_node(root_node)
     probabilities = []
     for i in range(len(legal_moves)):
         probabilities.append(1.0)
     probability_distribution = list(zip(legal_moves, probabilities))
     root_node.expand_with_probability_distribution(probability_distribution, probability_cutoff)
+    order_own_move_children(root_node)
 
     # Node expansion may not produce any children due to the probability cutoff.
     if len(root_node.children) <= 0:
-        return get_best_legal_move(position)
+        return None, -math.inf
 
     # Get maximum child
     max_value = -math.inf
     max_child = None
     for child in root_node.children:
-        child_value = expectiminimax(child, depth - 1, max_value, is_white)
+        if use_bounded_search:
+            child_value = bounded_expectiminimax(child, depth - 1, max_value, math.inf, is_white)
+        else:
+            child_value = expectiminimax(child, depth - 1, max_value, is_white)
         if child_value > max_value:
             max_value = child_value
             max_child = child
+            partial_best_move = max_child.position[len(max_child.position) - 1]
 
-    return max_child.position[len(max_child.position) - 1]
+    return max_child, max_value
 
 
-def is_terminal_position(position):
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
+def expand_own_move_node(node):
+    legal_moves = get_legal_moves_from_node(node)
+    probabilities = []
+    for i in range(len(legal_moves)):
+        probabilities.append(1.0)
+    probability_distribution = list(zip(legal_moves, probabilities))
+    node.expand_with_probability_distribution(probability_distribution, probability_cutoff)
+    order_own_move_children(node)
 
-    outcome = board.outcome(claim_draw=True)
-    if outcome is not None:
-        return True
-    else:
-        return False
-
-
-def get_heuristic(position, is_white):
-    if is_terminal_position(position):
-        board = chess.Board()
-        for move in position:
-            board.push_uci(move)
-        outcome = board.outcome(claim_draw=True)
-        if outcome.result() == "1-0":
-            heuristic = 1.0
-        elif outcome.result() == "0-1":
-            heuristic = 0.0
-        else:
-            heuristic = 0.5
+
+def expand_chance_node(node):
+    global evaluation_count
+    evaluation_count += 1
+    evaluation = weak_evaluator.get_full_evaluation_from_moves(node.position, curr_fen_string)
+    probability_distribution = evaluation.move_policy_list
+
+    # Simplifying here, an unsound way of saving time.
+    probability_distribution = get_simplified_probability_distribution(probability_distribution,
+                                                                       opponent_culling_cutoff)
+
+    probability_distribution.sort(key=probability_distribution_sort, reverse=True)
+    node.expand_with_probability_distribution(probability_distribution, probability_cutoff)
+    order_chance_children(node)
+
+
+def get_heuristic(node, is_white):
+    global evaluation_count
+    if node.is_terminal(board_cursor):
+        heuristic = node.get_result(board_cursor)
 
     else:
-        evaluation = strong_evaluator.get_expected_outcome_from_moves(position)
+        evaluation_count += 1
+        evaluation = strong_evaluator.get_expected_outcome_from_moves(node.position, fen_string=curr_fen_string)
         heuristic = (evaluation + 1.0) / 2.0
 
     if is_white:
@@ -159,18 +425,14 @@ def get_heuristic(position, is_white):
         return 1.0 - heuristic
 
 
-def get_legal_moves_from_position(moves_list):
+def get_legal_moves_from_node(node):
 
+    global evaluation_count
     if engine_culling_cutoff <= 0.0:
-        board = chess.Board()
-        for move in moves_list:
-            board.push_uci(move)
-
-        legal_moves = []
-        for legal_move in board.legal_moves:
-            legal_moves.append(legal_move.uci())
+        legal_moves = node.get_legal_moves(board_cursor)
     else:
-        evaluation = strong_evaluator.get_full_evaluation_from_moves(moves_list)
+        evaluation_count += 1
+        evaluation = strong_evaluator.get_full_evaluation_from_moves(node.position, curr_fen_string)
         policies_list = evaluation.move_policy_list
 
         # Remove the most unpromising moves.
@@ -211,7 +473,7 @@ def get_simplified_probability_distribution(distribution, cutoff):
 # Quickly return the legal move with the highest policy value.
 def get_best_legal_move(position):
 
-    evaluation = strong_evaluator.get_full_evaluation_from_moves(position)
+    evaluation = strong_evaluator.get_full_evaluation_from_moves(position, curr_fen_string)
     legal_moves = evaluation.move_policy_list
     legal_moves.sort(key=probability_distribution_sort, reverse=True)
 
@@ -1,19 +1,28 @@
+from board_cursor import get_outcome_value
+from game_position import is_white_to_move
 
 
 class Node:
 
-    def __init__(self, parent, position, local_probability, position_probability, children):
+    def __init__(self, parent, position, local_probability, position_probability, children, fen_string=""):
         self.parent = parent
+        # Moves played since fen_string (or since the start of the game if there is no FEN), shared by the whole tree.
         self.position = position
+        self.fen_string = fen_string
         self.local_probability = local_probability
         self.position_probability = position_probability
         self.children = children
 
+        # Board state of the position. Computed once, the first time a search asks for it, and then reused.
+        self.board_state_known = False
+        self.outcome = None
+        self.legal_moves = None
+
     def add_child(self, child):
         self.children.append(child)
 
     def is_own_move(self, is_white):
-        white_to_play = len(self.position) % 2 == 0
+        white_to_play = is_white_to_move(self.position, self.fen_string)
         if is_white:
             return white_to_play
         else:
@@ -24,6 +33,29 @@ class Node:
         for entry in probability_distribution:
             if entry[1] * self.position_probability < position_probability_cutoff:
                 continue
-            new_node = Node(self, self.position.copy(), entry[1], entry[1] * self.position_probability, [])
+            new_node = Node(self, self.position.copy(), entry[1], entry[1] * self.position_probability, [],
+                            self.fen_string)
             new_node.position.append(entry[0])
             self.add_child(new_node)
+
+    def load_board_state(self, board_cursor):
+        if self.board_state_known:
+            return
+        board = board_cursor.move_to(self.position)
+        self.outcome = board.outcome(claim_draw=True)
+        self.board_state_known = True
+
+    def is_terminal(self, board_cursor):
+        self.load_board_state(board_cursor)
+        return self.outcome is not None
+
+    def get_result(self, board_cursor):
+        # Objective result, from white's perspective.
+        self.load_board_state(board_cursor)
+        return get_outcome_value(self.outcome)
+
+    def get_legal_moves(self, board_cursor):
+        if self.legal_moves is None:
+            board = board_cursor.move_to(self.position)
+            self.legal_moves = [legal_move.uci() for legal_move in board.legal_moves]
+        return self.legal_moves
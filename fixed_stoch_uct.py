@@ -1,23 +1,52 @@
 import backends
 from treenode import TreeNode
-import chess
+from board_cursor import BoardCursor
+from game_position import is_white_to_move
+import transposition_table as transposition_tables
+from search_clock import SearchClock, can_best_child_be_overtaken
 
 
 weak_evaluator = backends.player_model_evaluator
 strong_evaluator = backends.strong_evaluator
 
+# Values the leaves of the search, e.g. with Stockfish instead of the strong network (see leaf_evaluators.py). The
+# strong network still supplies the policies for culling the engine's own moves.
+leaf_evaluator = strong_evaluator
+
 
 playing_as_white = None
 opponent_probability_cutoff = 0.0
 engine_culling_cutoff = 0.0
 tendril_count = 16
 
+board_cursor = None
+
+# Positions are moves played since curr_fen_string (the empty string stands for the start of the game).
+curr_fen_string = ""
+
+# Transposition-aware search mode. Transposed move orders share search statistics and cached NN evaluations.
+use_transposition_table = False
+report_transposition_hits = False
+transposition_table = transposition_tables.shared_table
 
-def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probability_cutoff):
+# Time-managed searches (see get_best_move's search_limits) print their report if report_search_statistics is set, and
+# keep it in last_search_report either way.
+report_search_statistics = False
+last_search_report = ""
+max_principal_variation_length = 12
+
+
+def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probability_cutoff, search_limits=None,
+                  fen_string=""):
+    # With search_limits (a search_clock.SearchLimits), the search runs on its time and node limits instead of
+    # nodes_limit, and stops early once the best move can't change.
 
     # Assign global variables from given parameters.
+    global curr_fen_string
+    curr_fen_string = fen_string
+
     global playing_as_white
-    playing_as_white = len(position) % 2 == 0
+    playing_as_white = is_white_to_move(position, fen_string)
 
     global engine_culling_cutoff
     engine_culling_cutoff = own_probability_cutoff
@@ -25,16 +54,27 @@ def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probabili
     global opponent_probability_cutoff
     opponent_probability_cutoff = enemy_probability_cutoff
 
+    global board_cursor
+    board_cursor = BoardCursor(position, fen_string)
+
+    if use_transposition_table:
+        transposition_table.new_search()
+
     # Create tree root.
-    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position)
+    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position, fen_string=fen_string)
 
-    # Perform a number of uct iterations equal to parameter nodes_limit.
-    nodes_count = 0
-    while nodes_count < nodes_limit // tendril_count:
-        perform_iteration(root_node)
-        nodes_count += 1
+    if search_limits is not None:
+        perform_timed_iterations(root_node, search_limits)
+    else:
+        # Perform uct iterations until nodes_limit leaves have been evaluated, as the timed searches count them.
+        nodes_count = 0
+        while nodes_count < nodes_limit:
+            nodes_count += perform_iteration(root_node)
 
     # Return best move found so far.
+    if use_transposition_table and report_transposition_hits:
+        print(transposition_table.get_report())
+
     best_move = root_node.get_best_move()
     if best_move is None:
         best_move = get_best_legal_move(position)
@@ -42,6 +82,51 @@ def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probabili
     return best_move
 
 
+def perform_timed_iterations(root_node, search_limits):
+    search_clock = SearchClock(search_limits, [weak_evaluator, strong_evaluator])
+
+    while not search_clock.is_out_of_budget():
+        search_clock.node_count += perform_iteration(root_node)
+        if search_clock.is_out_of_budget():
+            break
+
+        # Leaf values are win probabilities, so they lie between 0 and 1.
+        if root_node.has_children() and not can_best_child_be_overtaken(root_node.children,
+                                                                        search_clock.get_remaining_nodes(), 0.0, 1.0):
+            search_clock.stop("best move decided")
+
+        search_clock.report_progress(lambda: get_best_line(root_node))
+
+    search_clock.report_progress(lambda: get_best_line(root_node), force=True)
+
+    global last_search_report
+    last_search_report = search_clock.get_report()
+    if report_search_statistics:
+        print(last_search_report)
+
+
+def get_best_line(root_node):
+    # The principal variation follows the best move at own move nodes and the most likely reply at chance nodes.
+    principal_variation = []
+    node = root_node
+    while node.has_children() and len(principal_variation) < max_principal_variation_length:
+        if node.is_own_move(playing_as_white):
+            node = node.get_highest_value_child()
+        else:
+            node = node.get_most_likely_child()
+        if node is None:
+            break
+        principal_variation.append(node.get_move())
+
+    # Leaf values are the engine's win probabilities, so the best child's mean value is the line's.
+    win_probability = None
+    best_child = root_node.get_highest_value_child()
+    if best_child is not None:
+        win_probability = best_child.total_value / best_child.visit_count
+
+    return win_probability, principal_variation
+
+
 def perform_iteration(root_node):
 
     #
@@ -63,16 +148,15 @@ def perform_iteration(root_node):
     #
 
     chance_nodes = []
-    chance_node_positions = []
 
     for index in range(len(leaf_nodes)):
         # Skip expansion if the node is terminal.
-        if is_terminal_position(leaf_nodes[index].position):
+        if leaf_nodes[index].is_terminal(board_cursor):
             pass
         elif leaf_nodes[index].visit_count > 0:
             if leaf_nodes[index].is_own_move(playing_as_white):
                 # Own move node
-                legal_moves = get_legal_moves_from_position(leaf_nodes[index].position)
+                legal_moves = get_legal_moves_from_node(leaf_nodes[index])
                 probabilities = []
                 for i in range(len(legal_moves)):
                     probabilities.append(1.0)
@@ -84,12 +168,11 @@ def perform_iteration(root_node):
             else:
                 # Chance node
                 chance_nodes.append(leaf_nodes[index])
-                chance_node_positions.append(leaf_nodes[index].position)
 
-    chance_evaluations = weak_evaluator.get_evaluations_from_moves(chance_node_positions)
+    chance_policies = get_weak_policies(chance_nodes)
     for index in range(len(chance_nodes)):
         leaf_index = leaf_nodes.index(chance_nodes[index])
-        probability_distribution = chance_evaluations[index].move_policy_list
+        probability_distribution = chance_policies[index]
 
         probability_distribution = get_simplified_probability_distribution(probability_distribution,
                                                                            opponent_probability_cutoff)
@@ -101,15 +184,11 @@ def perform_iteration(root_node):
     # ROLLOUT
     #
 
-    positions = []
-
-    for leaf in leaf_nodes:
-        positions.append(leaf.position)
-    expected_values = strong_evaluator.get_expected_outcomes_from_moves(positions)
+    expected_values = get_strong_values(leaf_nodes)
 
     for index in range(len(leaf_nodes)):
-        if is_terminal_position(leaf_nodes[index].position):
-            expected_values[index] = get_result(leaf_nodes[index].position, playing_as_white)
+        if leaf_nodes[index].is_terminal(board_cursor):
+            expected_values[index] = leaf_nodes[index].get_result(board_cursor, playing_as_white)
         else:
             expected_values[index] = (expected_values[index] + 1.0) / 2.0
 
@@ -128,22 +207,40 @@ def perform_iteration(root_node):
             curr_node.visit_count += 1
             curr_node.total_value += expected_values[index]
 
+            if curr_node.entry is not None:
+                entry = transposition_table.lookup(curr_node.entry)
+                entry.visit_count += 1
+                entry.total_value += expected_values[index]
+
             curr_node = curr_node.parent
 
+    return len(leaf_nodes)
 
-def get_legal_moves_from_position(moves_list):
 
-    if engine_culling_cutoff <= 0.0:
-        board = chess.Board()
-        for move in moves_list:
-            board.push_uci(move)
+def get_weak_policies(nodes):
+    return transposition_tables.get_weak_policies(get_search_table(), nodes, weak_evaluator, curr_fen_string,
+                                                  board_cursor)
 
-        legal_moves = []
-        for legal_move in board.legal_moves:
-            legal_moves.append(legal_move.uci())
+
+def get_strong_values(nodes):
+    return transposition_tables.get_strong_values(get_search_table(), nodes, leaf_evaluator, curr_fen_string,
+                                                  board_cursor)
+
+
+def get_search_table():
+    # The transposition table this search uses, or None without one.
+    if use_transposition_table:
+        return transposition_table
+    return None
+
+
+def get_legal_moves_from_node(node):
+
+    if engine_culling_cutoff <= 0.0:
+        legal_moves = node.get_legal_moves(board_cursor)
 
     else:
-        evaluation = strong_evaluator.get_full_evaluation_from_moves(moves_list)
+        evaluation = strong_evaluator.get_full_evaluation_from_moves(node.position, curr_fen_string)
         policies_list = evaluation.move_policy_list
 
         # Remove the most unpromising moves.
@@ -156,37 +253,6 @@ def get_legal_moves_from_position(moves_list):
     return legal_moves
 
 
-def is_terminal_position(position):
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
-
-    outcome = board.outcome(claim_draw=True)
-    if outcome is not None:
-        return True
-    else:
-        return False
-
-
-def get_result(position, is_white):
-
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
-    outcome = board.outcome(claim_draw=True)
-    if outcome.result() == "1-0":
-        result = 1.0
-    elif outcome.result() == "0-1":
-        result = 0.0
-    else:
-        result = 0.5
-
-    if not is_white:
-        result = 1.0 - result
-
-    return result
-
-
 def get_simplified_probability_distribution(distribution, cutoff):
 
     new_distribution = []
@@ -213,7 +279,7 @@ def probability_distribution_sort(entry):
 # Quickly return the legal move with the highest policy value.
 def get_best_legal_move(position):
 
-    evaluation = strong_evaluator.get_full_evaluation_from_moves(position)
+    evaluation = strong_evaluator.get_full_evaluation_from_moves(position, curr_fen_string)
     legal_moves = evaluation.move_policy_list
     legal_moves.sort(key=probability_distribution_sort, reverse=True)
 
@@ -221,9 +287,12 @@ def get_best_legal_move(position):
 
 
 def remove_list_duplicates(input_list):
+    # Keeps the first occurrence of each element. Nodes hash by identity, so this is linear in the list length.
     output_list = []
+    seen_elements = set()
     for element in input_list:
-        if element not in output_list:
+        if element not in seen_elements:
+            seen_elements.add(element)
             output_list.append(element)
 
     return output_list
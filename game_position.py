@@ -0,0 +1,72 @@
+import chess
+from collections import OrderedDict
+
+# Positions are given as a FEN string plus the list of moves in LAN played since it. An empty FEN string stands for
+# the standard starting position, so a move list on its own still describes a game from the start.
+
+# The network looks at the current position and the seven before it, so that's all the history its input and the
+# evaluation caches need (see backend_utilities.get_network_input).
+NETWORK_HISTORY_LENGTH = 7
+
+
+def is_white_to_move(position, fen_string=""):
+    white_to_move_at_fen = fen_string == "" or fen_string.split()[1] == "w"
+    return white_to_move_at_fen == (len(position) % 2 == 0)
+
+
+def get_board(position, fen_string=""):
+    if fen_string == "":
+        board = chess.Board()
+    else:
+        board = chess.Board(fen_string)
+    for move in position:
+        board.push_uci(move)
+    return board
+
+
+def get_search_position(board):
+    # Returns (fen_string, position) for board: the FEN the game started from and every move played since. Searches
+    # keep the whole game so that their boards see repetitions of positions from any point in it. The evaluators cut
+    # each position down to the history the network uses. Games from the standard start get the empty FEN string.
+    position = [move.uci() for move in board.move_stack]
+    fen_string = board.root().fen()
+    if fen_string == chess.STARTING_FEN:
+        fen_string = ""
+    return fen_string, position
+
+
+class PositionSnapshots:
+    # Boards reached by playing moves from a FEN, kept so that the FEN of a long game a few moves back can be found by
+    # pushing one move onto the snapshot before it, instead of replaying the whole game. Searches ask for the snapshot
+    # of a node after the one of its parent, so that's usually the case. The least recently used snapshots are dropped
+    # once there are more than capacity.
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.boards = OrderedDict()
+
+    def get_fen(self, position, fen_string=""):
+        return self.get_board(position, fen_string).fen()
+
+    def get_board(self, position, fen_string=""):
+        # The returned board is shared, so it must not be changed.
+        key = (fen_string, tuple(position))
+        board = self.boards.get(key)
+        if board is not None:
+            self.boards.move_to_end(key)
+            return board
+
+        parent_board = None
+        if len(position) > 0:
+            parent_board = self.boards.get((fen_string, key[1][:-1]))
+
+        if parent_board is None:
+            board = get_board(position, fen_string).copy(stack=False)
+        else:
+            board = parent_board.copy(stack=False)
+            board.push_uci(position[-1])
+
+        self.boards[key] = board
+        if len(self.boards) > self.capacity:
+            self.boards.popitem(last=False)
+        return board
@@ -0,0 +1,140 @@
+import math
+import threading
+import chess
+from backend_utilities import PositionEvaluator, PositionEvaluation, EvaluationCache, get_cache_key, \
+    get_fen_strings, get_network_input
+from game_position import PositionSnapshots, get_board
+
+# Evaluators that need no neural network, for running and profiling the searches without the lc0 backend or any
+# weights files. They value a position by material and mobility, and spread their policy over the legal moves with a
+# softmax of how promising each move looks. Both are deterministic, so searches run on them are repeatable.
+#   StubEvaluator:      the fast one. Boards are built from the cached board of the position before, and evaluations
+#                       are cached.
+#   ReferenceEvaluator: the same evaluation with python-chess alone, replaying every position from scratch. It's the
+#                       baseline the stub is checked against.
+
+PIECE_VALUES = {chess.PAWN: 1.0, chess.KNIGHT: 3.0, chess.BISHOP: 3.0, chess.ROOK: 5.0, chess.QUEEN: 9.0,
+                chess.KING: 0.0}
+
+# Advantage, in pawns, that gives an expected outcome of tanh(1), about 0.76.
+value_scale = 4.0
+
+# Pawns each legal move more than the opponent has is worth.
+mobility_weight = 0.05
+
+# Softmax temperature of the policy, in pawns of move score.
+policy_temperature = 1.0
+
+# Move scores, in pawns, on top of the material a move captures or promotes to.
+check_bonus = 0.5
+castling_bonus = 0.3
+
+
+def get_heuristic_evaluation(board):
+    # PositionEvaluation of board, with the expected outcome for the side to move.
+    legal_moves = list(board.legal_moves)
+    if len(legal_moves) == 0:
+        if board.is_check():
+            return PositionEvaluation(-1.0, [])
+        return PositionEvaluation(0.0, [])
+
+    score = get_material_balance(board) + mobility_weight * (len(legal_moves) - get_opponent_mobility(board))
+    expected_outcome = math.tanh(score / value_scale)
+
+    move_scores = []
+    for move in legal_moves:
+        move_scores.append(get_move_score(board, move))
+    highest_score = max(move_scores)
+
+    weights = []
+    for move_score in move_scores:
+        weights.append(math.exp((move_score - highest_score) / policy_temperature))
+    weight_total = sum(weights)
+
+    move_policy_list = []
+    for index in range(len(legal_moves)):
+        move_policy_list.append((legal_moves[index].uci(), weights[index] / weight_total))
+
+    return PositionEvaluation(expected_outcome, move_policy_list)
+
+
+def get_material_balance(board):
+    balance = 0.0
+    for piece_type in PIECE_VALUES:
+        piece_count = chess.popcount(board.pieces_mask(piece_type, board.turn)) \
+            - chess.popcount(board.pieces_mask(piece_type, not board.turn))
+        balance += PIECE_VALUES[piece_type] * piece_count
+    return balance
+
+
+def get_opponent_mobility(board):
+    # Moves the opponent could make if it were their turn, not counting whether they leave their king in check.
+    opponent_board = board.copy(stack=False)
+    opponent_board.turn = not board.turn
+    opponent_board.ep_square = None
+    return opponent_board.pseudo_legal_moves.count()
+
+
+def get_move_score(board, move):
+    move_score = 0.0
+    if board.is_capture(move):
+        captured_piece_type = board.piece_type_at(move.to_square)
+        if captured_piece_type is None:
+            # En passant.
+            captured_piece_type = chess.PAWN
+        move_score += PIECE_VALUES[captured_piece_type] - PIECE_VALUES[board.piece_type_at(move.from_square)] / 10
+    if move.promotion is not None:
+        move_score += PIECE_VALUES[move.promotion] - PIECE_VALUES[chess.PAWN]
+    if board.gives_check(move):
+        move_score += check_bonus
+    if board.is_castling(move):
+        move_score += castling_bonus
+    return move_score
+
+
+class StubEvaluator(PositionEvaluator):
+
+    def __init__(self, cache_size=0):
+        self.snapshots = PositionSnapshots()
+        self.cache = EvaluationCache(cache_size)
+        self.backend_call_count = 0
+
+        # Searches may run in background threads (e.g. pondering), and the snapshots and cache aren't thread-safe.
+        self.lock = threading.Lock()
+
+    def get_evaluations(self, input_moves_list, fen_string=""):
+        with self.lock:
+            position_evaluations = []
+            evaluated_count = 0
+            fen_strings = get_fen_strings(fen_string, len(input_moves_list))
+            for index in range(len(input_moves_list)):
+                # Cached by the network input a network evaluator would build, to hit and miss the way it does.
+                key = get_cache_key(*get_network_input(self.snapshots, input_moves_list[index], fen_strings[index]))
+                evaluation = self.cache.get(key)
+                if evaluation is None:
+                    evaluation = get_heuristic_evaluation(self.snapshots.get_board(input_moves_list[index],
+                                                                                   fen_strings[index]))
+                    self.cache.put(key, evaluation)
+                    evaluated_count += 1
+                position_evaluations.append(evaluation.copy())
+
+            # Batches that needed evaluating count as backend calls, as they would with a network.
+            if evaluated_count > 0:
+                self.backend_call_count += 1
+            return position_evaluations
+
+
+class ReferenceEvaluator(PositionEvaluator):
+
+    def __init__(self):
+        self.backend_call_count = 0
+
+    def get_evaluations(self, input_moves_list, fen_string=""):
+        if len(input_moves_list) > 0:
+            self.backend_call_count += 1
+        position_evaluations = []
+        fen_strings = get_fen_strings(fen_string, len(input_moves_list))
+        for index in range(len(input_moves_list)):
+            position_evaluations.append(get_heuristic_evaluation(get_board(input_moves_list[index],
+                                                                           fen_strings[index])))
+        return position_evaluations
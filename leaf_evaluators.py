@@ -0,0 +1,80 @@
+import concurrent.futures
+import backends
+import stockfish_utility
+from game_position import is_white_to_move
+
+# Leaf evaluators give the UCT searches the values of the positions at their leaves. Anything with the
+# get_expected_outcomes_from_moves method of backend_utilities.PositionEvaluator can be one, so the network evaluators
+# are used as they are. Expected outcomes run from -1 to 1, from white's perspective unless objective_evaluation is
+# False, in which case they are from the perspective of the side to move.
+
+LEAF_EVALUATOR_CHOICES = ["leela", "stockfish", "hybrid"]
+
+# Stockfish searches each leaf this deep.
+stockfish_leaf_depth = 8
+
+# Share of a hybrid leaf value that comes from Stockfish. The rest comes from the network.
+hybrid_stockfish_weight = 0.5
+
+
+class StockfishLeafEvaluator:
+    # Depth-limited Stockfish searches of each leaf, spread across a Stockfish pool's processes.
+
+    def __init__(self, pool=None, depth=None, nodes=None):
+        if pool is None:
+            pool = stockfish_utility.pool
+        if depth is None and nodes is None:
+            depth = stockfish_leaf_depth
+        self.pool = pool
+        self.depth = depth
+        self.nodes = nodes
+
+    def get_expected_outcomes_from_moves(self, input_moves_list, objective_evaluation=True, fen_string=""):
+        values = self.pool.get_values_at_positions(input_moves_list, fen_string, self.depth, self.nodes)
+
+        outcomes_list = []
+        for index in range(len(values)):
+            expected_outcome = values[index] * 2.0 - 1.0
+            if not objective_evaluation and not is_white_to_move(input_moves_list[index], fen_string):
+                expected_outcome = -expected_outcome
+            outcomes_list.append(expected_outcome)
+
+        return outcomes_list
+
+
+class HybridLeafEvaluator:
+    # Blends the network's and Stockfish's values. Stockfish works on the batch in the background while the network
+    # evaluates it, so a batch takes about as long as the slower of the two.
+
+    def __init__(self, network_evaluator, stockfish_evaluator, stockfish_weight=None):
+        if stockfish_weight is None:
+            stockfish_weight = hybrid_stockfish_weight
+        self.network_evaluator = network_evaluator
+        self.stockfish_evaluator = stockfish_evaluator
+        self.stockfish_weight = stockfish_weight
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def get_expected_outcomes_from_moves(self, input_moves_list, objective_evaluation=True, fen_string=""):
+        stockfish_future = self.executor.submit(self.stockfish_evaluator.get_expected_outcomes_from_moves,
+                                                input_moves_list, objective_evaluation, fen_string)
+        network_outcomes = self.network_evaluator.get_expected_outcomes_from_moves(input_moves_list,
+                                                                                   objective_evaluation, fen_string)
+        stockfish_outcomes = stockfish_future.result()
+
+        outcomes_list = []
+        for index in range(len(network_outcomes)):
+            outcomes_list.append((1.0 - self.stockfish_weight) * network_outcomes[index]
+                                 + self.stockfish_weight * stockfish_outcomes[index])
+
+        return outcomes_list
+
+
+def get_leaf_evaluator(name):
+    if name == "leela":
+        return backends.strong_evaluator
+    elif name == "stockfish":
+        return StockfishLeafEvaluator()
+    elif name == "hybrid":
+        return HybridLeafEvaluator(backends.strong_evaluator, StockfishLeafEvaluator())
+    else:
+        raise ValueError("unknown leaf evaluator " + name)
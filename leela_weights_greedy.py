@@ -5,8 +5,8 @@ import backends
 nn_evaluator = backends.strong_evaluator
 
 
-def get_move(position):
-    evaluation = nn_evaluator.get_evaluations_from_moves([position])[0]
+def get_move(position, fen_string=""):
+    evaluation = nn_evaluator.get_evaluations_from_moves([position], fen_string)[0]
 
     probability_distribution = evaluation.move_policy_list
 
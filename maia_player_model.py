@@ -5,8 +5,8 @@ import backends
 player_model_evaluator = backends.player_model_evaluator
 
 
-def get_move(position):
-    evaluation = player_model_evaluator.get_evaluations_from_moves([position])[0]
+def get_move(position, fen_string=""):
+    evaluation = player_model_evaluator.get_evaluations_from_moves([position], fen_string)[0]
 
     probability_distribution = evaluation.move_policy_list
 
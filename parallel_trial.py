@@ -0,0 +1,173 @@
+import concurrent.futures
+import csv
+import multiprocessing
+import os
+import random
+import chess
+import config
+
+# Performs the same trials as trial.py, spread across a pool of worker processes.
+# Each worker builds its own neural network evaluators and Stockfish pool when it imports the engines.
+# Every finished game is appended to the results file straight away, and games already in the results file are
+# skipped, so an interrupted run picks up where it left off when started again.
+# With USE_EVALUATION_SERVER, the networks are only loaded in the main process instead, and every worker's positions
+# are batched together there.
+
+engines = ["aggro fixed stochastic uct", "stockfish"]
+
+results_fields = ["engine", "game_index", "seed", "computer_is_white", "half_moves", "result"]
+
+# Imported in each worker process by initialize_worker.
+trial_player = None
+
+
+def initialize_worker(server_arguments=None):
+    if server_arguments is not None:
+        import backends
+        import batching_evaluator
+        client = batching_evaluator.EvaluationClient(*server_arguments)
+        backends.strong_evaluator = batching_evaluator.RemoteEvaluator(client, "strong")
+        backends.player_model_evaluator = batching_evaluator.RemoteEvaluator(client, "player model")
+
+    global trial_player
+    import player
+    trial_player = player
+
+    trial_player.simulate_player = True
+    trial_player.suppress_game_text = True
+
+
+def get_game_seed(game_index):
+    # Game i gets the same seed for every engine, so each engine faces the same simulated player randomness.
+    return config.TRIAL_SEED * 1000003 + game_index
+
+
+def play_trial_game(engine, game_index, seed):
+    random.seed(seed)
+
+    trial_player.computer_engine = engine
+    computer_is_white = game_index % 2 == 0
+    played_game = trial_player.play_game(play_random=False, is_computer_white=computer_is_white)
+
+    board = chess.Board()
+    for move in played_game:
+        board.push_uci(move)
+    outcome = board.outcome(claim_draw=True)
+    result = "*"
+    if outcome is not None:
+        result = outcome.result()
+
+    return {"engine": engine, "game_index": game_index, "seed": seed, "computer_is_white": computer_is_white,
+            "half_moves": len(played_game), "result": result}
+
+
+def read_finished_games(path):
+    finished_games = []
+    if not os.path.exists(path):
+        return finished_games
+
+    remove_partial_row(path)
+    with open(path, newline="") as results_file:
+        for row in csv.DictReader(results_file):
+            # Rows with missing or unreadable fields are skipped, and their games are played again.
+            if any(row.get(field) is None for field in results_fields):
+                continue
+            try:
+                row["game_index"] = int(row["game_index"])
+                row["half_moves"] = int(row["half_moves"])
+            except ValueError:
+                continue
+            finished_games.append(row)
+
+    return finished_games
+
+
+def remove_partial_row(path):
+    # A crash while a row was being written can leave it without its line ending. It's cut off, so the rows
+    # appended when the run resumes start on a line of their own.
+    with open(path, "rb+") as results_file:
+        contents = results_file.read()
+        if len(contents) == 0 or contents.endswith(b"\n"):
+            return
+        results_file.truncate(contents.rfind(b"\n") + 1)
+
+
+def start_evaluation_server(worker_count, context):
+    import backends
+    import batching_evaluator
+    evaluators = {"strong": backends.strong_evaluator, "player model": backends.player_model_evaluator}
+    return batching_evaluator.EvaluationServer(evaluators, worker_count, config.EVALUATION_BATCH_SIZE,
+                                               config.EVALUATION_BATCH_DEADLINE, context)
+
+
+def run_trials(trials, worker_count, results_path):
+    finished_games = read_finished_games(results_path)
+    finished_keys = set()
+    for game in finished_games:
+        finished_keys.add((game["engine"], game["game_index"]))
+
+    pending_games = []
+    for engine in engines:
+        for game_index in range(trials):
+            if (engine, game_index) not in finished_keys:
+                pending_games.append((engine, game_index))
+
+    print("Resuming with " + str(len(finished_keys)) + " finished games, " + str(len(pending_games)) + " to play.")
+
+    write_header = not os.path.exists(results_path) or os.path.getsize(results_path) == 0
+    with open(results_path, "a", newline="") as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=results_fields)
+        if write_header:
+            writer.writeheader()
+
+        # Worker processes are spawned rather than forked, since the evaluation server runs threads.
+        context = multiprocessing.get_context("spawn")
+
+        evaluation_server = None
+        server_arguments = None
+        if config.USE_EVALUATION_SERVER:
+            evaluation_server = start_evaluation_server(worker_count, context)
+            server_arguments = evaluation_server.get_client_arguments()
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=worker_count, mp_context=context,
+                                                    initializer=initialize_worker,
+                                                    initargs=(server_arguments,)) as executor:
+            futures = []
+            for engine, game_index in pending_games:
+                futures.append(executor.submit(play_trial_game, engine, game_index, get_game_seed(game_index)))
+
+            completed_count = 0
+            for future in concurrent.futures.as_completed(futures):
+                game = future.result()
+                writer.writerow(game)
+                results_file.flush()
+                os.fsync(results_file.fileno())
+                finished_games.append(game)
+
+                completed_count += 1
+                print("Finished " + game["engine"] + " game " + str(game["game_index"]) + " in "
+                      + str(game["half_moves"]) + " half-moves (" + str(completed_count) + "/"
+                      + str(len(pending_games)) + ")")
+
+        if evaluation_server is not None:
+            print(evaluation_server.get_report())
+            evaluation_server.close()
+
+    return finished_games
+
+
+def print_summary(finished_games, trials):
+    print("")
+    for engine in engines:
+        half_moves = [game["half_moves"] for game in finished_games
+                      if game["engine"] == engine and game["game_index"] < trials]
+        if len(half_moves) == 0:
+            continue
+        print(engine + " average half-moves over " + str(len(half_moves)) + " games: "
+              + str(sum(half_moves) / len(half_moves)))
+
+
+if __name__ == "__main__":
+    print("Running trials...")
+    games = run_trials(config.NUMBER_OF_TRIALS, config.NUMBER_OF_TRIAL_WORKERS, config.PATH_TO_TRIAL_RESULTS)
+    print_summary(games, config.NUMBER_OF_TRIALS)
@@ -0,0 +1,116 @@
+import array
+import hashlib
+import sqlite3
+import threading
+
+
+class PersistentEvaluationCache:
+    # On-disk tier behind the in-memory evaluation cache, shared between runs and between processes.
+    # Evaluations are stored in SQLite in WAL mode, so any number of processes can read while one writes.
+    # Rows are keyed by (weights file digest, position key), so several networks can share one database file.
+
+    def __init__(self, path_to_database, path_to_weights):
+        self.weights_digest = get_file_digest(path_to_weights)
+
+        self.connection = sqlite3.connect(path_to_database, timeout=30.0, isolation_level=None,
+                                          check_same_thread=False)
+        self.lock = threading.Lock()
+
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS evaluations ("
+                                "weights_digest BLOB NOT NULL, "
+                                "position_key BLOB NOT NULL, "
+                                "expected_outcome REAL NOT NULL, "
+                                "moves TEXT NOT NULL, "
+                                "policies BLOB NOT NULL, "
+                                "PRIMARY KEY (weights_digest, position_key)) WITHOUT ROWID")
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get_many(self, keys):
+        # Returns a dictionary from each key found on disk to its (expected_outcome, move_policy_list) pair.
+        key_digests = {}
+        for key in keys:
+            key_digests[get_key_digest(key)] = key
+
+        found = {}
+        digests = list(key_digests.keys())
+        with self.lock:
+            for start in range(0, len(digests), QUERY_CHUNK_SIZE):
+                chunk = digests[start:start + QUERY_CHUNK_SIZE]
+                rows = self.connection.execute(
+                    "SELECT position_key, expected_outcome, moves, policies FROM evaluations "
+                    "WHERE weights_digest = ? AND position_key IN (" + ", ".join("?" * len(chunk)) + ")",
+                    [self.weights_digest] + chunk).fetchall()
+
+                for row in rows:
+                    found[key_digests[row[0]]] = (row[1], decode_policy(row[2], row[3]))
+
+        self.hits += len(found)
+        self.misses += len(key_digests) - len(found)
+        return found
+
+    def put_many(self, items):
+        # items is a list of (key, expected_outcome, move_policy_list) tuples.
+        rows = []
+        for item in items:
+            moves, policies = encode_policy(item[2])
+            rows.append((self.weights_digest, get_key_digest(item[0]), item[1], moves, policies))
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany("INSERT OR IGNORE INTO evaluations VALUES (?, ?, ?, ?, ?)", rows)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                # Otherwise the connection stays in the failed transaction and every later write fails too.
+                self.connection.execute("ROLLBACK")
+                raise
+
+        self.writes += len(rows)
+
+    def get_report(self):
+        return "Persistent evaluation cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses, " \
+               + str(self.writes) + " writes"
+
+
+# SQLite limits the number of parameters in one statement.
+QUERY_CHUNK_SIZE = 500
+
+
+def get_file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.digest()
+
+
+def get_key_digest(key):
+    # key is the (fen_string, moves) tuple used by the in-memory cache.
+    key_text = key[0] + "|" + " ".join(key[1])
+    return hashlib.blake2b(key_text.encode(), digest_size=16).digest()
+
+
+def encode_policy(move_policy_list):
+    # Moves are kept as one space-separated string and probabilities as a packed float64 array, so evaluations read
+    # back from disk are exactly the ones computed and a warm run picks the same moves as a cold one.
+    moves = " ".join(entry[0] for entry in move_policy_list)
+    policies = array.array("d", (entry[1] for entry in move_policy_list)).tobytes()
+    return moves, policies
+
+
+def decode_policy(moves, policies):
+    if moves == "":
+        return []
+    move_list = moves.split(" ")
+
+    policy_array = array.array("d")
+    if len(policies) != policy_array.itemsize * len(move_list):
+        raise ValueError("Corrupt cached policy: " + str(len(policies)) + " bytes for " + str(len(move_list))
+                         + " moves")
+    policy_array.frombytes(policies)
+    return list(zip(move_list, policy_array.tolist()))
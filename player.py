@@ -1,7 +1,9 @@
 import random
+import time
 import chess
 import chess.pgn
 import expectimax
+import batched_expectimax
 import stockfish_utility
 import leela_weights_greedy
 import maia_player_model
@@ -9,26 +11,85 @@ import stochastic_uct
 import fixed_stoch_uct
 import aggro_fixed_stoch_uct
 import blunder_creator
+import leaf_evaluators
+import transposition_table
+from game_position import get_search_position
+from search_clock import SearchLimits
 
 # Program will play a game of chess with you.
 
 # Options for the computer opponent are the following:
-# "blunder creator", "maia player model", "stockfish", "leela weights", "expectimax", "stochastic uct",
-# or "aggro fixed stochastic uct"
+# "blunder creator", "beam blunder creator", "maia player model", "stockfish", "leela weights", "expectimax",
+# "batched expectimax", "stochastic uct", or "aggro fixed stochastic uct"
 computer_engine = "aggro fixed stochastic uct"
 
+# Search settings. Moves the engine would play with less than own_move_cutoff policy probability aren't searched, and
+# nor are opponent replies Maia gives less than opponent_move_cutoff. Expectimax also drops lines whose probability
+# falls below expectimax_line_cutoff.
+own_move_cutoff = .01
+opponent_move_cutoff = .02
+expectimax_line_cutoff = .01
+
+# Beam blunder creator settings: plies searched, the engine's moves kept at each of its positions, and the share of
+# Maia's policy kept at each of the opponent's. The cost of a move grows with all three.
+beam_depth = 4
+beam_width = 3
+beam_reply_mass = .8
+
+# Leaves evaluated by the UCT engines on each move when they have no time control.
+uct_nodes_limits = {"stochastic uct": 2000, "fixed stochastic uct": 2000, "aggro fixed stochastic uct": 8000}
+
+# Leaf evaluator of the UCT engines: "leela" (the strong network), "stockfish" or "hybrid". Change it with
+# set_leaf_evaluator.
+leaf_evaluator = "leela"
+
 # Playing options.
 simulate_player = False
 suppress_game_text = False
 
+# Keep the aggro search tree between moves, so each search continues from the subtree of the moves actually played.
+# Off by default: the reused visits come on top of the node count, so it changes how strong the engine plays.
+reuse_search_tree = False
+aggro_search_session = aggro_fixed_stoch_uct.SearchSession()
+
+# Keep searching on the opponent's time. Only used with tree reuse and the aggro engine.
+pondering = False
+
+# Time control for "fixed stochastic uct", "aggro fixed stochastic uct" and "expectimax". With move_time set, each
+# move gets that many seconds. With clock_time set, the computer plays on a game clock of clock_time seconds plus
+# clock_increment per move. With neither, those engines search their fixed node counts and depth.
+move_time = None
+clock_time = None
+clock_increment = 0.0
+computer_time_left = None
+
+
+def get_search_limits():
+    if move_time is None and clock_time is None:
+        return None
+    if clock_time is None:
+        return SearchLimits(move_time=move_time)
+    return SearchLimits(move_time=move_time, time_left=computer_time_left, increment=clock_increment)
+
+
+def set_leaf_evaluator(name):
+    global leaf_evaluator
+    evaluator = leaf_evaluators.get_leaf_evaluator(name)
+    leaf_evaluator = name
+    stochastic_uct.leaf_evaluator = evaluator
+    fixed_stoch_uct.leaf_evaluator = evaluator
+    aggro_fixed_stoch_uct.leaf_evaluator = evaluator
+
+    # Values from the old evaluator are kept in the search tree and the transposition table.
+    aggro_search_session.clear()
+    transposition_table.shared_table.clear()
+
 
 def get_player_move(input_board):
     while True:
         if simulate_player:
-            position = []
-            for move in input_board.move_stack:
-                position.append(move.uci())
-            move_input = maia_player_model.get_move(position)
+            fen_string, position = get_search_position(input_board)
+            move_input = maia_player_model.get_move(position, fen_string)
             if not suppress_game_text:
                 print("Player move: " + move_input)
         else:
@@ -50,33 +111,70 @@ def get_player_move(input_board):
             print("Not a legal move.")
 
 
-def get_computer_move(input_board):
-    position = []
-    for move in input_board.move_stack:
-        position.append(move.uci())
+def get_computer_move(input_board, search_limits=None):
+    # search_limits (a search_clock.SearchLimits) overrides the time control options for the engines that support it.
+    if search_limits is None:
+        search_limits = get_search_limits()
+
+    # The engines search from the whole game, so repetitions count as draws inside the search. The evaluators only
+    # send the networks the last few moves.
+    fen_string, position = get_search_position(input_board)
 
     # Select computer engine.
     if computer_engine == "maia player model":
-        return maia_player_model.get_move(position)
+        return maia_player_model.get_move(position, fen_string)
     elif computer_engine == "blunder creator":
-        return blunder_creator.get_best_move(position)
+        return blunder_creator.get_best_move(position, fen_string)
+    elif computer_engine == "beam blunder creator":
+        return blunder_creator.get_best_move_beam(position, beam_depth, beam_width, beam_reply_mass, fen_string)
     elif computer_engine == "stockfish":
-        return stockfish_utility.get_best_move(position)
+        return stockfish_utility.get_best_move(position, fen_string)
     elif computer_engine == "leela weights":
-        return leela_weights_greedy.get_move(position)
+        return leela_weights_greedy.get_move(position, fen_string)
     elif computer_engine == "stochastic uct":
-        return stochastic_uct.get_best_move(position, 2000, .01, .02)
+        return stochastic_uct.get_best_move(position, uct_nodes_limits[computer_engine], own_move_cutoff,
+                                            opponent_move_cutoff, fen_string)
     elif computer_engine == "fixed stochastic uct":
-        return fixed_stoch_uct.get_best_move(position, 2000, .01, .02)
+        return fixed_stoch_uct.get_best_move(position, uct_nodes_limits[computer_engine], own_move_cutoff,
+                                             opponent_move_cutoff, search_limits, fen_string)
     elif computer_engine == "aggro fixed stochastic uct":
-        return aggro_fixed_stoch_uct.get_best_move(position, 8000, .01, .02)
+        if reuse_search_tree:
+            return aggro_fixed_stoch_uct.get_best_move(position, uct_nodes_limits[computer_engine], own_move_cutoff,
+                                                       opponent_move_cutoff, aggro_search_session, search_limits,
+                                                       fen_string)
+        return aggro_fixed_stoch_uct.get_best_move(position, uct_nodes_limits[computer_engine], own_move_cutoff,
+                                                   opponent_move_cutoff, search_limits=search_limits,
+                                                   fen_string=fen_string)
     elif computer_engine == "expectimax":
-        return expectimax.get_best_move(position, 4, .01, .01, .02)
+        return expectimax.get_best_move(position, 4, expectimax_line_cutoff, own_move_cutoff, opponent_move_cutoff,
+                                        search_limits, fen_string)
+    elif computer_engine == "batched expectimax":
+        return batched_expectimax.get_best_move(position, 4, expectimax_line_cutoff, own_move_cutoff,
+                                                opponent_move_cutoff, fen_string)
     else:
         print("Computer engine is not specified.")
         exit(1)
 
 
+def get_timed_computer_move(input_board):
+    # Gets the computer's move and charges the time it took to the computer's clock.
+    global computer_time_left
+    start_time = time.monotonic()
+    computer_move = get_computer_move(input_board)
+    if computer_time_left is not None:
+        computer_time_left += clock_increment - (time.monotonic() - start_time)
+    return computer_move
+
+
+def start_pondering(input_board):
+    if not pondering or not reuse_search_tree or computer_engine != "aggro fixed stochastic uct":
+        return
+    if len(input_board.move_stack) == 0:
+        return
+
+    aggro_search_session.start_pondering(input_board.peek().uci(), uct_nodes_limits[computer_engine])
+
+
 def play_game(play_random=True, is_computer_white=True):
     computer_plays_white = None
     if play_random:
@@ -91,16 +189,23 @@ def play_game(play_random=True, is_computer_white=True):
             print("Let's have a game! You can go first.")
         print("Type a move in long algebraic notation to play, or type 'Show' to show the board!")
 
+    # Search trees from a previous game are of no use in this one.
+    aggro_search_session.clear()
+
+    global computer_time_left
+    computer_time_left = clock_time
+
     board = chess.Board()
 
     if computer_plays_white:
         # Play first move.
-        computer_move = get_computer_move(board)
+        computer_move = get_timed_computer_move(board)
         board.push(chess.Move.from_uci(computer_move))
         if not suppress_game_text:
             print(computer_move)
 
     while True:
+        start_pondering(board)
         player_move = get_player_move(board)
         board.push(player_move)
 
@@ -121,7 +226,7 @@ def play_game(play_random=True, is_computer_white=True):
                     print("A draw!")
             break
 
-        computer_move = get_computer_move(board)
+        computer_move = get_timed_computer_move(board)
         board.push(chess.Move.from_uci(computer_move))
         if not suppress_game_text:
             print(computer_move)
@@ -145,6 +250,8 @@ def play_game(play_random=True, is_computer_white=True):
                     print("A draw!")
             break
 
+    aggro_search_session.stop_pondering()
+
     if not suppress_game_text:
         print("Good game! Let's play again soon.")
 
@@ -0,0 +1,197 @@
+import math
+import time
+
+# Time management for the searches. A search is given SearchLimits (a fixed time per move, or the game clock and
+# increment, and optionally a node cap), and checks a SearchClock between iterations to know when to stop.
+
+# When the number of moves left to the next time control isn't known, the clock is shared as if this many were left.
+default_moves_to_go = 30
+
+# Share of the increment spent on each move, on top of the clock share.
+increment_share = 0.75
+
+# A move never takes more than this share of the remaining clock.
+maximum_clock_share = 0.5
+
+# Seconds kept back on every move for everything outside the search (move transmission, GUI, process start-up).
+move_overhead = 0.05
+
+# Seconds between progress reports sent to a search's info_callback.
+info_interval = 1.0
+
+
+class SearchLimits:
+    # Any combination of limits can be given; the search stops at the first one it reaches.
+    # move_time: seconds for this move. time_left, increment: the engine's game clock and increment, in seconds.
+    # moves_to_go: moves left to the next time control, if known. nodes_limit: maximum number of nodes.
+    # depth: maximum depth, for depth-limited searches.
+    # stop_event: a threading.Event that stops the search when set, e.g. by another thread.
+    # pondering: if True, the clock limits don't apply until ponderhit is called (searching on the opponent's time).
+    # info_callback: called as info_callback(search_clock, win_probability, principal_variation, depth) with the
+    # search's progress every info_interval seconds and when it finishes. win_probability and depth may be None.
+
+    def __init__(self, move_time=None, time_left=None, increment=0.0, moves_to_go=None, nodes_limit=None,
+                 depth=None, stop_event=None, pondering=False, info_callback=None):
+        self.move_time = move_time
+        self.time_left = time_left
+        self.increment = increment
+        self.moves_to_go = moves_to_go
+        self.nodes_limit = nodes_limit
+        self.depth = depth
+        self.stop_event = stop_event
+        self.pondering = pondering
+        self.info_callback = info_callback
+        self.ponderhit_time = None
+
+    def ponderhit(self):
+        # The opponent played the expected move, so the search is now on the engine's own clock.
+        self.ponderhit_time = time.monotonic()
+        self.pondering = False
+
+    def get_time_budget(self):
+        # Seconds the search may spend on this move, or None if it has no time limit.
+        budgets = []
+        if self.move_time is not None:
+            budgets.append(self.move_time - move_overhead)
+
+        if self.time_left is not None:
+            moves_to_go = self.moves_to_go
+            if moves_to_go is None or moves_to_go <= 0:
+                moves_to_go = default_moves_to_go
+            clock_budget = self.time_left / moves_to_go + self.increment * increment_share
+            clock_budget = min(clock_budget, self.time_left * maximum_clock_share)
+            budgets.append(clock_budget - move_overhead)
+
+        if len(budgets) == 0:
+            return None
+        return max(0.0, min(budgets))
+
+
+class SearchClock:
+    # Tracks one search against its limits, and collects the numbers for its report.
+    # evaluators are the search's neural network evaluators, whose backend calls are counted.
+
+    def __init__(self, search_limits, evaluators=()):
+        self.start_time = time.monotonic()
+        self.search_limits = search_limits
+        self.nodes_limit = search_limits.nodes_limit
+        self.node_count = 0
+        self.stop_reason = None
+        self.last_info_time = self.start_time
+
+        self.evaluators = list(evaluators)
+        self.start_backend_calls = []
+        for evaluator in self.evaluators:
+            self.start_backend_calls.append(evaluator.backend_call_count)
+
+    def get_elapsed_time(self):
+        return time.monotonic() - self.start_time
+
+    def get_time_budget(self):
+        # Seconds from the start of the search that it may run for, or None without a time limit. A pondering search
+        # has no time limit, and its budget only starts counting at the ponderhit.
+        if self.search_limits.pondering:
+            return None
+        time_budget = self.search_limits.get_time_budget()
+        if time_budget is None or self.search_limits.ponderhit_time is None:
+            return time_budget
+        return time_budget + max(0.0, self.search_limits.ponderhit_time - self.start_time)
+
+    def get_remaining_time(self):
+        time_budget = self.get_time_budget()
+        if time_budget is None:
+            return math.inf
+        return time_budget - self.get_elapsed_time()
+
+    def get_remaining_nodes(self):
+        # Nodes the search can still expect to reach, from the node cap and from the speed so far.
+        remaining_nodes = math.inf
+        if self.nodes_limit is not None:
+            remaining_nodes = self.nodes_limit - self.node_count
+
+        remaining_time = self.get_remaining_time()
+        if not math.isinf(remaining_time):
+            elapsed_time = self.get_elapsed_time()
+            if elapsed_time > 0 and self.node_count > 0:
+                remaining_nodes = min(remaining_nodes, self.node_count / elapsed_time * remaining_time)
+
+        return max(0, remaining_nodes)
+
+    def is_out_of_budget(self):
+        # Checks the node and time limits, recording which one stopped the search.
+        if self.stop_reason is not None:
+            return True
+        if self.search_limits.stop_event is not None and self.search_limits.stop_event.is_set():
+            self.stop_reason = "stop requested"
+        elif self.nodes_limit is not None and self.node_count >= self.nodes_limit:
+            self.stop_reason = "node limit"
+        elif self.get_remaining_time() <= 0:
+            self.stop_reason = "time limit"
+        return self.stop_reason is not None
+
+    def stop(self, stop_reason):
+        if self.stop_reason is None:
+            self.stop_reason = stop_reason
+
+    def report_progress(self, get_best_line, depth=None, force=False):
+        # Sends the search's progress to the limits' info_callback, at most every info_interval seconds unless forced.
+        # get_best_line returns (win_probability, principal_variation) and is only called when a report is sent.
+        if self.search_limits.info_callback is None:
+            return
+        current_time = time.monotonic()
+        if not force and current_time - self.last_info_time < info_interval:
+            return
+        self.last_info_time = current_time
+
+        win_probability, principal_variation = get_best_line()
+        self.search_limits.info_callback(self, win_probability, principal_variation, depth)
+
+    def get_nodes_per_second(self):
+        elapsed_time = self.get_elapsed_time()
+        if elapsed_time <= 0:
+            return 0.0
+        return self.node_count / elapsed_time
+
+    def get_backend_call_count(self):
+        backend_call_count = 0
+        for index in range(len(self.evaluators)):
+            backend_call_count += self.evaluators[index].backend_call_count - self.start_backend_calls[index]
+        return backend_call_count
+
+    def get_report(self):
+        return "Search: " + str(self.node_count) + " nodes in " + str(round(self.get_elapsed_time(), 3)) + " s (" \
+               + str(round(self.get_nodes_per_second())) + " nodes/s), " + str(self.get_backend_call_count()) \
+               + " NN calls, stopped by " + str(self.stop_reason)
+
+
+def can_best_child_be_overtaken(children, remaining_visits, lowest_value, highest_value):
+    # Searches pick the visited child with the highest mean value. It can no longer be overtaken if, even with the
+    # remaining visits all going to it at lowest_value, its mean stays above what any other child could reach with
+    # all the remaining visits at highest_value. Leaf values are assumed to stay within [lowest_value, highest_value].
+    best_child = None
+    best_mean = -math.inf
+    for child in children:
+        if child.visit_count > 0 and child.total_value / child.visit_count > best_mean:
+            best_mean = child.total_value / child.visit_count
+            best_child = child
+
+    if best_child is None:
+        return True
+
+    if math.isinf(remaining_visits):
+        return True
+
+    lowest_best_mean = (best_child.total_value + remaining_visits * lowest_value) \
+        / (best_child.visit_count + remaining_visits)
+
+    for child in children:
+        if child == best_child:
+            continue
+        if child.visit_count + remaining_visits <= 0:
+            continue
+        highest_child_mean = (child.total_value + remaining_visits * highest_value) \
+            / (child.visit_count + remaining_visits)
+        if highest_child_mean >= lowest_best_mean:
+            return True
+
+    return False
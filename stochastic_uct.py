@@ -1,21 +1,34 @@
 import backends
 from treenode import TreeNode
-import chess
+from board_cursor import BoardCursor
+from game_position import is_white_to_move
 
 
 weak_evaluator = backends.player_model_evaluator
 strong_evaluator = backends.strong_evaluator
 
+# Values the leaves of the search, e.g. with Stockfish instead of the strong network (see leaf_evaluators.py). The
+# strong network still supplies the policies for culling the engine's own moves.
+leaf_evaluator = strong_evaluator
+
 
 playing_as_white = None
 opponent_probability_cutoff = 0.0
 engine_culling_cutoff = 0.0
 tendril_count = 16
 
+board_cursor = None
+
+# Positions are moves played since curr_fen_string (the empty string stands for the start of the game).
+curr_fen_string = ""
+
+
+def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probability_cutoff, fen_string=""):
+    global curr_fen_string
+    curr_fen_string = fen_string
 
-def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probability_cutoff):
     global playing_as_white
-    playing_as_white = len(position) % 2 == 0
+    playing_as_white = is_white_to_move(position, fen_string)
 
     global engine_culling_cutoff
     engine_culling_cutoff = own_probability_cutoff
@@ -23,12 +36,15 @@ def get_best_move(position, nodes_limit, own_probability_cutoff, enemy_probabili
     global opponent_probability_cutoff
     opponent_probability_cutoff = enemy_probability_cutoff
 
-    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position)
+    global board_cursor
+    board_cursor = BoardCursor(position, fen_string)
+
+    root_node = TreeNode(total_value=0, visit_count=0, probability=1.0, position=position, fen_string=fen_string)
 
+    # Perform uct iterations until nodes_limit leaves have been evaluated, as the other UCT engines count them.
     nodes_count = 0
-    while nodes_count < nodes_limit // tendril_count:
-        perform_iteration(root_node)
-        nodes_count += 1
+    while nodes_count < nodes_limit:
+        nodes_count += perform_iteration(root_node)
 
     best_move = root_node.get_best_move()
     if best_move is None:
@@ -62,12 +78,12 @@ def perform_iteration(root_node):
 
     for index in range(len(leaf_nodes)):
         # Skip expansion if the node is terminal.
-        if is_terminal_position(leaf_nodes[index].position):
+        if leaf_nodes[index].is_terminal(board_cursor):
             pass
         elif leaf_nodes[index].visit_count > 0:
             if leaf_nodes[index].is_own_move(playing_as_white):
                 # Own move node
-                legal_moves = get_legal_moves_from_position(leaf_nodes[index].position)
+                legal_moves = get_legal_moves_from_node(leaf_nodes[index])
                 probabilities = []
                 for i in range(len(legal_moves)):
                     probabilities.append(1.0)
@@ -81,7 +97,7 @@ def perform_iteration(root_node):
                 chance_nodes.append(leaf_nodes[index])
                 chance_node_positions.append(leaf_nodes[index].position)
 
-    chance_evaluations = weak_evaluator.get_evaluations_from_moves(chance_node_positions)
+    chance_evaluations = weak_evaluator.get_evaluations_from_moves(chance_node_positions, curr_fen_string)
     for index in range(len(chance_nodes)):
         leaf_index = leaf_nodes.index(chance_nodes[index])
         probability_distribution = chance_evaluations[index].move_policy_list
@@ -100,11 +116,11 @@ def perform_iteration(root_node):
 
     for leaf in leaf_nodes:
         positions.append(leaf.position)
-    expected_values = strong_evaluator.get_expected_outcomes_from_moves(positions)
+    expected_values = leaf_evaluator.get_expected_outcomes_from_moves(positions, fen_string=curr_fen_string)
 
     for index in range(len(leaf_nodes)):
-        if is_terminal_position(leaf_nodes[index].position):
-            expected_values[index] = get_result(leaf_nodes[index].position, playing_as_white)
+        if leaf_nodes[index].is_terminal(board_cursor):
+            expected_values[index] = leaf_nodes[index].get_result(board_cursor, playing_as_white)
         else:
             expected_values[index] = (expected_values[index] + 1.0) / 2.0
 
@@ -125,20 +141,16 @@ def perform_iteration(root_node):
 
             curr_node = curr_node.parent
 
+    return len(leaf_nodes)
 
-def get_legal_moves_from_position(moves_list):
 
-    if engine_culling_cutoff <= 0.0:
-        board = chess.Board()
-        for move in moves_list:
-            board.push_uci(move)
+def get_legal_moves_from_node(node):
 
-        legal_moves = []
-        for legal_move in board.legal_moves:
-            legal_moves.append(legal_move.uci())
+    if engine_culling_cutoff <= 0.0:
+        legal_moves = node.get_legal_moves(board_cursor)
 
     else:
-        evaluation = strong_evaluator.get_full_evaluation_from_moves(moves_list)
+        evaluation = strong_evaluator.get_full_evaluation_from_moves(node.position, curr_fen_string)
         policies_list = evaluation.move_policy_list
 
         # Remove the most unpromising moves.
@@ -151,37 +163,6 @@ def get_legal_moves_from_position(moves_list):
     return legal_moves
 
 
-def is_terminal_position(position):
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
-
-    outcome = board.outcome(claim_draw=True)
-    if outcome is not None:
-        return True
-    else:
-        return False
-
-
-def get_result(position, is_white):
-
-    board = chess.Board()
-    for move in position:
-        board.push_uci(move)
-    outcome = board.outcome(claim_draw=True)
-    if outcome.result() == "1-0":
-        result = 1.0
-    elif outcome.result() == "0-1":
-        result = 0.0
-    else:
-        result = 0.5
-
-    if not is_white:
-        result = 1.0 - result
-
-    return result
-
-
 def get_simplified_probability_distribution(distribution, cutoff):
 
     new_distribution = []
@@ -208,7 +189,7 @@ def probability_distribution_sort(entry):
 # Quickly return the legal move with the highest policy value.
 def get_best_legal_move(position):
 
-    evaluation = strong_evaluator.get_full_evaluation_from_moves(position)
+    evaluation = strong_evaluator.get_full_evaluation_from_moves(position, curr_fen_string)
     legal_moves = evaluation.move_policy_list
     legal_moves.sort(key=probability_distribution_sort, reverse=True)
 
@@ -216,9 +197,12 @@ def get_best_legal_move(position):
 
 
 def remove_list_duplicates(input_list):
+    # Keeps the first occurrence of each element. Nodes hash by identity, so this is linear in the list length.
     output_list = []
+    seen_elements = set()
     for element in input_list:
-        if element not in output_list:
+        if element not in seen_elements:
+            seen_elements.add(element)
             output_list.append(element)
 
     return output_list
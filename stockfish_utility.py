@@ -1,24 +1,172 @@
+import concurrent.futures
+import contextlib
+import queue
+import threading
 import config
 from stockfish import Stockfish
+from board_cursor import get_outcome_value
+from game_position import get_board, is_white_to_move
 
 
-strong_stockfish = Stockfish(path=config.PATH_TO_STOCKFISH, depth=12)
-weak_stockfish = Stockfish(path=config.PATH_TO_STOCKFISH, depth=12)
+# Depth searched by requests that don't give their own limits.
+default_depth = 12
 
 
-def get_best_move(position):
-    strong_stockfish.set_position(position)
-    return strong_stockfish.get_best_move()
+class StockfishWorker(Stockfish):
+    # One persistent Stockfish process. The stockfish package always searches to its fixed depth, so _go is overridden
+    # to send each request's own limits instead.
 
+    def __init__(self, path):
+        # WDL output stays on, so get_wdl_stats doesn't switch it on and off around every search.
+        super().__init__(path=path, depth=default_depth, parameters={"UCI_ShowWDL": "true"})
+        self.go_command = get_go_command()
 
-def get_value_at_position(position):
-    # Returns objective evaluation (from white's perspective)
-    playing_as_white = len(position) % 2 == 0
+    def _go(self):
+        self._put(self.go_command)
 
-    weak_stockfish.set_position(position)
+    def set_limits(self, depth=None, nodes=None, move_time=None):
+        self.go_command = get_go_command(depth, nodes, move_time)
 
-    wdl = weak_stockfish.get_wdl_stats()
+    def set_game_position(self, position, fen_string=""):
+        # position is the list of moves played since fen_string, or since the start of the game if fen_string is empty.
+        if fen_string == "":
+            self.set_position(position)
+        else:
+            self.set_fen_position(fen_string)
+            self.make_moves_from_current_position(position)
 
+
+def get_go_command(depth=None, nodes=None, move_time=None):
+    # Search limits for one request: depth in plies, nodes, and move_time in seconds. The search stops at the first
+    # limit it reaches, and searches to default_depth if none is given.
+    go_command = "go"
+    if depth is not None:
+        go_command += " depth " + str(depth)
+    if nodes is not None:
+        go_command += " nodes " + str(nodes)
+    if move_time is not None:
+        go_command += " movetime " + str(max(1, round(move_time * 1000)))
+    if go_command == "go":
+        go_command += " depth " + str(default_depth)
+    return go_command
+
+
+class StockfishPool:
+    # Up to size persistent Stockfish processes, shared by every thread of this process. A request checks out an idle
+    # worker, or waits for one, so that many positions can be searched at once rather than one after another.
+    # Processes are only started when a request finds no idle worker, and are then kept for later requests.
+
+    def __init__(self, size, path=config.PATH_TO_STOCKFISH):
+        self.size = size
+        self.path = path
+
+        self.idle_workers = queue.LifoQueue()
+        self.worker_count = 0
+        self.lock = threading.Lock()
+
+        # Runs the requests of batched calls in parallel. Created on first use.
+        self.executor = None
+
+    @contextlib.contextmanager
+    def checkout(self):
+        # with pool.checkout() as worker: ... gives the block a worker of its own. A worker whose request fails is
+        # dropped, since its process may be left in the middle of a search.
+        worker = self.get_idle_worker()
+        try:
+            yield worker
+        except BaseException:
+            self.discard(worker)
+            raise
+        self.idle_workers.put(worker)
+
+    def get_idle_worker(self):
+        while True:
+            try:
+                return self.idle_workers.get_nowait()
+            except queue.Empty:
+                pass
+
+            with self.lock:
+                start_worker = self.worker_count < self.size
+                if start_worker:
+                    self.worker_count += 1
+
+            if start_worker:
+                break
+
+            # Checked again now and then, in case a failed worker was dropped and a new one can be started instead.
+            try:
+                return self.idle_workers.get(timeout=1.0)
+            except queue.Empty:
+                pass
+
+        try:
+            return StockfishWorker(self.path)
+        except BaseException:
+            with self.lock:
+                self.worker_count -= 1
+            raise
+
+    def discard(self, worker):
+        # The process is stopped when the worker is garbage collected.
+        with self.lock:
+            self.worker_count -= 1
+
+    def get_best_move(self, position, fen_string="", depth=None, nodes=None, move_time=None):
+        with self.checkout() as worker:
+            worker.set_limits(depth, nodes, move_time)
+            worker.set_game_position(position, fen_string)
+            return worker.get_best_move()
+
+    def get_wdl_stats(self, position, fen_string="", depth=None, nodes=None, move_time=None):
+        # Win, draw and loss counts out of 1000 for the side to move, or None if the game is over.
+        with self.checkout() as worker:
+            worker.set_limits(depth, nodes, move_time)
+            worker.set_game_position(position, fen_string)
+            return worker.get_wdl_stats()
+
+    def get_value_at_position(self, position, fen_string="", depth=None, nodes=None, move_time=None):
+        # Returns objective evaluation (from white's perspective)
+        wdl = self.get_wdl_stats(position, fen_string, depth, nodes, move_time)
+        if wdl is None:
+            # Checkmate or stalemate, which Stockfish has no stats for.
+            return get_outcome_value(get_board(position, fen_string).outcome())
+        return get_position_value(wdl, is_white_to_move(position, fen_string))
+
+    def get_values_at_positions(self, positions, fen_string="", depth=None, nodes=None, move_time=None):
+        # get_value_at_position for a batch of positions, spread across the pool's workers.
+        if len(positions) == 0:
+            return []
+        if len(positions) == 1:
+            return [self.get_value_at_position(positions[0], fen_string, depth, nodes, move_time)]
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.size)
+
+        futures = []
+        for position in positions:
+            futures.append(self.executor.submit(self.get_value_at_position, position, fen_string, depth, nodes,
+                                                move_time))
+        return [future.result() for future in futures]
+
+    def close(self):
+        # Stops every idle worker. Workers still checked out are stopped when they are garbage collected.
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown()
+
+        while True:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(worker)
+
+
+def get_position_value(wdl, playing_as_white):
     if not playing_as_white:
         wdl.reverse()
 
@@ -29,3 +177,18 @@ def get_value_at_position(position):
     position_value += (wdl[1] / 2.0) / wdl_total
 
     return position_value
+
+
+pool = StockfishPool(config.STOCKFISH_POOL_SIZE)
+
+
+def get_best_move(position, fen_string="", depth=None, nodes=None, move_time=None):
+    return pool.get_best_move(position, fen_string, depth, nodes, move_time)
+
+
+def get_value_at_position(position, fen_string="", depth=None, nodes=None, move_time=None):
+    return pool.get_value_at_position(position, fen_string, depth, nodes, move_time)
+
+
+def get_values_at_positions(positions, fen_string="", depth=None, nodes=None, move_time=None):
+    return pool.get_values_at_positions(positions, fen_string, depth, nodes, move_time)
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+import config
+
+
+class TranspositionEntry:
+    def __init__(self, search_generation):
+        # Search statistics, shared by every node that reaches this position during one search.
+        self.visit_count = 0
+        self.total_value = 0
+        self.search_generation = search_generation
+
+        # Cached neural network evaluations. These don't depend on the search, so they survive between searches.
+        self.weak_policy = None
+        self.strong_value = None
+
+
+class TranspositionTable:
+    # Positions are keyed by their Zobrist hash, so transposed move orders share one entry.
+    # The table holds at most capacity entries. When it's full, the least recently used entry is replaced.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.search_generation = 0
+
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.policy_hits = 0
+        self.policy_misses = 0
+        self.value_hits = 0
+        self.value_misses = 0
+
+    def new_search(self):
+        # Search statistics from earlier searches are stale, so entries get lazily reset the next time they're used.
+        self.search_generation += 1
+
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.policy_hits = 0
+        self.policy_misses = 0
+        self.value_hits = 0
+        self.value_misses = 0
+
+    def clear(self):
+        # Drops every entry, e.g. when a network is swapped and the cached evaluations no longer apply.
+        self.entries.clear()
+
+    def lookup(self, entry):
+        # Every access to an entry a node holds goes through here, so an entry kept from an earlier search has its
+        # stale statistics reset before they are read or added to.
+        if entry.search_generation != self.search_generation:
+            entry.visit_count = 0
+            entry.total_value = 0
+            entry.search_generation = self.search_generation
+        return entry
+
+    def get_entry(self, key):
+        self.lookups += 1
+
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = TranspositionEntry(self.search_generation)
+            self.entries[key] = entry
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self.lookup(entry)
+
+        return entry
+
+    def get_report(self):
+        return "Transposition table: " + str(len(self.entries)) + " entries, " \
+               + get_rate_text(self.hits, self.lookups) + " position hits, " \
+               + get_rate_text(self.policy_hits, self.policy_hits + self.policy_misses) + " Maia policy hits, " \
+               + get_rate_text(self.value_hits, self.value_hits + self.value_misses) + " Leela value hits, " \
+               + str(self.policy_hits + self.value_hits) + " NN evaluations saved, " \
+               + str(self.evictions) + " evictions"
+
+
+def get_node_entry(table, node, board_cursor):
+    # The entry of a search tree node's position, found by its Zobrist key the first time and kept on the node.
+    if node.entry is None:
+        node.entry = table.get_entry(board_cursor.get_zobrist_key(node.position))
+        return node.entry
+    return table.lookup(node.entry)
+
+
+def get_weak_policies(table, nodes, evaluator, fen_string, board_cursor):
+    # Maia's move policy for each node. Positions cached in table aren't sent to the network; with no table (None),
+    # every position is.
+    if table is None:
+        positions = []
+        for node in nodes:
+            positions.append(node.position)
+        evaluations = evaluator.get_evaluations_from_moves(positions, fen_string)
+        return [evaluation.move_policy_list for evaluation in evaluations]
+
+    policies = [None] * len(nodes)
+    missing_indices = []
+    for index in range(len(nodes)):
+        entry = get_node_entry(table, nodes[index], board_cursor)
+        if entry.weak_policy is not None:
+            policies[index] = entry.weak_policy
+            table.policy_hits += 1
+        else:
+            missing_indices.append(index)
+            table.policy_misses += 1
+
+    if len(missing_indices) > 0:
+        positions = []
+        for index in missing_indices:
+            positions.append(nodes[index].position)
+        evaluations = evaluator.get_evaluations_from_moves(positions, fen_string)
+
+        for evaluation_index in range(len(missing_indices)):
+            entry = get_node_entry(table, nodes[missing_indices[evaluation_index]], board_cursor)
+            entry.weak_policy = evaluations[evaluation_index].move_policy_list
+            policies[missing_indices[evaluation_index]] = entry.weak_policy
+
+    return policies
+
+
+def get_strong_values(table, nodes, evaluator, fen_string, board_cursor):
+    # Objective expected outcome for each node. Positions cached in table aren't sent to the network; with no table
+    # (None), every position is.
+    positions = []
+    if table is None:
+        for node in nodes:
+            positions.append(node.position)
+        return evaluator.get_expected_outcomes_from_moves(positions, fen_string=fen_string)
+
+    values = [None] * len(nodes)
+    missing_indices = []
+    for index in range(len(nodes)):
+        entry = get_node_entry(table, nodes[index], board_cursor)
+        if entry.strong_value is not None:
+            values[index] = entry.strong_value
+            table.value_hits += 1
+        else:
+            missing_indices.append(index)
+            positions.append(nodes[index].position)
+            table.value_misses += 1
+
+    if len(missing_indices) > 0:
+        evaluations = evaluator.get_expected_outcomes_from_moves(positions, fen_string=fen_string)
+
+        for evaluation_index in range(len(missing_indices)):
+            entry = get_node_entry(table, nodes[missing_indices[evaluation_index]], board_cursor)
+            entry.strong_value = evaluations[evaluation_index]
+            values[missing_indices[evaluation_index]] = entry.strong_value
+
+    return values
+
+
+def get_rate_text(hits, total):
+    if total == 0:
+        return "0/0"
+    return str(hits) + "/" + str(total) + " (" + str(round(hits / total * 100, 1)) + "%)"
+
+
+shared_table = TranspositionTable(config.TRANSPOSITION_TABLE_SIZE)
@@ -0,0 +1,215 @@
+import chess
+import random
+from array import array
+from game_position import is_white_to_move
+
+
+# Board states kept per node. The search only needs to know whether a position is over and, if so, how it ended.
+BOARD_STATE_UNKNOWN = 0
+BOARD_STATE_ONGOING = 1
+BOARD_STATE_WHITE_WON = 2
+BOARD_STATE_BLACK_WON = 3
+BOARD_STATE_DRAWN = 4
+
+NO_NODE = -1
+
+
+def encode_move(move):
+    # Packs a move in LAN into 15 bits: from square, to square and promotion piece type.
+    chess_move = chess.Move.from_uci(move)
+    promotion = chess_move.promotion if chess_move.promotion is not None else 0
+    return chess_move.from_square | (chess_move.to_square << 6) | (promotion << 12)
+
+
+def decode_move(code):
+    promotion = code >> 12
+    if promotion == 0:
+        promotion = None
+    return chess.Move(code & 63, (code >> 6) & 63, promotion).uci()
+
+
+def get_board_state(outcome):
+    if outcome is None:
+        return BOARD_STATE_ONGOING
+    elif outcome.result() == "1-0":
+        return BOARD_STATE_WHITE_WON
+    elif outcome.result() == "0-1":
+        return BOARD_STATE_BLACK_WON
+    else:
+        return BOARD_STATE_DRAWN
+
+
+class TreeStore:
+    # Structure-of-arrays storage for a search tree. Node i is described by the i-th entry of each array, a node only
+    # stores the move that leads to it, and its position is rebuilt from the root position when it is asked for.
+    # Children are always created together, so they sit next to each other and a node only needs to know where its
+    # first child is and how many there are.
+    # That comes to about 70 bytes per node, against a few hundred for a tree of Python objects (treenode.TreeNode).
+
+    def __init__(self, root_position, capacity=4096, random_generator=None, fen_string=""):
+        # Positions are moves played since fen_string (or since the start of the game if there is no FEN).
+        self.root_position = list(root_position)
+        self.fen_string = fen_string
+        self.root_white_to_move = is_white_to_move(root_position, fen_string)
+
+        # Chance nodes sample their children with this generator (anything with a random() method, such as a seeded
+        # random.Random). By default it's the random module's shared generator.
+        if random_generator is None:
+            random_generator = random
+        self.random_generator = random_generator
+
+        self.node_count = 0
+        self.capacity = 0
+
+        self.total_values = array("d")
+        self.visit_counts = array("q")
+        self.pending_visits = array("q")
+        self.probabilities = array("d")
+        # Running sum of the probabilities of a node and its earlier siblings, so children can be sampled by bisection.
+        self.cumulative_probabilities = array("d")
+        self.parents = array("q")
+        self.first_children = array("q")
+        self.child_counts = array("H")
+        self.moves = array("H")
+        self.depths = array("H")
+        self.board_states = array("B")
+
+        # Sparse per-node data: transposition table entries, only set by transposition-aware searches.
+        self.entries = {}
+
+        # Value assumed for a visit that is still pending (virtual loss). Pending visits make a node look more explored
+        # and less promising, so the descents of one iteration spread across different leaves instead of piling onto
+        # one. It has to be pessimistic to do that, so the aggro search sets it to the lowest value a leaf can have.
+        # It's kept per tree, as searches running at once may value their leaves differently.
+        self.virtual_loss_value = 0.0
+
+        self.reserve(capacity)
+        self.add_node(NO_NODE, 0, 1.0, 0)
+
+    def reserve(self, capacity):
+        # Grows every array to hold capacity nodes, so the search doesn't reallocate on every expansion.
+        if capacity <= self.capacity:
+            return
+        extra = capacity - self.capacity
+        self.total_values.extend(array("d", [0.0]) * extra)
+        self.visit_counts.extend(array("q", [0]) * extra)
+        self.pending_visits.extend(array("q", [0]) * extra)
+        self.probabilities.extend(array("d", [0.0]) * extra)
+        self.cumulative_probabilities.extend(array("d", [0.0]) * extra)
+        self.parents.extend(array("q", [NO_NODE]) * extra)
+        self.first_children.extend(array("q", [NO_NODE]) * extra)
+        self.child_counts.extend(array("H", [0]) * extra)
+        self.moves.extend(array("H", [0]) * extra)
+        self.depths.extend(array("H", [0]) * extra)
+        self.board_states.extend(array("B", [BOARD_STATE_UNKNOWN]) * extra)
+        self.capacity = capacity
+
+    def add_node(self, parent, move_code, probability, depth):
+        if self.node_count >= self.capacity:
+            self.reserve(self.capacity * 2)
+
+        index = self.node_count
+        self.parents[index] = parent
+        self.moves[index] = move_code
+        self.probabilities[index] = probability
+        self.depths[index] = depth
+        self.node_count += 1
+        return index
+
+    def add_children(self, index, probability_distribution):
+        # probability_distribution needs to be a list of tuples of the form ('move', probability)
+        if len(probability_distribution) == 0:
+            return
+        self.reserve_for(len(probability_distribution))
+        self.first_children[index] = self.node_count
+        self.child_counts[index] = len(probability_distribution)
+        depth = self.depths[index] + 1
+        cumulative_probability = 0.0
+        for entry in probability_distribution:
+            child_index = self.add_node(index, encode_move(entry[0]), entry[1], depth)
+            cumulative_probability += entry[1]
+            self.cumulative_probabilities[child_index] = cumulative_probability
+
+    def reserve_for(self, node_count):
+        capacity = self.capacity
+        while self.node_count + node_count > capacity:
+            capacity *= 2
+        self.reserve(capacity)
+
+    def get_children(self, index):
+        first_child = self.first_children[index]
+        return range(first_child, first_child + self.child_counts[index])
+
+    def get_move(self, index):
+        return decode_move(self.moves[index])
+
+    def get_position(self, index):
+        moves = []
+        while index > 0:
+            moves.append(decode_move(self.moves[index]))
+            index = self.parents[index]
+        moves.reverse()
+        return self.root_position + moves
+
+    def get_position_length(self, index):
+        return len(self.root_position) + self.depths[index]
+
+    def is_white_to_move(self, index):
+        # Every depth of the tree alternates sides, starting with the root's side to move.
+        return self.root_white_to_move == (self.depths[index] % 2 == 0)
+
+    def extract_subtree(self, index, root_position=None, fen_string=None):
+        # Copies the subtree below index into a new store rooted at it. The rest of this tree can then be dropped.
+        # root_position and fen_string describe the new root, if it should be given from another FEN.
+        # Transposition table entries aren't copied: their statistics belong to the search that set them, and nodes
+        # look their entries up again when they are next evaluated.
+        if root_position is None:
+            root_position = self.get_position(index)
+            fen_string = self.fen_string
+        subtree = TreeStore(root_position, max(4096, self.count_subtree_nodes(index)), self.random_generator,
+                            fen_string)
+        subtree.total_values[0] = self.total_values[index]
+        subtree.visit_counts[0] = self.visit_counts[index]
+        subtree.board_states[0] = self.board_states[index]
+
+        # Breadth-first copy, which keeps each node's children next to each other.
+        queue = [(index, 0)]
+        queue_position = 0
+        while queue_position < len(queue):
+            old_index, new_index = queue[queue_position]
+            queue_position += 1
+
+            child_count = self.child_counts[old_index]
+            if child_count == 0:
+                continue
+
+            subtree.first_children[new_index] = subtree.node_count
+            subtree.child_counts[new_index] = child_count
+            for old_child in self.get_children(old_index):
+                new_child = subtree.add_node(new_index, self.moves[old_child], self.probabilities[old_child],
+                                             subtree.depths[new_index] + 1)
+                subtree.cumulative_probabilities[new_child] = self.cumulative_probabilities[old_child]
+                subtree.total_values[new_child] = self.total_values[old_child]
+                subtree.visit_counts[new_child] = self.visit_counts[old_child]
+                subtree.board_states[new_child] = self.board_states[old_child]
+                queue.append((old_child, new_child))
+
+        return subtree
+
+    def count_subtree_nodes(self, index):
+        count = 0
+        stack = [index]
+        while len(stack) > 0:
+            node = stack.pop()
+            count += 1
+            stack.extend(self.get_children(node))
+        return count
+
+    def get_memory_usage(self):
+        # Bytes held by the arrays, allocated capacity included.
+        byte_count = 0
+        for node_array in [self.total_values, self.visit_counts, self.pending_visits, self.probabilities,
+                           self.cumulative_probabilities, self.parents, self.first_children, self.child_counts,
+                           self.moves, self.depths, self.board_states]:
+            byte_count += node_array.itemsize * len(node_array)
+        return byte_count
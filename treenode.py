@@ -1,37 +1,90 @@
+import bisect
 import math
 import random
+from aggro_treenode import get_log_visit_count
+from board_cursor import get_outcome_value
+from game_position import is_white_to_move
+import transposition_table as transposition_tables
+
+
+# Table of the entries transposition-aware searches give the nodes.
+transposition_table = transposition_tables.shared_table
 
 
 class TreeNode:
-    def __init__(self, total_value, visit_count, probability, parent=None, position=[]):
+    # A node only stores the move that leads to it (move, in LAN) and a link to its parent. Its position, the list of
+    # moves made since fen_string (or since the start of the game if there is no FEN), is rebuilt from the root's
+    # position when it is asked for, so nodes don't each keep a copy of the game's move list. Every node of a tree
+    # shares the root's FEN. A root is created with its position; children are created by expansion.
+    __slots__ = ("total_value", "visit_count", "probability", "parent", "children", "cumulative_probabilities",
+                 "move", "root_position", "fen_string", "white_to_move", "board_state_known", "outcome",
+                 "legal_moves", "entry")
+
+    def __init__(self, total_value, visit_count, probability, parent=None, position=None, fen_string="", move=None):
         self.total_value = total_value
         self.visit_count = visit_count
         self.probability = probability
         self.parent = parent
         self.children = []
-        # The position is represented as a list of moves in LAN that have been made.
-        self.position = position
+        # Running sums of the children's probabilities, so a chance node samples a child by bisection.
+        self.cumulative_probabilities = []
+        self.move = move
+        self.fen_string = fen_string
+        if parent is None:
+            self.root_position = list(position) if position is not None else []
+            self.white_to_move = is_white_to_move(self.root_position, fen_string)
+        else:
+            self.root_position = None
+            self.white_to_move = not parent.white_to_move
+
+        # Board state of the position. Computed once, the first time a search asks for it, and then reused.
+        self.board_state_known = False
+        self.outcome = None
+        self.legal_moves = None
+
+        # Shared transposition table entry, only used by transposition-aware searches.
+        self.entry = None
+
+    @property
+    def position(self):
+        moves = []
+        node = self
+        while node.parent is not None:
+            moves.append(node.move)
+            node = node.parent
+        moves.reverse()
+        return node.root_position + moves
 
     def is_own_move(self, is_white):
-        white_to_play = len(self.position) % 2 == 0
         if is_white:
-            return white_to_play
+            return self.white_to_move
         else:
-            return not white_to_play
+            return not self.white_to_move
 
     def add_child(self, child_node):
         self.children.append(child_node)
+        if len(self.cumulative_probabilities) > 0:
+            self.cumulative_probabilities.append(self.cumulative_probabilities[-1] + child_node.probability)
+        else:
+            self.cumulative_probabilities.append(child_node.probability)
 
     def has_children(self):
         return len(self.children) > 0
 
+    def truncate_children(self, width):
+        # Keeps the first width children. The cumulative probabilities are rebuilt from the children left, so they
+        # stay consistent even if the children were reordered.
+        children = self.children[:width]
+        self.children = []
+        self.cumulative_probabilities = []
+        for child in children:
+            self.add_child(child)
+
     def expand_with_probability_distribution(self, probability_distribution):
         # probability_distribution needs to be a list of tuples of the form ('move', probability)
         for entry in probability_distribution:
-            new_node = TreeNode(total_value=0, visit_count=0, probability=entry[1],
-                                parent=self, position=self.position.copy())
-            new_node.position.append(entry[0])
-            self.add_child(new_node)
+            self.add_child(TreeNode(total_value=0, visit_count=0, probability=entry[1], parent=self,
+                                    fen_string=self.fen_string, move=entry[0]))
 
     def get_child_with_highest_uct(self):
         if not self.has_children():
@@ -50,18 +103,57 @@ class TreeNode:
         return highest_uct_child
 
     def get_uct(self):
-        if self.visit_count <= 0:
+        # Transposed nodes share their visit and value statistics through their transposition table entry.
+        if self.entry is not None:
+            entry = transposition_table.lookup(self.entry)
+            visit_count = entry.visit_count
+            total_value = entry.total_value
+        else:
+            visit_count = self.visit_count
+            total_value = self.total_value
+
+        if visit_count <= 0:
             return math.inf
         else:
-            exploitation = self.total_value / self.visit_count
-            exploration = 2 * math.sqrt(math.log(self.parent.visit_count) / self.visit_count)
+            exploitation = total_value / visit_count
+            exploration = 2 * math.sqrt(get_log_visit_count(self.parent.visit_count) / visit_count)
             return self.probability * (exploitation + exploration)
 
+    def get_move(self):
+        # The move that leads to this node.
+        if self.move is None:
+            return self.root_position[len(self.root_position) - 1]
+        return self.move
+
     def get_best_move(self):
         best_child = self.get_highest_value_child()
         if best_child is None:
             return None
-        return best_child.position[len(best_child.position) - 1]
+        return best_child.move
+
+    def load_board_state(self, board_cursor):
+        if self.board_state_known:
+            return
+        board = board_cursor.move_to(self.position)
+        self.outcome = board.outcome(claim_draw=True)
+        self.board_state_known = True
+
+    def is_terminal(self, board_cursor):
+        self.load_board_state(board_cursor)
+        return self.outcome is not None
+
+    def get_result(self, board_cursor, is_white):
+        self.load_board_state(board_cursor)
+        result = get_outcome_value(self.outcome)
+        if not is_white:
+            result = 1.0 - result
+        return result
+
+    def get_legal_moves(self, board_cursor):
+        if self.legal_moves is None:
+            board = board_cursor.move_to(self.position)
+            self.legal_moves = [legal_move.uci() for legal_move in board.legal_moves]
+        return self.legal_moves
 
     def select_child(self, is_white):
         if self.is_own_move(is_white):
@@ -74,15 +166,25 @@ class TreeNode:
         if not self.has_children():
             return None
 
-        random_value = random.random()
-        for child in self.children:
-            if random_value < child.probability:
-                return child
-            else:
-                random_value -= child.probability
+        child_index = bisect.bisect_right(self.cumulative_probabilities, random.random())
 
         # In case no child was selected.
-        return self.children[0]
+        if child_index == len(self.children):
+            return self.children[0]
+        return self.children[child_index]
+
+    def get_most_likely_child(self):
+        if not self.has_children():
+            return None
+
+        most_likely_child = None
+        highest_probability = -math.inf
+        for child in self.children:
+            if child.probability > highest_probability:
+                highest_probability = child.probability
+                most_likely_child = child
+
+        return most_likely_child
 
     def get_highest_value_child(self):
         if not self.has_children():
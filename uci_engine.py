@@ -0,0 +1,316 @@
+import math
+import sys
+import threading
+import chess
+import backends
+import config
+import leaf_evaluators
+import player
+import transposition_table
+from game_position import get_search_position
+from search_clock import SearchLimits
+
+# UCI front-end, so Polecat can be used from chess GUIs, lichess-bot and match runners. Run it with:
+#     python uci_engine.py
+# It plays with the engine selected by player.computer_engine (the Engine option). Searches run in a background
+# thread, so stop and ponderhit are handled while the engine thinks. The aggro, fixed stochastic UCT and expectimax
+# engines follow the clock and send info lines; the other engines search as they do in player.py.
+
+ENGINE_NAME = "Polecat"
+ENGINE_AUTHOR = "the Polecat developers"
+
+# The UCT engines don't search by depth, so "go depth N" gives them N times this many nodes.
+uct_nodes_per_depth = 1000
+
+ENGINE_CHOICES = ["aggro fixed stochastic uct", "fixed stochastic uct", "expectimax", "batched expectimax",
+                  "stochastic uct", "blunder creator", "beam blunder creator", "maia player model", "stockfish",
+                  "leela weights"]
+
+
+def get_centipawns(win_probability):
+    # Leela's conversion from expected outcome to centipawns.
+    win_probability = min(max(win_probability, 0.001), 0.999)
+    expected_outcome = 2.0 * win_probability - 1.0
+    return round(90 * math.tan(1.5637541897 * expected_outcome))
+
+
+class UciEngine:
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+
+        self.board = chess.Board()
+        self.position_valid = True
+
+        self.search_thread = None
+        self.search_limits = None
+        self.stop_event = threading.Event()
+        # Set when an infinite or pondering search may send its best move (stop, or ponderhit when pondering).
+        self.release_event = threading.Event()
+        self.infinite_search = False
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def run(self, input_stream=sys.stdin):
+        for line in input_stream:
+            if not self.handle_command(line.strip()):
+                break
+        self.stop_search()
+
+    def handle_command(self, line):
+        # Returns False when the engine should quit.
+        tokens = line.split()
+        if len(tokens) == 0:
+            return True
+        command = tokens[0]
+
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Engine type combo default " + player.computer_engine + " var "
+                      + " var ".join(ENGINE_CHOICES))
+            self.send("option name OwnMoveCutoff type string default " + str(player.own_move_cutoff))
+            self.send("option name OpponentMoveCutoff type string default " + str(player.opponent_move_cutoff))
+            self.send("option name ExpectimaxLineCutoff type string default " + str(player.expectimax_line_cutoff))
+            self.send("option name BeamDepth type spin default " + str(player.beam_depth) + " min 1 max 8")
+            self.send("option name BeamWidth type spin default " + str(player.beam_width) + " min 1 max 64")
+            self.send("option name BeamReplyMass type string default " + str(player.beam_reply_mass))
+            self.send("option name LeafEvaluator type combo default " + player.leaf_evaluator + " var "
+                      + " var ".join(leaf_evaluators.LEAF_EVALUATOR_CHOICES))
+            self.send("option name MaiaWeightsFile type string default " + config.PATH_TO_PLAYER_MODEL_WEIGHTS_FILE)
+            self.send("option name TreeReuse type check default " + str(player.reuse_search_tree).lower())
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "ucinewgame":
+            self.stop_search()
+            player.aggro_search_session.clear()
+        elif command == "setoption":
+            self.stop_search()
+            self.set_option(tokens[1:])
+        elif command == "position":
+            self.stop_search()
+            self.set_position(tokens[1:])
+        elif command == "go":
+            self.stop_search()
+            self.start_search(tokens[1:])
+        elif command == "stop":
+            self.stop_search()
+        elif command == "ponderhit":
+            if self.search_limits is not None:
+                self.search_limits.ponderhit()
+            if not self.infinite_search:
+                self.release_event.set()
+        elif command == "quit":
+            return False
+        else:
+            self.send("info string Unknown command: " + line)
+
+        return True
+
+    def set_option(self, tokens):
+        # setoption name <name> [value <value>]; names and values may contain spaces.
+        if len(tokens) < 2 or tokens[0] != "name":
+            return
+        if "value" in tokens:
+            value_index = tokens.index("value")
+            name = " ".join(tokens[1:value_index])
+            value = " ".join(tokens[value_index + 1:])
+        else:
+            name = " ".join(tokens[1:])
+            value = ""
+
+        try:
+            if name == "Engine":
+                if value not in ENGINE_CHOICES:
+                    raise ValueError("unknown engine " + value)
+                player.computer_engine = value
+            elif name == "OwnMoveCutoff":
+                player.own_move_cutoff = float(value)
+            elif name == "OpponentMoveCutoff":
+                player.opponent_move_cutoff = float(value)
+            elif name == "ExpectimaxLineCutoff":
+                player.expectimax_line_cutoff = float(value)
+            elif name == "BeamDepth":
+                player.beam_depth = int(value)
+            elif name == "BeamWidth":
+                player.beam_width = int(value)
+            elif name == "BeamReplyMass":
+                player.beam_reply_mass = float(value)
+            elif name == "LeafEvaluator":
+                player.set_leaf_evaluator(value)
+            elif name == "MaiaWeightsFile":
+                backends.player_model_evaluator.set_path_to_weights(value)
+                # Maia's predictions are cached in the search tree and the transposition table too.
+                player.aggro_search_session.clear()
+                transposition_table.shared_table.clear()
+            elif name == "TreeReuse":
+                player.reuse_search_tree = value == "true"
+                player.aggro_search_session.clear()
+            elif name == "Ponder":
+                # Pondering is driven by the GUI's go ponder commands.
+                pass
+            else:
+                self.send("info string Unknown option: " + name)
+        except ValueError as error:
+            self.send("info string Invalid value for " + name + ": " + str(error))
+
+    def set_position(self, tokens):
+        # position startpos [moves ...] or position fen <fen> [moves ...]
+        self.board = chess.Board()
+        self.position_valid = True
+
+        if "moves" in tokens:
+            moves = tokens[tokens.index("moves") + 1:]
+            tokens = tokens[:tokens.index("moves")]
+        else:
+            moves = []
+
+        if len(tokens) > 0 and tokens[0] == "fen":
+            fen_string = " ".join(tokens[1:])
+            try:
+                self.board = chess.Board(fen_string)
+            except ValueError:
+                self.board = None
+            if self.board is None or not self.board.is_valid():
+                self.send("info string Invalid FEN " + fen_string)
+                self.board = chess.Board()
+                self.position_valid = False
+                return
+
+        for move in moves:
+            try:
+                self.board.push_uci(move)
+            except ValueError:
+                self.send("info string Illegal move " + move)
+                self.position_valid = False
+                return
+
+    def start_search(self, tokens):
+        parameters = {}
+        flags = []
+        index = 0
+        while index < len(tokens):
+            if tokens[index] in ["infinite", "ponder"]:
+                flags.append(tokens[index])
+                index += 1
+            elif tokens[index] == "searchmoves":
+                # Not supported; skip the moves.
+                index = len(tokens)
+            else:
+                if index + 1 < len(tokens):
+                    parameters[tokens[index]] = tokens[index + 1]
+                index += 2
+
+        white_to_move = self.board.turn == chess.WHITE
+        time_left = parameters.get("wtime" if white_to_move else "btime")
+        increment = parameters.get("winc" if white_to_move else "binc", "0")
+        move_time = parameters.get("movetime")
+
+        self.infinite_search = "infinite" in flags
+        self.stop_event = threading.Event()
+        self.release_event = threading.Event()
+        depth = int(parameters["depth"]) if "depth" in parameters else None
+        nodes_limit = int(parameters["nodes"]) if "nodes" in parameters else None
+        if nodes_limit is None and move_time is None and time_left is None and len(flags) == 0:
+            nodes_limit = get_uct_nodes_limit(depth)
+
+        self.search_limits = SearchLimits(
+            move_time=float(move_time) / 1000 if move_time is not None else None,
+            time_left=float(time_left) / 1000 if time_left is not None and not self.infinite_search else None,
+            increment=float(increment) / 1000,
+            moves_to_go=int(parameters["movestogo"]) if "movestogo" in parameters else None,
+            nodes_limit=nodes_limit,
+            depth=depth,
+            stop_event=self.stop_event,
+            pondering="ponder" in flags,
+            info_callback=self.send_info)
+        if not self.infinite_search and "ponder" not in flags:
+            self.release_event.set()
+
+        self.search_thread = threading.Thread(target=self.search, args=(self.board.copy(), self.search_limits),
+                                              daemon=True)
+        self.search_thread.start()
+
+    def search(self, board, search_limits):
+        best_move = None
+        if self.position_valid and board.outcome() is None:
+            try:
+                best_move = player.get_computer_move(board, search_limits)
+            except Exception as error:
+                self.send("info string Search failed: " + repr(error))
+
+        # Infinite and pondering searches only answer once the GUI says so.
+        self.release_event.wait()
+
+        if best_move is None:
+            self.send("bestmove 0000")
+            return
+
+        ponder_move = self.get_ponder_move(board, best_move)
+        if ponder_move is None:
+            self.send("bestmove " + best_move)
+        else:
+            self.send("bestmove " + best_move + " ponder " + ponder_move)
+
+    def get_ponder_move(self, board, best_move):
+        # The reply Maia expects most, from the aggro search tree if it is kept between moves.
+        if player.computer_engine != "aggro fixed stochastic uct" or not player.reuse_search_tree:
+            return None
+        root_node = player.aggro_search_session.root_node
+        fen_string, position = get_search_position(board)
+        if root_node is None or root_node.fen_string != fen_string or root_node.position != position:
+            return None
+        own_move_node = root_node.get_child_with_move(best_move)
+        if own_move_node is None:
+            return None
+        reply_node = own_move_node.get_most_likely_child()
+        if reply_node is None:
+            return None
+        return reply_node.get_move()
+
+    def send_info(self, search_clock, win_probability, principal_variation, depth):
+        # The UCT engines have no search depth, only the length of their principal variation, which is the deepest
+        # line searched.
+        if depth is None:
+            line = "info seldepth " + str(max(1, len(principal_variation)))
+        else:
+            line = "info depth " + str(depth)
+
+        line += " nodes " + str(search_clock.node_count) + " nps " \
+            + str(round(search_clock.get_nodes_per_second())) + " time " \
+            + str(round(search_clock.get_elapsed_time() * 1000))
+        if win_probability is not None:
+            line += " score cp " + str(get_centipawns(win_probability))
+        if len(principal_variation) > 0:
+            line += " pv " + " ".join(principal_variation)
+        self.send(line)
+
+    def stop_search(self):
+        if self.search_thread is None:
+            return
+        self.stop_event.set()
+        self.release_event.set()
+        self.search_thread.join()
+        self.search_thread = None
+        self.search_limits = None
+
+
+def get_uct_nodes_limit(depth):
+    # Node budget of a "go" with no time or node limit, which would otherwise never end for the UCT engines: the
+    # engine's usual node count, or uct_nodes_per_depth nodes per ply of a "go depth". Other engines keep searching
+    # as they would without a limit.
+    if player.computer_engine not in player.uct_nodes_limits:
+        return None
+    if depth is None:
+        return player.uct_nodes_limits[player.computer_engine]
+    return depth * uct_nodes_per_depth
+
+
+if __name__ == "__main__":
+    UciEngine().run()